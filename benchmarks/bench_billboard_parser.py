@@ -0,0 +1,80 @@
+"""
+Benchmarks the streaming Billboard parser against the BeautifulSoup parser on saved chart pages.
+
+Usage:
+python benchmarks/bench_billboard_parser.py [saved_page.html ...] [--repeat N]
+
+Save pages with e.g. curl -o hot-100-1985-07-13.html https://www.billboard.com/charts/hot-100/1985-07-13/
+With no pages a synthetic page shaped like the Hot 100 is used.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billboard_parser import parse_top_song_stream, parse_top_song_soup, STREAM_CHUNK_SIZE
+
+
+def synthetic_page(entries=100, padding=4000):
+    """builds a page with the same list structure as the Hot 100, padded to roughly the real page size"""
+    filler = '<div class="lrv-u-display-none">' + 'x' * padding + '</div>'
+    rows = []
+    for rank in range(1, entries + 1):
+        rows.append(
+            '<ul class="o-chart-results-list-row">'
+            f'<li class="o-chart-results-list__item"><span class="c-label">{rank}</span></li>'
+            '<li class="o-chart-results-list__item"><span>image</span></li>'
+            '<li class="lrv-u-width-100p"><ul>'
+            '<li class="o-chart-results-list__item lrv-u-flex-grow-1">'
+            f'<h3 id="title-of-a-story" class="c-title a-no-trucate">\n\n\t\tSong {rank}\t\n</h3>'
+            f'<span class="c-label a-no-trucate">\n\t\tArtist {rank}\n</span>'
+            f'</li></ul></li></ul>{filler}')
+    # the real page has one chart list item above the chart itself
+    head = ('<html><head>' + '<script>var x = 1;</script>' * 200 + '</head><body>'
+            '<li class="o-chart-results-list__item">week of</li>')
+    return (head + ''.join(rows) + '</body></html>').encode('utf-8')
+
+
+def chunked(page):
+    for start in range(0, len(page), STREAM_CHUNK_SIZE):
+        yield page[start:start + STREAM_CHUNK_SIZE]
+
+
+def bench(name, function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'  {name:<8} {elapsed * 1000:9.2f} ms/page  result: {result}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', help='saved Billboard chart pages')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = [(path, open(path, 'rb').read()) for path in args.pages] or [('synthetic', synthetic_page())]
+    for name, page in pages:
+        print(f'{name}: {len(page)} bytes')
+        stream_result = {}
+
+        def run_stream():
+            song_data, bytes_read = parse_top_song_stream(chunked(page))
+            stream_result['bytes_read'] = bytes_read
+            return song_data
+
+        stream_time = bench('stream', run_stream, args.repeat)
+        print(f"  stream read {stream_result['bytes_read']} of {len(page)} bytes")
+        try:
+            soup_time = bench('soup', lambda: parse_top_song_soup(page.decode('utf-8')), args.repeat)
+            print(f'  stream is {soup_time / stream_time:.1f}x faster')
+        except ImportError:
+            print('  soup     skipped, beautifulsoup4 is not installed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Measures the cold start of each lambda handler: how long its module takes to import, how long the
+first invocation takes and how long a warm one takes after it.
+
+Each handler runs in a fresh python process, so nothing is already imported, against the fake upstream
+with the same environment as load_test.py. It also reports which heavy dependencies were loaded by the
+import and by the first invocation, they should only appear on the paths that use them.
+
+Usage:
+python benchmarks/bench_cold_start.py [--handlers news,weather,nasa,song,text,reply,birthday,spotify]
+                                      [--repeat 5] [--max-import-ms 250]
+
+The reply_nuked_by_elon handlers keep their state in DynamoDB, which moto stands in for when it is
+installed. Its tables are created after the import is timed and before the first invocation.
+
+With --max-import-ms the exit status is 1 if any handler's median import time is over the limit,
+so it can run as a check for cold start regressions.
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'reply_nuked_by_elon'))
+
+# handler name -> (module, event it is invoked with, DynamoDB tables it needs)
+HANDLERS = {
+    'news': ('tweet_news', {}, []),
+    'weather': ('tweet_weather', {}, []),
+    'nasa': ('tweet_nasa_img', {}, []),
+    'song': ('tweet_number_1_song', {}, []),
+    'text': ('tweet_text', {'message': 'cold start benchmark'}, []),
+    'reply': ('reply_to_tweets', {}, ['MentionState', 'Birthdays']),
+    'birthday': ('birthday_wisher', {}, ['Birthdays']),
+    'spotify': ('spotify_song', {'date': '2001-01-01'}, []),
+}
+
+# table name -> create_table arguments other than the name
+TABLES = {
+    'MentionState': {
+        'KeySchema': [{'AttributeName': 'key', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'key', 'AttributeType': 'S'}],
+    },
+    'Birthdays': {
+        'KeySchema': [{'AttributeName': 'username', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'username', 'AttributeType': 'S'},
+                                 {'AttributeName': 'birthday_md', 'AttributeType': 'S'}],
+        'GlobalSecondaryIndexes': [{
+            'IndexName': 'birthday_md-index',
+            'KeySchema': [{'AttributeName': 'birthday_md', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+    },
+}
+
+HEAVY_MODULES = ['boto3', 'botocore', 'spotipy', 'requests_oauthlib', 'bs4', 'PIL']
+
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def start_fake_dynamodb(tables):
+    """creates the tables in moto, returns False if moto isn't installed and the handler will fail"""
+    try:
+        from moto import mock_aws
+    except ImportError:
+        return False
+    import boto3
+
+    mock_aws().start()
+    dynamodb = boto3.resource('dynamodb')
+    for table in tables:
+        dynamodb.create_table(TableName=table, BillingMode='PAY_PER_REQUEST', **TABLES[table])
+    return True
+
+
+def measure_in_process(name, upstream_url, cache_dir):
+    """
+    Imports and invokes one handler, meant to run in a fresh process.
+
+    Returns:
+    dict: Import, first and warm invocation times in ms and the heavy modules loaded by each step
+    """
+    from load_test import configure_environment
+
+    configure_environment(cache_dir, no_cache=False)
+    os.environ['HTTP_UPSTREAM_URL'] = upstream_url
+    module_name, event, tables = HANDLERS[name]
+    if tables:
+        os.environ.update({'TWITTER_USER_ID': '1000', 'AWS_DEFAULT_REGION': 'us-east-1',
+                           'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                           'AWS_EC2_METADATA_DISABLED': 'true'})
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+    imported = loaded_heavy_modules()
+    if tables and not start_fake_dynamodb(tables):
+        print(f'moto is not installed, {name} has no DynamoDB to use', file=sys.stderr)
+
+    start = time.perf_counter()
+    status = module.lambda_handler(dict(event), None).get('statusCode')
+    first_ms = (time.perf_counter() - start) * 1000
+    invoked = loaded_heavy_modules()
+
+    start = time.perf_counter()
+    module.lambda_handler(dict(event), None)
+    warm_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'handler': name,
+        'import_ms': import_ms,
+        'first_ms': first_ms,
+        'warm_ms': warm_ms,
+        'status': status,
+        'imported': imported,
+        'invoked': [module for module in invoked if module not in imported],
+    }
+
+
+def measure(name, upstream_url):
+    """runs measure_in_process for one handler in a fresh python process with its own caches"""
+    with tempfile.TemporaryDirectory(prefix='twitter_bot_cold_start_') as cache_dir:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name,
+             '--upstream', upstream_url, '--cache-dir', cache_dir],
+            check=True, capture_output=True, text=True, cwd=cache_dir,  # spotipy writes its token .cache to cwd
+        ).stdout
+    # the handlers may log to stdout, the result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', default=','.join(HANDLERS), help=f'comma separated, any of {list(HANDLERS)}')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh processes per handler, medians are reported')
+    parser.add_argument('--max-import-ms', type=float, help='exit with status 1 if a median import time is over this')
+    parser.add_argument('--upstream', help='url of an already running fake upstream, one is started otherwise')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_in_process(args.child, args.upstream, args.cache_dir)))
+        return
+
+    upstream_url = args.upstream
+    if not upstream_url:
+        from fake_upstream import FakeUpstream, start_server
+        server, upstream_url = start_server(FakeUpstream(seed=1))
+
+    print(f"{'handler':<8} {'import ms':>10} {'first ms':>10} {'warm ms':>10}  loaded on import / on first call")
+    over_limit = []
+    for name in args.handlers.split(','):
+        runs = [measure(name, upstream_url) for _ in range(args.repeat)]
+        import_ms, first_ms, warm_ms = (statistics.median(run[key] for run in runs)
+                                        for key in ('import_ms', 'first_ms', 'warm_ms'))
+        statuses = sorted({str(run['status']) for run in runs})
+        print(f"{name:<8} {import_ms:>10.1f} {first_ms:>10.1f} {warm_ms:>10.1f}  "
+              f"{runs[-1]['imported'] or '-'} / {runs[-1]['invoked'] or '-'}  status {','.join(statuses)}")
+        if args.max_import_ms is not None and import_ms > args.max_import_ms:
+            over_limit.append(name)
+
+    if over_limit:
+        print(f'import time over {args.max_import_ms} ms: {", ".join(over_limit)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmarks rendering messages from the precompiled templates against building every option with f-strings.
+
+Usage:
+python benchmarks/bench_message_templates.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import time
+from random import choice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_templates import render, get_templates
+
+
+def legacy_news_message(news_topic, title, url):
+    """the way write_news_message built its message before the templates, every option rendered then one chosen"""
+    article_string = f"\n{title}\n{url}"
+    message_options = [
+        f"some fascinating {news_topic} news:{article_string}",
+        f"wow look at this {news_topic} news:{article_string}",
+        f"interesting developments in the {news_topic} world, read about it here: {article_string}",
+        f"never a dull moment in {news_topic}. {article_string}",
+        f"{news_topic} news that has peaked my interest: {article_string}",
+        f"can't believe this {news_topic} news. {article_string}",
+        f"seen this {news_topic} news coming a mile off. {article_string}",
+        f"been waiting a long time for {news_topic} news like this. {article_string}",
+        f"{news_topic}! {news_topic}! read all about it!! {article_string}",
+        f"Intriguing update in the {news_topic} scene:{article_string}",
+        f"Shaking up the {news_topic} world with this: {article_string}",
+        f"Keep an eye on this unfolding {news_topic} story: {article_string}",
+        f"A must-read {news_topic} update: {article_string}",
+        f"Hot off the press, {news_topic} news. {article_string}",
+        f"In case you missed this {news_topic} news. {article_string}"
+    ]
+    return choice(message_options)
+
+
+def bench(name, function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28} {iterations / elapsed:12,.0f} renders/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    title = 'Scientists discover a new species of deep sea fish off the coast of New Zealand'
+    long_title = title * 5
+    url = 'https://www.example.com/science/2023/10/18/new-deep-sea-fish'
+
+    start = time.perf_counter()
+    get_templates('news')
+    print(f'compiling news templates took {(time.perf_counter() - start) * 1000:.3f} ms (once per container)')
+
+    bench('legacy f-string options', lambda: legacy_news_message('science', title, url), args.iterations)
+    bench('template', lambda: render('news', topic='science', title=title, url=url), args.iterations)
+    bench('template, truncated title', lambda: render('news', topic='science', title=long_title, url=url),
+          args.iterations)
+
+
+if __name__ == '__main__':
+    main()
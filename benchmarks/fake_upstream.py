@@ -0,0 +1,292 @@
+"""
+Local stand-in for the services the bots call, for offline load testing.
+
+Run it and point the bots at it with HTTP_UPSTREAM_URL (see http_transport), every request then
+arrives here with its real host in the X-Upstream-Host header and is answered with a response shaped
+like the real NewsAPI, OpenWeatherMap, APOD, Billboard, Spotify or Twitter one.
+
+Usage:
+python benchmarks/fake_upstream.py [--port 8080] [--latency 50] [--jitter 20] [--error-rate 0.01]
+                                   [--recordings DIR]
+
+Recorded responses take priority over the built in ones. Each is a json file in --recordings:
+{"host": "newsapi.org", "method": "GET", "path": "/v2/top-headlines", "status": 200,
+ "headers": {...}, "body": <json or string>}
+GET /__stats on the server returns the number of requests and injected errors per host.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_transport import UPSTREAM_HOST_HEADER
+from bench_billboard_parser import synthetic_page
+
+CATEGORIES = ['business', 'entertainment', 'health', 'science', 'sports', 'technology']
+WEATHER_TYPES = ['Clear', 'Clouds', 'Rain', 'Drizzle', 'Snow', 'Thunderstorm']
+
+
+def fake_jpeg(width, height, size):
+    """a JPEG header with the given dimensions padded to size bytes, enough for anything that doesn't decode it"""
+    header = (b'\xff\xd8\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+              + b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+    return header + b'\x00' * max(0, size - len(header) - 2) + b'\xff\xd9'
+
+
+class FakeUpstream:
+    """
+    The responses of the fake services, keyed on (host, method, path prefix). Ids, urls and dates
+    come from counters so deduplication in the bots never runs out of new content.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, image_bytes=512 * 1024, recordings=None, seed=None):
+        """
+        Parameters:
+        latency (float): Mean seconds added to every response
+        jitter (float): Responses are delayed by latency +/- up to jitter seconds
+        error_rate (float): Fraction of requests answered with a 503
+        image_bytes (int): Size of the APOD images served
+        recordings (str): Optional directory of recorded responses
+        seed (int): Optional seed for the latency and error injection
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.counter = itertools.count(1)
+        self.stats = {}
+        self._lock = threading.Lock()
+        self.image = fake_jpeg(2048, 1365, image_bytes)
+        self.image_etag = '"' + hashlib.sha256(self.image).hexdigest()[:16] + '"'
+        self.billboard_page = synthetic_page()
+        self.recordings = self.load_recordings(recordings) if recordings else []
+        self.routes = [
+            ('newsapi.org', 'GET', '/v2/top-headlines', self.news),
+            ('api.openweathermap.org', 'GET', '/data/2.5/onecall', self.weather),
+            ('api.nasa.gov', 'GET', '/planetary/apod', self.apod),
+            ('apod.nasa.gov', 'GET', '/apod/image/', self.apod_image),
+            ('www.billboard.com', 'GET', '/charts/hot-100/', self.billboard),
+            ('accounts.spotify.com', 'POST', '/api/token', self.spotify_token),
+            ('api.spotify.com', 'GET', '/v1/search', self.spotify_search),
+            ('api.twitter.com', 'POST', '/2/tweets', self.tweet),
+            ('api.twitter.com', 'GET', '/2/users/', self.mentions),
+            ('upload.twitter.com', 'POST', '/1.1/media/upload.json', self.media_upload),
+            ('upload.twitter.com', 'GET', '/1.1/media/upload.json', self.media_status),
+        ]
+
+    @staticmethod
+    def load_recordings(directory):
+        recordings = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as recording_file:
+                    recordings.append(json.load(recording_file))
+        return recordings
+
+    def count(self, host, name):
+        with self._lock:
+            host_stats = self.stats.setdefault(host, {'requests': 0, 'errors': 0})
+            host_stats[name] += 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+    def respond(self, host, method, path, query, headers, body):
+        """
+        Works out the response to a request.
+
+        Returns:
+        tuple: (status, headers dict, body bytes)
+        """
+        self.count(host, 'requests')
+        self.delay()
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count(host, 'errors')
+            return 503, {'content-type': 'application/json'}, b'{"error": "injected failure"}'
+
+        for recording in self.recordings:
+            if recording['host'] == host and recording.get('method', 'GET') == method \
+                    and path.startswith(recording['path']):
+                recorded = recording.get('body', '')
+                recorded = recorded.encode('utf-8') if isinstance(recorded, str) else json.dumps(recorded).encode()
+                return recording.get('status', 200), recording.get('headers', {}), recorded
+
+        for route_host, route_method, prefix, handler in self.routes:
+            if route_host == host and route_method == method and path.startswith(prefix):
+                return handler(path, query, headers, body)
+        return 404, {'content-type': 'application/json'}, json.dumps({'error': f'no fake for {method} {host}{path}'}).encode()
+
+    @staticmethod
+    def json_response(data, status=200, headers=None):
+        return status, dict({'content-type': 'application/json; charset=utf-8'}, **(headers or {})), json.dumps(data).encode()
+
+    @staticmethod
+    def rate_limit_headers(limit=300):
+        return {'x-rate-limit-limit': str(limit), 'x-rate-limit-remaining': str(limit - 1),
+                'x-rate-limit-reset': str(int(time.time()) + 900)}
+
+    def news(self, path, query, headers, body):
+        category = query.get('category', ['general'])[0]
+        batch = next(self.counter)
+        page_size = int(query.get('pageSize', ['20'])[0])
+        articles = [{
+            'source': {'id': None, 'name': 'Fake News'},
+            'title': f'{category.title()} story {batch}-{i}: something happened today',
+            'url': f'https://news.example.com/{category}/{batch}/{i}',
+            'publishedAt': '2024-01-01T00:00:00Z',
+        } for i in range(page_size)]
+        return self.json_response({'status': 'ok', 'totalResults': len(articles), 'articles': articles})
+
+    def weather(self, path, query, headers, body):
+        daily = [{
+            'dt': int(time.time()) + day * 86400,
+            'temp': {'day': round(self.random.uniform(-5, 30), 2)},
+            'weather': [{'main': self.random.choice(WEATHER_TYPES)}],
+        } for day in range(8)]
+        return self.json_response({'lat': float(query['lat'][0]), 'lon': float(query['lon'][0]), 'daily': daily})
+
+    def apod(self, path, query, headers, body):
+        # a different day every request so the seen index never stops the bot early
+        n = next(self.counter)
+        apod_date = (date(2024, 1, 1) - timedelta(days=n)).isoformat()
+        image_url = f'https://apod.nasa.gov/apod/image/fake_{n}.jpg'
+        return self.json_response({
+            'date': apod_date, 'title': f'Fake nebula number {n}', 'media_type': 'image',
+            'url': image_url, 'hdurl': image_url, 'explanation': 'A picture of space.',
+        })
+
+    def apod_image(self, path, query, headers, body):
+        if headers.get('if-none-match') == self.image_etag:
+            return 304, {'etag': self.image_etag}, b''
+        return 200, {'content-type': 'image/jpeg', 'etag': self.image_etag}, self.image
+
+    def billboard(self, path, query, headers, body):
+        return 200, {'content-type': 'text/html; charset=utf-8'}, self.billboard_page
+
+    def spotify_token(self, path, query, headers, body):
+        return self.json_response({'access_token': 'fake-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def spotify_search(self, path, query, headers, body):
+        track_id = hashlib.sha256(query.get('q', [''])[0].encode()).hexdigest()[:22]
+        return self.json_response({'tracks': {'items': [{
+            'uri': f'spotify:track:{track_id}',
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+        }]}})
+
+    def tweet(self, path, query, headers, body):
+        text = json.loads(body or b'{}').get('text', '')
+        return self.json_response({'data': {'id': str(10 ** 18 + next(self.counter)), 'text': text}},
+                                  status=201, headers=self.rate_limit_headers(200))
+
+    def mentions(self, path, query, headers, body):
+        # a few new mentions every poll, newest first and all after since_id
+        since_id = int(query.get('since_id', [str(10 ** 18)])[0])
+        ids = [since_id + next(self.counter) for _ in range(3)][::-1]
+        data = [{'id': str(mention_id), 'text': '@bot hello', 'author_id': '7'} for mention_id in ids]
+        return self.json_response({
+            'data': data, 'includes': {'users': [{'id': '7', 'username': 'someone'}]},
+            'meta': {'result_count': len(data), 'newest_id': str(ids[0]), 'oldest_id': str(ids[-1])},
+        }, headers=self.rate_limit_headers(450))
+
+    def media_upload(self, path, query, headers, body):
+        if headers.get('content-type', '').startswith('multipart/'):
+            return 204, {}, b''  # APPEND
+        form = {name: values[0] for name, values in parse_qs(body.decode('utf-8')).items()}
+        if form.get('command') == 'INIT':
+            return self.json_response({'media_id_string': str(10 ** 17 + next(self.counter)), 'expires_after_secs': 86400})
+        return self.json_response({'media_id_string': form.get('media_id'), 'size': len(self.image)})
+
+    def media_status(self, path, query, headers, body):
+        return self.json_response({'media_id_string': query.get('media_id', [''])[0],
+                                   'processing_info': {'state': 'succeeded'}})
+
+
+def make_handler(upstream):
+    class FakeUpstreamHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_request(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('content-length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if url.path == '/__stats':
+                status, headers, response_body = FakeUpstream.json_response(upstream.stats)
+            else:
+                host = self.headers.get(UPSTREAM_HOST_HEADER) or self.headers.get('host', '')
+                request_headers = {name.lower(): value for name, value in self.headers.items()}
+                status, headers, response_body = upstream.respond(
+                    host, self.command, url.path, parse_qs(url.query), request_headers, body)
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('content-length', str(len(response_body)))
+            self.end_headers()
+            self.wfile.write(response_body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeUpstreamHandler
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients like the streaming billboard parser hang up part way through a response on purpose
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_server(upstream, host='127.0.0.1', port=0):
+    """
+    Starts the fake upstream on a background thread.
+
+    Returns:
+    tuple: (the server, its base url)
+    """
+    server = FakeUpstreamServer((host, port), make_handler(upstream))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='mean milliseconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds the latency varies by either way')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 503')
+    parser.add_argument('--image-bytes', type=int, default=512 * 1024)
+    parser.add_argument('--recordings', help='directory of recorded responses')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency / 1000, args.jitter / 1000, args.error_rate, args.image_bytes,
+                            args.recordings, args.seed)
+    server, url = start_server(upstream, args.host, args.port)
+    print(f'fake upstream listening on {url}, run the bots with HTTP_UPSTREAM_URL={url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
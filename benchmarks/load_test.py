@@ -0,0 +1,155 @@
+"""
+Offline load test of the bots' lambda handlers against the fake upstream.
+
+Starts benchmarks/fake_upstream.py in process (or uses --upstream), points every http request at it
+through HTTP_UPSTREAM_URL, posts tweets in process (TWEET_TRANSPORT=inprocess) and keeps every cache
+in a temporary directory. Each handler is invoked --requests times, --concurrency at a time, and the
+throughput, latency percentiles and status codes are reported.
+
+Usage:
+python benchmarks/load_test.py [--bots news,weather,nasa,song] [--requests 50] [--concurrency 4]
+                               [--latency 50] [--jitter 20] [--error-rate 0.01] [--no-cache]
+                               [--trace spans.log]
+
+With --trace every stage is timed (see tracing) into the file and a per stage breakdown is printed.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOTS = {
+    'news': 'tweet_news',
+    'weather': 'tweet_weather',
+    'nasa': 'tweet_nasa_img',
+    'song': 'tweet_number_1_song',
+}
+
+
+def configure_environment(cache_dir, no_cache):
+    """sets the environment the bot modules read when they are imported, so must run before any are imported"""
+    environ = {
+        'TWEET_TRANSPORT': 'inprocess',
+        'HTTP_CACHE_PATH': os.path.join(cache_dir, 'http_cache.sqlite3'),
+        'NEWS_POOL_PATH': os.path.join(cache_dir, 'news_pool.sqlite3'),
+        'SEEN_INDEX_PATH': os.path.join(cache_dir, 'seen_index.sqlite3'),
+        'SPOTIFY_CACHE_PATH': os.path.join(cache_dir, 'spotify_cache.sqlite3'),
+        'BILLBOARD_INDEX_PATH': os.path.join(cache_dir, 'billboard_index.tsv'),
+        'OUTBOX_PATH': os.path.join(cache_dir, 'tweet_outbox.sqlite3'),
+        'NASA_IMAGE_CACHE_DIR': os.path.join(cache_dir, 'nasa_images'),
+        'MEDIA_STORE_DIR': os.path.join(cache_dir, 'media'),
+        'TWITTER_API_KEY': 'key', 'TWITTER_API_SECRET': 'secret',
+        'TWITTER_API_ACCESS_TOKEN': 'token', 'TWITTER_API_ACCESS_TOKEN_SECRET': 'token-secret',
+        'NEWS_API_KEY': 'key', 'WEATHER_API_KEY': 'key', 'NASA_API_KEY': 'key',
+        'SPOTIFY_CID': 'cid', 'SPOTIFY_SECRET': 'secret',
+    }
+    if no_cache:
+        # every invocation goes all the way upstream
+        environ.update({
+            'NEWS_MODE': 'single', 'WEATHER_CACHE_MAX_AGE': '0', 'NASA_APOD_MAX_AGE': '0',
+            'SPOTIFY_CACHE_TTL': '0', 'SPOTIFY_CACHE_NEGATIVE_TTL': '0',
+        })
+    os.environ.pop('MEDIA_STORE_BUCKET', None)
+    os.environ.update(environ)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run_bot(name, handler, requests, concurrency):
+    """
+    Invokes a handler requests times, concurrency at a time.
+
+    Returns:
+    dict: Throughput, latency percentiles in ms and the count of each status code
+    """
+    def invoke(_):
+        start = time.perf_counter()
+        try:
+            status = handler({}, None).get('statusCode')
+        except Exception:
+            status = 'exception'
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(invoke, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for status, latency in results]
+    statuses = {}
+    for status, latency in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'bot': name,
+        'requests': requests,
+        'throughput': round(requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bots', default=','.join(BOTS), help=f'comma separated, any of {list(BOTS)}')
+    parser.add_argument('--requests', type=int, default=50, help='invocations of each handler')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=20, help='mean milliseconds added to upstream responses')
+    parser.add_argument('--jitter', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--upstream', help='url of an already running fake upstream, one is started otherwise')
+    parser.add_argument('--no-cache', action='store_true', help='turn off the caches so every run goes upstream')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace', help='file the stage timings are written to, tracing is off without it')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='twitter_bot_load_test_')
+    configure_environment(cache_dir, args.no_cache)
+    if args.trace:
+        os.environ.update({'TRACING_ENABLED': 'true', 'TRACING_PATH': os.path.abspath(args.trace)})
+
+    # the fake upstream imports bot modules itself, so only once the environment is set
+    from fake_upstream import FakeUpstream, start_server
+
+    upstream = None
+    if args.upstream:
+        upstream_url = args.upstream
+    else:
+        upstream = FakeUpstream(args.latency / 1000, args.jitter / 1000, args.error_rate, seed=args.seed)
+        server, upstream_url = start_server(upstream)
+    # read when the sessions are first built, which is after this
+    os.environ['HTTP_UPSTREAM_URL'] = upstream_url
+    handlers = {name: importlib.import_module(BOTS[name]).lambda_handler for name in args.bots.split(',')}
+    # the bots set INFO on the root logger, some only when first called, keep the output readable
+    logging.disable(logging.CRITICAL)
+
+    print(f'upstream: {upstream_url}, caches: {cache_dir}')
+    print(f"{'bot':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for name, handler in handlers.items():
+        result = run_bot(name, handler, args.requests, args.concurrency)
+        print(f"{name:<8} {result['throughput']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+              f"{result['p99_ms']:>8} {result['max_ms']:>8}  {result['statuses']}")
+
+    if upstream:
+        print(f'upstream requests: {json.dumps(upstream.stats)}')
+
+    if args.trace:
+        from trace_report import read_spans, summarise, format_table
+        with open(args.trace) as trace_file:
+            print(format_table(summarise(read_spans(trace_file))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Summarises the spans written by tracing: count, errors, latency percentiles and bytes per stage.
+
+Reads log files holding the EMF json lines, e.g. the TRACING_PATH file of a load test run or logs
+exported from CloudWatch. Anything before the json on a line (timestamps, request ids) and lines that
+are not spans are skipped.
+
+Usage:
+python benchmarks/trace_report.py spans.log [more.log ...] [--by Stage,source,host,kind] [--json]
+
+With no files the lines are read from stdin.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import percentile
+
+DEFAULT_GROUP_BY = ('Stage', 'source', 'host', 'kind')
+
+
+def read_spans(lines):
+    """yields the span records found in lines of log output"""
+    for line in lines:
+        start = line.find('{')
+        if start == -1:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(record, dict) and '_aws' in record and 'Stage' in record:
+            yield record
+
+
+def summarise(spans, group_by=DEFAULT_GROUP_BY):
+    """
+    Groups spans on the group_by fields and works out each group's statistics.
+
+    Parameters:
+    spans (iterable): Span records, see read_spans
+    group_by (tuple): Record fields to group on, a record without a field is grouped under '-'
+
+    Returns:
+    list: A dict per group with the group's fields, 'count', 'errors', 'p50_ms', 'p95_ms', 'p99_ms',
+          'max_ms' and 'bytes', busiest group first
+    """
+    groups = {}
+    for record in spans:
+        key = tuple(str(record.get(field, '-')) for field in group_by)
+        group = groups.setdefault(key, {'durations': [], 'errors': 0, 'bytes': 0})
+        group['durations'].append(record['Duration'])
+        group['errors'] += record.get('status') == 'error'
+        group['bytes'] += record.get('Bytes') or 0
+
+    summary = []
+    for key, group in groups.items():
+        durations = group['durations']
+        summary.append(dict(zip(group_by, key), **{
+            'count': len(durations),
+            'errors': group['errors'],
+            'p50_ms': round(percentile(durations, 0.50), 1),
+            'p95_ms': round(percentile(durations, 0.95), 1),
+            'p99_ms': round(percentile(durations, 0.99), 1),
+            'max_ms': round(max(durations), 1),
+            'bytes': group['bytes'],
+        }))
+    summary.sort(key=lambda row: (-row['count'], [row[field] for field in group_by]))
+    return summary
+
+
+def format_table(summary, group_by=DEFAULT_GROUP_BY):
+    """returns the summary as a text table"""
+    lines = [f"{' / '.join(group_by):<48} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+             f"{'p99 ms':>8} {'max ms':>8} {'bytes':>12}"]
+    for row in summary:
+        group = ' / '.join(row[field] for field in group_by)
+        lines.append(f"{group:<48} {row['count']:>7} {row['errors']:>7} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                     f"{row['p99_ms']:>8} {row['max_ms']:>8} {row['bytes']:>12}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='log files, stdin when none are given')
+    parser.add_argument('--by', default=','.join(DEFAULT_GROUP_BY), help='comma separated record fields to group on')
+    parser.add_argument('--json', action='store_true', help='print the summary as json')
+    args = parser.parse_args()
+
+    group_by = args.by.split(',')
+    spans = []
+    for path in args.files:
+        with open(path) as log_file:
+            spans.extend(read_spans(log_file))
+    if not args.files:
+        spans.extend(read_spans(sys.stdin))
+
+    summary = summarise(spans, group_by)
+    print(json.dumps(summary, indent=2) if args.json else format_table(summary, group_by))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Bulk warms the Billboard index for a range of dates.
+
+Usage:
+python billboard_backfill.py 1970-01-01 1979-12-31 --workers 8 --rate 2
+
+Offline, against recorded pages named YYYY-MM-DD.html (the chart week) and a json file of spotify uri codes
+keyed on "song|artist":
+python billboard_backfill.py 1970-01-01 1970-12-31 --fixtures pages/ --spotify-fixtures uris.json
+"""
+import logging
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from billboard_index import BillboardIndex, BILLBOARD_INDEX_PATH, chart_week
+from billboard_parser import fetch_top_song, parse_top_song_stream, BILLBOARD_CHART_URL, STREAM_CHUNK_SIZE
+from rate_limit import HostRateLimiter
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SPOTIFY_API_HOST = 'api.spotify.com'
+
+
+def chart_weeks(start, end):
+    """
+    Dedupes a date range down to the distinct chart weeks covering it.
+
+    Parameters:
+    start (str): First date YYYY-MM-DD
+    end (str): Last date YYYY-MM-DD
+
+    Returns:
+    list: The chart weeks YYYY-MM-DD in order
+    """
+    week = datetime.strptime(chart_week(start), '%Y-%m-%d')
+    last = datetime.strptime(chart_week(end), '%Y-%m-%d')
+    weeks = []
+    while week <= last:
+        weeks.append(week.strftime('%Y-%m-%d'))
+        week += timedelta(days=7)
+    return weeks
+
+
+class BillboardBackfill:
+    """
+    Class that fetches the number 1 for many chart weeks concurrently, resolves their spotify uri codes
+    in batches and writes them to the Billboard index
+    """
+
+    def __init__(self, index, fetch_page, find_song_uri=None, workers=4, rate=1.0, batch_size=50):
+        """
+        Parameters:
+        index (BillboardIndex): The index results are written to
+        fetch_page (callable): Takes a chart week and returns {'song', 'artist'}
+        find_song_uri (callable): Optional, takes song and artist and returns the spotify uri code
+        workers (int): Number of pages fetched at once
+        rate (float): Requests per second allowed to each host
+        batch_size (int): Number of weeks fetched and resolved before the index is saved
+        """
+        self.index = index
+        self.fetch_page = fetch_page
+        self.find_song_uri = find_song_uri
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = HostRateLimiter(rate)
+        self.stats = {'weeks': 0, 'fetched': 0, 'resolved': 0, 'failed': 0, 'skipped': 0}
+
+    def _fetch(self, week):
+        self.limiter.acquire(BILLBOARD_CHART_URL)
+        try:
+            return week, self.fetch_page(week)
+        except Exception as e:
+            logger.error(f'error fetching billboard page for week {week}, error: {e}')
+            return week, None
+
+    def _resolve(self, item):
+        week, song_data = item
+        self.limiter.acquire(SPOTIFY_API_HOST)
+        try:
+            return week, song_data, self.find_song_uri(song_data['song'], song_data['artist'])
+        except Exception as e:
+            logger.warning(f'no spotify uri for week {week}, error: {e}')
+            return week, song_data, None
+
+    def run(self, weeks):
+        """
+        Backfills the given chart weeks, weeks already in the index with a uri code are skipped.
+
+        Parameters:
+        weeks (list): Chart weeks YYYY-MM-DD
+
+        Returns:
+        dict: Counts of weeks fetched, resolved, failed and skipped
+        """
+        todo = []
+        for week in weeks:
+            entry = self.index.lookup(week)
+            if entry and (entry['uri_code'] or not self.find_song_uri):
+                self.stats['skipped'] += 1
+            else:
+                todo.append(week)
+        self.stats['weeks'] = len(weeks)
+        logger.info(f'backfilling {len(todo)} weeks, {self.stats["skipped"]} already indexed')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch_start in range(0, len(todo), self.batch_size):
+                batch = todo[batch_start:batch_start + self.batch_size]
+
+                pages = [item for item in executor.map(self._fetch, batch) if item[1]]
+                self.stats['fetched'] += len(pages)
+                self.stats['failed'] += len(batch) - len(pages)
+
+                if self.find_song_uri:
+                    results = list(executor.map(self._resolve, pages))
+                else:
+                    results = [(week, song_data, None) for week, song_data in pages]
+
+                for week, song_data, uri_code in results:
+                    self.index.add(week, song_data['song'], song_data['artist'], uri_code)
+                    if uri_code:
+                        self.stats['resolved'] += 1
+                self.index.save()
+
+                done = batch_start + len(batch)
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f'backfill progress {done}/{len(todo)} weeks, {done / elapsed:.2f} weeks/s, stats: {self.stats}')
+
+        elapsed = time.perf_counter() - start
+        logger.info(f'backfill finished in {elapsed:.1f}s, stats: {self.stats}')
+        return self.stats
+
+
+def fixture_page_fetcher(directory):
+    """returns a fetch_page function reading recorded pages named YYYY-MM-DD.html from a directory"""
+    def fetch_page(week):
+        with open(os.path.join(directory, f'{week}.html'), 'rb') as page:
+            song_data, _ = parse_top_song_stream(iter(lambda: page.read(STREAM_CHUNK_SIZE), b''))
+        if song_data is None:
+            raise Exception(f'number one not found in recorded page for week {week}')
+        return song_data
+    return fetch_page
+
+
+def fixture_uri_finder(path):
+    """returns a find_song_uri function reading uri codes keyed on "song|artist" from a json file"""
+    with open(path, encoding='utf-8') as uri_file:
+        uris = json.load(uri_file)
+
+    def find_song_uri(song, artist):
+        try:
+            return uris[f'{song}|{artist}']
+        except KeyError:
+            raise Exception(f'song not found in recorded uris using song: {song}, artist: {artist}')
+    return find_song_uri
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start', help='first date YYYY-MM-DD')
+    parser.add_argument('end', help='last date YYYY-MM-DD')
+    parser.add_argument('--index', default=BILLBOARD_INDEX_PATH, help='index file to write to')
+    parser.add_argument('--workers', type=int, default=4, help='pages fetched at once')
+    parser.add_argument('--rate', type=float, default=1.0, help='requests per second per host')
+    parser.add_argument('--batch-size', type=int, default=50, help='weeks per batch before saving')
+    parser.add_argument('--fixtures', help='directory of recorded pages to read instead of billboard.com')
+    parser.add_argument('--spotify-fixtures', help='json file of recorded uri codes to use instead of spotify')
+    parser.add_argument('--no-spotify', action='store_true', help='do not look up spotify uri codes')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(message)s')
+
+    fetch_page = fixture_page_fetcher(args.fixtures) if args.fixtures else fetch_top_song
+    if args.no_spotify:
+        find_song_uri = None
+    elif args.spotify_fixtures:
+        find_song_uri = fixture_uri_finder(args.spotify_fixtures)
+    else:
+        from tweet_number_1_song import SpotifySongFinder
+        find_song_uri = SpotifySongFinder().find_song_uri
+
+    backfill = BillboardBackfill(BillboardIndex(args.index), fetch_page, find_song_uri,
+                                 workers=args.workers, rate=args.rate, batch_size=args.batch_size)
+    backfill.run(chart_weeks(args.start, args.end))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import logging
+from os import environ
+import os
+import bisect
+import argparse
+import threading
+from datetime import datetime, date, timedelta
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The prebuilt index ships next to this module, point BILLBOARD_INDEX_PATH somewhere writable
+# (e.g. /tmp) for lambdas that should add to it
+BILLBOARD_INDEX_PATH = environ.get(
+    'BILLBOARD_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'billboard_index.tsv'))
+
+# Hot 100 charts are dated on a saturday
+CHART_WEEKDAY = 5
+
+
+def chart_week(date_str):
+    """
+    Normalises a date to the date of the Billboard Hot 100 chart covering it.
+
+    Parameters:
+    date_str (str): Date in the format YYYY-MM-DD
+
+    Returns:
+    str: The chart week (the saturday on or after the date) in the format YYYY-MM-DD
+    """
+    day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    return (day + timedelta(days=(CHART_WEEKDAY - day.weekday()) % 7)).isoformat()
+
+
+class BillboardIndex:
+    """
+    Class holding a compact on-disk index of the Billboard Hot 100 number 1 for each chart week.
+    The index is a sorted tab separated file of week, song, artist and spotify uri code, lookups
+    bisect the sorted weeks so are O(log n).
+    """
+
+    def __init__(self, path=BILLBOARD_INDEX_PATH):
+        self.path = path
+        self.weeks = []
+        self.entries = []
+        self._loaded = False
+        # handlers run concurrently in load tests and backfills, adds and saves must not interleave
+        self._lock = threading.RLock()
+
+    def load(self):
+        """reads the index file, a missing file is treated as an empty index"""
+        self.weeks, self.entries = [], []
+        try:
+            with open(self.path, encoding='utf-8') as index_file:
+                rows = [line.rstrip('\n').split('\t') for line in index_file if line.strip()]
+        except FileNotFoundError:
+            logger.info(f'no billboard index found at {self.path}, starting empty')
+            rows = []
+
+        for week, song, artist, uri_code in sorted(rows):
+            self.weeks.append(week)
+            self.entries.append({'song': song, 'artist': artist, 'uri_code': uri_code or None})
+        self._loaded = True
+        logger.info(f'billboard index loaded, weeks: {len(self.weeks)}')
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.weeks)
+
+    @property
+    def last_week(self):
+        """the most recent indexed chart week, or None if the index is empty"""
+        self._ensure_loaded()
+        return self.weeks[-1] if self.weeks else None
+
+    def lookup(self, date_str):
+        """
+        Finds the number 1 for the chart week covering a date.
+
+        Parameters:
+        date_str (str): Date in the format YYYY-MM-DD
+
+        Returns:
+        dict: A dictionary with keys 'song', 'artist', 'uri_code' and 'week', or None if the week is not indexed
+        """
+        self._ensure_loaded()
+        week = chart_week(date_str)
+        position = bisect.bisect_left(self.weeks, week)
+        if position < len(self.weeks) and self.weeks[position] == week:
+            return dict(self.entries[position], week=week)
+        return None
+
+    def add(self, date_str, song, artist, uri_code=None):
+        """
+        Adds or replaces the number 1 for the chart week covering a date.
+
+        Parameters:
+        date_str (str): Date in the format YYYY-MM-DD
+        song (str): The song's name
+        artist (str): The artist's name
+        uri_code (str): The song's spotify uri code, if known
+        """
+        self._ensure_loaded()
+        week = chart_week(date_str)
+        entry = {'song': song.replace('\t', ' '), 'artist': artist.replace('\t', ' '), 'uri_code': uri_code}
+        with self._lock:
+            position = bisect.bisect_left(self.weeks, week)
+            if position < len(self.weeks) and self.weeks[position] == week:
+                self.entries[position] = entry
+            else:
+                self.weeks.insert(position, week)
+                self.entries.insert(position, entry)
+
+    def save(self):
+        """writes the index back to disk atomically, returns False if the location is not writable"""
+        self._ensure_loaded()
+        temp_path = f'{self.path}.tmp'
+        try:
+            with self._lock:
+                with open(temp_path, 'w', encoding='utf-8') as index_file:
+                    for week, entry in zip(self.weeks, self.entries):
+                        index_file.write(
+                            f"{week}\t{entry['song']}\t{entry['artist']}\t{entry['uri_code'] or ''}\n")
+                os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f'could not save billboard index to {self.path}, error: {e}')
+            return False
+        return True
+
+    def update(self, scrape_top_song, find_song_uri=None, until=None):
+        """
+        Incrementally adds the chart weeks newer than the last indexed week.
+
+        Parameters:
+        scrape_top_song (callable): Takes a date YYYY-MM-DD and returns a dict with 'song' and 'artist'
+        find_song_uri (callable): Optional, takes song and artist and returns the spotify uri code
+        until (str): Last date to index YYYY-MM-DD, defaults to today
+
+        Returns:
+        int: The number of weeks added
+        """
+        until = chart_week(until or date.today().isoformat())
+        if self.last_week:
+            week = (datetime.strptime(self.last_week, '%Y-%m-%d') + timedelta(days=7)).date().isoformat()
+        else:
+            week = chart_week('1970-01-01')
+
+        added = 0
+        while week <= until:
+            song_data = scrape_top_song(week)
+            uri_code = None
+            if find_song_uri:
+                try:
+                    uri_code = find_song_uri(song_data['song'], song_data['artist'])
+                except Exception as e:
+                    logger.warning(f'no spotify uri for week {week}, error: {e}')
+            self.add(week, song_data['song'], song_data['artist'], uri_code)
+            added += 1
+            week = (datetime.strptime(week, '%Y-%m-%d') + timedelta(days=7)).date().isoformat()
+
+        logger.info(f'billboard index updated, weeks added: {added}')
+        return added
+
+
+@per_container
+def get_index():
+    """returns the billboard index, loaded once per container"""
+    return BillboardIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the Billboard Hot 100 number 1 index.')
+    parser.add_argument('--path', default=BILLBOARD_INDEX_PATH, help='index file to update')
+    parser.add_argument('--until', help='last date to index YYYY-MM-DD, defaults to today')
+    parser.add_argument('--no-spotify', action='store_true', help='do not look up spotify uri codes')
+    args = parser.parse_args()
+
+    from tweet_number_1_song import SpotifySongFinder
+
+    song_finder = SpotifySongFinder()
+    index = BillboardIndex(args.path)
+    try:
+        index.update(song_finder.scrape_top_song,
+                     None if args.no_spotify else song_finder.find_song_uri, args.until)
+    finally:
+        # keep whatever was scraped even if a week failed part way through
+        index.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import logging
+from os import environ
+import codecs
+from html.parser import HTMLParser
+from http_cache import get_http_session
+from tracing import span
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+BILLBOARD_CHART_URL = 'https://www.billboard.com/charts/hot-100/{date}/'
+
+# 'stream' stops reading the page as soon as the number 1 is found, 'soup' builds the full BeautifulSoup tree
+BILLBOARD_PARSER_MODE = environ.get('BILLBOARD_PARSER_MODE', 'stream')
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# The number 1's title and artist are inside the fourth chart results list item on the page
+CHART_ITEM_CLASS = 'o-chart-results-list__item'
+CHART_ITEM_POSITION = 4
+
+
+class TopSongParser(HTMLParser):
+    """
+    Event driven parser that picks the number 1's title and artist out of a Billboard Hot 100 page.
+    Feed it the page a chunk at a time and check 'done' after each chunk, once done the rest of the
+    page can be discarded without being read.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items_seen = 0
+        self.item_depth = 0
+        self.capture = None
+        self.song = None
+        self.artist = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+
+        if tag == 'li':
+            if self.item_depth:
+                self.item_depth += 1
+            elif CHART_ITEM_CLASS in classes:
+                self.items_seen += 1
+                if self.items_seen == CHART_ITEM_POSITION:
+                    self.item_depth = 1
+            return
+
+        if not self.item_depth:
+            return
+        if tag == 'h3' and self.song is None and 'c-title' in classes and attrs.get('id') == 'title-of-a-story':
+            self.capture = ('song', tag, [])
+        elif tag == 'span' and self.artist is None and 'c-label' in classes:
+            self.capture = ('artist', tag, [])
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if self.capture and tag == self.capture[1]:
+            field, _, text = self.capture
+            setattr(self, field, ''.join(text).strip())
+            self.capture = None
+            if self.song is not None and self.artist is not None:
+                self.done = True
+        elif tag == 'li' and self.item_depth:
+            self.item_depth -= 1
+            if not self.item_depth:
+                # left the number 1's list item without finding both fields
+                self.done = True
+
+    def handle_data(self, data):
+        if self.capture and not self.done:
+            self.capture[2].append(data)
+
+    def result(self):
+        """returns {'song', 'artist'} or None if the page did not contain them"""
+        if self.song and self.artist:
+            return {'song': self.song, 'artist': self.artist}
+        return None
+
+
+def parse_top_song_stream(chunks, encoding='utf-8'):
+    """
+    Parses the number 1 out of a Billboard page read in chunks, stopping as soon as it is found.
+
+    Parameters:
+    chunks (iterable): An iterable of bytes, e.g. response.iter_content(STREAM_CHUNK_SIZE)
+    encoding (str): The encoding of the page
+
+    Returns:
+    tuple: ({'song', 'artist'} or None, number of bytes read)
+    """
+    parser = TopSongParser()
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    bytes_read = 0
+    for chunk in chunks:
+        bytes_read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            break
+    return parser.result(), bytes_read
+
+
+def parse_top_song_soup(website_html):
+    """
+    Parses the number 1 out of a whole Billboard page by building a BeautifulSoup tree.
+
+    Parameters:
+    website_html (str): The page's html
+
+    Returns:
+    dict: {'song', 'artist'} or None if the page did not contain them
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(website_html, 'html.parser')
+    soup_data = soup.find_all(name='li', class_=CHART_ITEM_CLASS, limit=CHART_ITEM_POSITION)
+    if len(soup_data) < CHART_ITEM_POSITION:
+        return None
+
+    soup_song = soup_data[CHART_ITEM_POSITION - 1]
+    song = soup_song.find(name='h3', class_='c-title', id='title-of-a-story')
+    artist = soup_song.find(name='span', class_='c-label')
+    if song is None or artist is None:
+        return None
+    return {'song': song.get_text().strip(), 'artist': artist.get_text().strip()}
+
+
+def fetch_top_song(date, mode=None):
+    """
+    Downloads the Billboard Hot 100 for a date and returns the number 1.
+
+    Parameters:
+    date (str): Date in the format YYYY-MM-DD
+    mode (str): 'stream' or 'soup', defaults to the BILLBOARD_PARSER_MODE environment variable
+
+    Returns:
+    dict: A dictionary containing the top song's name, 'song', and artist, 'artist'
+    """
+    mode = mode or BILLBOARD_PARSER_MODE
+    url = BILLBOARD_CHART_URL.format(date=date)
+
+    if mode == 'soup':
+        with span('fetch', source='billboard') as fetch_span:
+            response = get_http_session().get(url)
+            fetch_span.add_bytes(len(response.content))
+        with span('parse', source='billboard', mode='soup'):
+            song_data = parse_top_song_soup(response.text)
+    elif mode == 'stream':
+        # closing the response part way through drops the rest of the page unread
+        with get_http_session().get(url, stream=True) as response:
+            # requests assumes ISO-8859-1 for html without a charset, the page is utf-8 unless it says otherwise
+            content_type = response.headers.get('content-type', '')
+            encoding = response.encoding if 'charset=' in content_type else 'utf-8'
+            # the page is read as it is parsed, so this span covers downloading the part that is read too
+            with span('parse', source='billboard', mode='stream') as parse_span:
+                song_data, bytes_read = parse_top_song_stream(
+                    response.iter_content(STREAM_CHUNK_SIZE), encoding)
+                parse_span.add_bytes(bytes_read)
+        logger.info(f'billboard page parsed after reading {bytes_read} bytes')
+    else:
+        raise ValueError(f'unknown billboard parser mode: {mode}')
+
+    if song_data is None:
+        raise Exception(f'number one not found on billboard page, status code: {response.status_code}')
+    return song_data
@@ -0,0 +1,42 @@
+"""
+State kept for the life of a lambda container.
+
+Lambda reuses a container for warm invocations, so clients, connections and caches built by one
+invocation are still there for the next and only cold starts pay to build them again. Functions
+decorated with per_container build their object on the first call and return it from then on.
+
+/tmp survives between warm invocations too, which is why the SQLite caches and indexes (HTTP_CACHE_PATH,
+SPOTIFY_CACHE_PATH, NEWS_POOL_PATH, SEEN_INDEX_PATH, ...) default to it. Point those paths at a mounted
+volume (e.g. EFS) for them to survive cold starts as well and to be shared between functions.
+"""
+import functools
+import threading
+
+
+def per_container(factory):
+    """
+    Decorator for a function that builds a shared object, the object is built on the first call and
+    every call after returns it. Concurrent first calls build it once.
+
+    The decorated function has reset(), dropping the object so the next call builds a new one. reset()
+    returns the dropped object, None if there wasn't one, so it can be closed.
+    """
+    lock = threading.Lock()
+    state = {}
+
+    @functools.wraps(factory)
+    def get():
+        try:
+            return state['value']
+        except KeyError:
+            with lock:
+                if 'value' not in state:
+                    state['value'] = factory()
+                return state['value']
+
+    def reset():
+        with lock:
+            return state.pop('value', None)
+
+    get.reset = reset
+    return get
@@ -0,0 +1,246 @@
+import logging
+from os import environ
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from requests import Session
+from http_transport import mount_adapter
+from tracing import span
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# kept in /tmp between warm invocations by default, see container_state
+HTTP_CACHE_PATH = environ.get('HTTP_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'http_cache.sqlite3'))
+HTTP_POOL_MAXSIZE = int(environ.get('HTTP_POOL_MAXSIZE', 16))
+
+@per_container
+def get_http_session():
+    """returns a requests session with a keep-alive connection pool, shared by concurrent fetches"""
+    return mount_adapter(Session(), pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+
+
+def reset_http_session():
+    """Closes and discards the shared session, the next call to get_http_session builds a new one."""
+    session = get_http_session.reset()
+    if session is not None:
+        session.close()
+
+
+def parse_max_age(headers):
+    """
+    Reads how long a response may be cached for from its Cache-Control header.
+
+    Returns:
+    int: Seconds the response is fresh for, 0 for no-cache/no-store, or None if the header doesn't say
+    """
+    cache_control = headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return int(match.group(1)) if match else None
+
+
+class HTTPCache:
+    """
+    Class holding cached http responses in SQLite along with their validators (ETag and Last-Modified)
+    so stale entries can be revalidated with a conditional GET.
+    """
+
+    def __init__(self, path=HTTP_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, last_modified TEXT, '
+            'fetched REAL NOT NULL, expires REAL NOT NULL)')
+        # large bodies are streamed to files, only their validators are kept in the database
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'key TEXT PRIMARY KEY, path TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+            'fetched REAL NOT NULL, expires REAL NOT NULL)')
+        self._db.commit()
+
+    def get(self, key):
+        """returns the cached entry for a key as a dictionary, or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, etag, last_modified, fetched, expires FROM responses WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        return {'body': row[0], 'etag': row[1], 'last_modified': row[2], 'fetched': row[3], 'expires': row[4]}
+
+    def put(self, key, body, headers, default_max_age):
+        """stores a response body, fresh for the response's max-age or default_max_age if it doesn't give one"""
+        max_age = parse_max_age(headers)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, body, etag, last_modified, fetched, expires) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, headers.get('etag'), headers.get('last-modified'), now,
+                 now + (default_max_age if max_age is None else max_age)))
+            self._db.commit()
+
+    def refresh(self, key, headers, default_max_age):
+        """marks an entry fresh again after a 304 Not Modified"""
+        max_age = parse_max_age(headers)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE responses SET fetched = ?, expires = ? WHERE key = ?',
+                (now, now + (default_max_age if max_age is None else max_age), key))
+            self._db.commit()
+
+    def fetch(self, key, url, params=None, max_age=3600, timeout=10, stale_if_error=0, stale_while_revalidate=0):
+        """
+        Returns a response body from the cache, or fetches it if the cached copy is missing or stale.
+
+        Parameters:
+        key (str): The cache key, should not contain secrets like api keys
+        url (str): The url to fetch
+        params (dict): Query parameters
+        max_age (int): Seconds a response is fresh for when it has no Cache-Control max-age
+        timeout (float): Seconds to wait for the upstream before giving up
+        stale_if_error (int): Seconds past expiry a stale copy is still served if the upstream is slow or down
+        stale_while_revalidate (int): Seconds past expiry a stale copy is served straight away while it is
+                                      refreshed in the background. In a lambda the refresh may only finish
+                                      when the container is next thawed
+
+        Returns:
+        tuple: (body bytes, one of 'hit', 'miss', 'revalidated', 'stale', 'stale-error')
+        """
+        with span('fetch', source=key.split(':', 1)[0]) as fetch_span:
+            body, status = self._fetch(key, url, params, max_age, timeout, stale_if_error, stale_while_revalidate)
+            fetch_span.set(cache=status)
+            fetch_span.add_bytes(len(body))
+            return body, status
+
+    def _fetch(self, key, url, params, max_age, timeout, stale_if_error, stale_while_revalidate):
+        entry = self.get(key)
+        now = time.time()
+        if entry and now < entry['expires']:
+            return entry['body'], 'hit'
+
+        if entry and now < entry['expires'] + stale_while_revalidate:
+            threading.Thread(
+                target=self._revalidate_quietly, args=(key, url, params, entry, max_age, timeout), daemon=True).start()
+            return entry['body'], 'stale'
+
+        try:
+            return self._revalidate(key, url, params, entry, max_age, timeout)
+        except Exception as e:
+            if entry and now < entry['expires'] + stale_if_error:
+                logger.warning(f'serving stale copy of {key}, upstream error: {e}')
+                return entry['body'], 'stale-error'
+            raise
+
+    def _revalidate(self, key, url, params, entry, max_age, timeout):
+        # conditional GET so an unchanged response costs a 304 with no body
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        elif entry:
+            headers['If-Modified-Since'] = formatdate(entry['fetched'], usegmt=True)
+
+        response = get_http_session().get(url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry:
+            self.refresh(key, response.headers, max_age)
+            return entry['body'], 'revalidated'
+        if response.status_code != 200:
+            raise Exception(f'status code: {response.status_code}, response: {response.text}')
+
+        self.put(key, response.content, response.headers, max_age)
+        return response.content, 'miss'
+
+    def fetch_file(self, key, url, path, max_age=24 * 60 * 60, timeout=30, max_bytes=None, chunk_size=64 * 1024):
+        """
+        Streams a large response to a file, or returns the cached file if it is fresh or the upstream
+        says it hasn't changed. Only one chunk is held in memory at a time.
+
+        Parameters:
+        key (str): The cache key
+        url (str): The url to fetch
+        path (str): Where the file is written
+        max_age (int): Seconds the file is fresh for when the response has no Cache-Control max-age
+        timeout (float): Seconds to wait for the upstream before giving up
+        max_bytes (int): Optional size limit, checked against Content-Length before the body is read
+        chunk_size (int): Size of the chunks the body is streamed in
+
+        Returns:
+        tuple: (path of the file, one of 'hit', 'miss', 'revalidated')
+        """
+        with span('fetch', source=key.split(':', 1)[0]) as fetch_span:
+            path, status, bytes_written = self._fetch_file(key, url, path, max_age, timeout, max_bytes, chunk_size)
+            fetch_span.set(cache=status)
+            fetch_span.add_bytes(bytes_written)
+            return path, status
+
+    def _fetch_file(self, key, url, path, max_age, timeout, max_bytes, chunk_size):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT path, etag, last_modified, fetched, expires FROM files WHERE key = ?', (key,)).fetchone()
+        entry = None
+        if row and os.path.exists(row[0]):
+            entry = {'path': row[0], 'etag': row[1], 'last_modified': row[2], 'fetched': row[3], 'expires': row[4]}
+            if time.time() < entry['expires']:
+                return entry['path'], 'hit', 0
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        bytes_written = 0
+        with get_http_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and entry:
+                status, path = 'revalidated', entry['path']
+            elif response.status_code != 200:
+                raise Exception(f'status code: {response.status_code}, url: {url}')
+            else:
+                size = int(response.headers.get('content-length') or 0)
+                if max_bytes and size > max_bytes:
+                    raise ValueError(f'{url} is {size} bytes, over the limit of {max_bytes}')
+
+                # write to a temporary file first so a failed download never replaces a good copy
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                partial = f'{path}.partial'
+                with open(partial, 'wb') as body_file:
+                    for chunk in response.iter_content(chunk_size):
+                        bytes_written += body_file.write(chunk)
+                os.replace(partial, path)
+                status = 'miss'
+
+            max_age_header = parse_max_age(response.headers)
+            now = time.time()
+            with self._lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO files (key, path, etag, last_modified, fetched, expires) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, path,
+                     response.headers.get('etag') or (entry and entry['etag']),
+                     response.headers.get('last-modified') or (entry and entry['last_modified']),
+                     now, now + (max_age if max_age_header is None else max_age_header)))
+                self._db.commit()
+        return path, status, bytes_written
+
+    def _revalidate_quietly(self, key, url, params, entry, max_age, timeout):
+        try:
+            self._revalidate(key, url, params, entry, max_age, timeout)
+        except Exception as e:
+            logger.warning(f'background refresh of {key} failed, error: {e}')
+
+
+@per_container
+def get_http_cache():
+    """returns the http cache, opened once per container"""
+    return HTTPCache()
@@ -0,0 +1,101 @@
+"""
+The transport every outbound http request goes through.
+
+Sessions mount the adapter from build_adapter rather than a plain HTTPAdapter. Normally that is
+exactly a pooled HTTPAdapter, but with HTTP_UPSTREAM_URL set every request, whatever its host, is
+sent to that url instead with the original host in the X-Upstream-Host header. Pointing it at
+benchmarks/fake_upstream.py runs the bots end to end without touching the real services.
+A different adapter can also be injected in process with set_adapter_factory.
+With tracing on (see tracing) every request is also timed as an 'http' span.
+"""
+import logging
+from os import environ
+from urllib.parse import urlsplit
+from requests.adapters import BaseAdapter, HTTPAdapter
+from tracing import TRACING_ENABLED, span
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+UPSTREAM_HOST_HEADER = 'X-Upstream-Host'
+
+
+class UpstreamAdapter(HTTPAdapter):
+    """
+    Adapter sending every request to one upstream, e.g. a local fake of the real services.
+    """
+
+    def __init__(self, upstream_url, **kwargs):
+        self.upstream_url = upstream_url.rstrip('/')
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        # requests are already signed (oauth) by the time they are sent, so rewriting here changes nothing else
+        url = urlsplit(request.url)
+        request.headers[UPSTREAM_HOST_HEADER] = url.netloc
+        request.url = f"{self.upstream_url}{url.path or '/'}{'?' + url.query if url.query else ''}"
+        return super().send(request, **kwargs)
+
+
+class TracedAdapter(BaseAdapter):
+    """
+    Wraps an adapter to time each request as an 'http' span, with the real host even when the request is
+    rewritten to an upstream. Streamed responses are timed to their headers, the body is read later.
+    """
+
+    def __init__(self, adapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        with span('http', host=urlsplit(request.url).netloc, method=request.method) as http_span:
+            response = self.adapter.send(request, **kwargs)
+            http_span.set(status_code=response.status_code)
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit():
+                http_span.add_bytes(int(content_length))
+            return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def default_adapter_factory(**kwargs):
+    """returns an UpstreamAdapter if HTTP_UPSTREAM_URL is set, otherwise a plain HTTPAdapter"""
+    # read when the adapter is built, not on import, so a harness can set it after importing this module
+    upstream_url = environ.get('HTTP_UPSTREAM_URL')
+    if upstream_url:
+        return UpstreamAdapter(upstream_url, **kwargs)
+    return HTTPAdapter(**kwargs)
+
+
+_adapter_factory = default_adapter_factory
+
+
+def set_adapter_factory(factory):
+    """
+    Replaces the function adapters are built with, sessions built after this use it.
+    Reset the shared sessions (http_cache.reset_http_session, twitter_session.reset_oauth_session)
+    for it to take effect on them.
+
+    Parameters:
+    factory (callable): Takes HTTPAdapter's keyword arguments and returns an adapter, None restores the default
+    """
+    global _adapter_factory
+    _adapter_factory = factory or default_adapter_factory
+
+
+def build_adapter(**kwargs):
+    """builds the transport adapter, kwargs are HTTPAdapter's e.g. pool_maxsize and max_retries"""
+    return _adapter_factory(**kwargs)
+
+
+def mount_adapter(session, **kwargs):
+    """mounts a transport adapter on a session for both http and https, returns the session"""
+    adapter = build_adapter(**kwargs)
+    if TRACING_ENABLED:
+        adapter = TracedAdapter(adapter)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
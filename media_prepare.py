@@ -0,0 +1,151 @@
+"""
+Media preparation between fetching an image and uploading it.
+
+Image dimensions are read from the JPEG/PNG/GIF headers without decoding the image. Images already
+within the upload limits are passed through untouched. Bigger ones are downsampled and recompressed
+as JPEG to fit the byte budget. That needs Pillow, listed in the Pipfile so it is packaged with the
+function. It is only imported when an image needs downscaling, and if it is missing oversized images are
+refused so the caller can fall back to a smaller one. Prepared variants are cached next to the original
+so a rerun reuses them.
+"""
+import logging
+from os import environ
+import os
+import struct
+import time
+from tracing import traced
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Twitter's limits for images uploaded with media_category tweet_image
+MEDIA_MAX_IMAGE_BYTES = int(environ.get('MEDIA_MAX_IMAGE_BYTES', 5 * 1024 * 1024))
+MEDIA_MAX_DIMENSION = int(environ.get('MEDIA_MAX_DIMENSION', 4096))
+# JPEG qualities tried in turn until the image fits the byte budget
+MEDIA_JPEG_QUALITIES = (90, 85, 75, 65)
+
+
+class ImageTooLargeError(Exception):
+    """Raised when an image is over the upload limits and can't be made to fit"""
+
+
+def image_info(path):
+    """
+    Reads an image's format and dimensions from its header, only the first few kilobytes of the file
+    are read for PNG and GIF and JPEG is scanned marker to marker up to its frame header.
+
+    Parameters:
+    path (str): Path of the image
+
+    Returns:
+    dict: 'format' ('jpeg', 'png', 'gif' or None if not recognised), 'width', 'height' (None if not found)
+          and 'bytes', the file size
+    """
+    info = {'format': None, 'width': None, 'height': None, 'bytes': os.path.getsize(path)}
+    with open(path, 'rb') as image_file:
+        head = image_file.read(26)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            info['format'] = 'png'
+            info['width'], info['height'] = struct.unpack('>II', head[16:24])
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            info['format'] = 'gif'
+            info['width'], info['height'] = struct.unpack('<HH', head[6:10])
+        elif head.startswith(b'\xff\xd8'):
+            info['format'] = 'jpeg'
+            image_file.seek(2)
+            while True:
+                marker = image_file.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    break
+                # start of frame markers hold the dimensions, all but DHT, JPG and DAC
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    frame = image_file.read(7)
+                    info['height'], info['width'] = struct.unpack('>HH', frame[3:7])
+                    break
+                length = struct.unpack('>H', image_file.read(2))[0]
+                image_file.seek(length - 2, os.SEEK_CUR)
+    return info
+
+
+def fits(info, max_bytes=MEDIA_MAX_IMAGE_BYTES, max_dimension=MEDIA_MAX_DIMENSION):
+    """returns True if an image described by image_info can be uploaded as it is"""
+    return (info['bytes'] <= max_bytes and info['width'] is not None
+            and max(info['width'], info['height']) <= max_dimension)
+
+
+def _encode(image, path, max_bytes):
+    """saves image as JPEG at the best quality that fits max_bytes, returns True if it fit"""
+    for quality in MEDIA_JPEG_QUALITIES:
+        image.save(path, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if os.path.getsize(path) <= max_bytes:
+            return True
+    return False
+
+
+def downscale(path, output_path, info, max_bytes=MEDIA_MAX_IMAGE_BYTES, max_dimension=MEDIA_MAX_DIMENSION):
+    """
+    Downsamples and recompresses an image to a JPEG within max_bytes and max_dimension.
+
+    Raises:
+    ImageTooLargeError: If Pillow isn't installed or the image can't be made small enough
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImageTooLargeError(f'{path} is over the upload limits and Pillow is not installed to downscale it')
+
+    scale = min(1.0, max_dimension / max(info['width'], info['height']))
+    with Image.open(path) as image:
+        # JPEGs are decoded straight at a reduced size, much cheaper than decoding in full and resizing
+        image.draft('RGB', (int(info['width'] * scale), int(info['height'] * scale)))
+        image = image.convert('RGB')
+        for attempt in range(4):
+            size = (max(1, int(info['width'] * scale)), max(1, int(info['height'] * scale)))
+            resized = image if size == image.size else image.resize(size, Image.LANCZOS)
+            if _encode(resized, output_path, max_bytes):
+                return
+            # JPEG size scales roughly with the pixel count, so shrink the sides by the root of the overshoot
+            scale *= 0.9 * (max_bytes / os.path.getsize(output_path)) ** 0.5
+    os.remove(output_path)
+    raise ImageTooLargeError(f'{path} could not be compressed to {max_bytes} bytes')
+
+
+@traced('prepare')
+def prepare_image(path, max_bytes=MEDIA_MAX_IMAGE_BYTES, max_dimension=MEDIA_MAX_DIMENSION):
+    """
+    Gets an image ready to upload, passing it through if it is within the limits and otherwise
+    downscaling it, or reusing a variant prepared for the same limits on an earlier run.
+
+    Parameters:
+    path (str): Path of the image
+    max_bytes (int): Largest file size allowed
+    max_dimension (int): Largest width or height allowed
+
+    Returns:
+    dict: 'path' of the image to upload, 'original_bytes', 'bytes', 'bytes_saved', 'seconds' spent and
+          'status', one of 'unchanged', 'cached' or 'downscaled'
+    """
+    start = time.perf_counter()
+    info = image_info(path)
+    report = {'path': path, 'original_bytes': info['bytes'], 'bytes': info['bytes'], 'status': 'unchanged'}
+
+    if not fits(info, max_bytes, max_dimension):
+        if info['format'] is None or info['width'] is None:
+            raise ImageTooLargeError(f'{path} is not an image that can be downscaled')
+
+        output_path = f'{os.path.splitext(path)[0]}.{max_bytes}-{max_dimension}.jpg'
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(path):
+            report['status'] = 'cached'
+        else:
+            downscale(path, output_path, info, max_bytes, max_dimension)
+            report['status'] = 'downscaled'
+        report['path'] = output_path
+        report['bytes'] = os.path.getsize(output_path)
+
+    report['bytes_saved'] = report['original_bytes'] - report['bytes']
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    logger.info(
+        f"image prepared, {report['status']}, {report['original_bytes']} -> {report['bytes']} bytes, "
+        f"{info['width']}x{info['height']} {info['format']}, {report['seconds']}s")
+    return report
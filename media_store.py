@@ -0,0 +1,159 @@
+import logging
+import base64
+import mimetypes
+from os import environ
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Size of the chunks media is read and written in, keeps peak memory bounded
+CHUNK_SIZE = 64 * 1024
+
+# Where media is staged, if MEDIA_STORE_BUCKET is set media is staged in s3 so it can be
+# shared between separate lambda functions, otherwise it is staged on the local disk
+MEDIA_STORE_BUCKET = environ.get('MEDIA_STORE_BUCKET')
+MEDIA_STORE_PREFIX = environ.get('MEDIA_STORE_PREFIX', 'twitter_bot_media/')
+MEDIA_STORE_DIR = environ.get('MEDIA_STORE_DIR', os.path.join(tempfile.gettempdir(), 'twitter_bot_media'))
+
+
+@per_container
+def get_s3_client():
+    """returns a boto3 s3 client, created once per container and only when media is staged in s3"""
+    import boto3
+    return boto3.client('s3')
+
+
+def stage_media(chunks, suffix=''):
+    """
+    Stages media once so it can be handed to tweet_img by reference rather than as base64 in a payload.
+
+    Parameters:
+    chunks (iterable): An iterable of bytes objects, e.g. response.iter_content(CHUNK_SIZE)
+    suffix (str): Optional file extension for the staged media e.g. '.jpg'
+
+    Returns:
+    str: A media reference, either 's3://bucket/key' or 'file:///path'
+    """
+    os.makedirs(MEDIA_STORE_DIR, exist_ok=True)
+    name = f'{uuid.uuid4().hex}{suffix}'
+    path = os.path.join(MEDIA_STORE_DIR, name)
+
+    # Write the chunks straight to disk so only one chunk is held in memory at a time
+    size = 0
+    with open(path, 'wb') as media_file:
+        for chunk in chunks:
+            if chunk:
+                media_file.write(chunk)
+                size += len(chunk)
+
+    if not MEDIA_STORE_BUCKET:
+        logger.info(f'media staged locally, path: {path}, bytes: {size}')
+        return f'file://{path}'
+
+    key = f'{MEDIA_STORE_PREFIX}{name}'
+    try:
+        get_s3_client().upload_file(path, MEDIA_STORE_BUCKET, key)
+    finally:
+        os.remove(path)
+    logger.info(f'media staged in s3, bucket: {MEDIA_STORE_BUCKET}, key: {key}, bytes: {size}')
+    return f's3://{MEDIA_STORE_BUCKET}/{key}'
+
+
+@contextmanager
+def open_media(media_ref):
+    """
+    Opens staged media for streaming reads.
+
+    Parameters:
+    media_ref (str): A media reference returned by stage_media
+
+    Yields:
+    file-like: A binary file-like object supporting read(size)
+    """
+    parsed = urlparse(media_ref)
+    if parsed.scheme == 'file':
+        with open(parsed.path, 'rb') as media_file:
+            yield media_file
+    elif parsed.scheme == 's3':
+        body = get_s3_client().get_object(
+            Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))['Body']
+        try:
+            yield body
+        finally:
+            body.close()
+    else:
+        raise ValueError(f'unsupported media reference: {media_ref}')
+
+
+def media_size(media_ref):
+    """
+    Returns the size of staged media in bytes without reading it.
+
+    Parameters:
+    media_ref (str): A media reference returned by stage_media
+
+    Returns:
+    int: The size of the media in bytes
+    """
+    parsed = urlparse(media_ref)
+    if parsed.scheme == 'file':
+        return os.path.getsize(parsed.path)
+    elif parsed.scheme == 's3':
+        response = get_s3_client().head_object(
+            Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))
+        return response['ContentLength']
+    raise ValueError(f'unsupported media reference: {media_ref}')
+
+
+def is_local_media(media_ref):
+    """True if media is staged on this function's local disk, where no other lambda function can read it"""
+    return urlparse(media_ref).scheme == 'file'
+
+
+def inline_media(media_ref, max_bytes=None):
+    """
+    Reads staged media into the base64 'image' field tweet_img accepts in place of a media reference,
+    for handing local media to another lambda function when there is no MEDIA_STORE_BUCKET.
+
+    Parameters:
+    media_ref (str): A media reference returned by stage_media
+    max_bytes (int): Optional limit on the size of the base64 text, e.g. the lambda payload limit
+
+    Returns:
+    dict: The payload fields, 'image' and 'media_type'
+    """
+    size = media_size(media_ref)
+    encoded_size = 4 * ((size + 2) // 3)
+    if max_bytes and encoded_size > max_bytes:
+        raise ValueError(
+            f'media {media_ref} is {size} bytes, too big to send inline ({encoded_size} bytes as base64, the limit '
+            f'is {max_bytes}), MEDIA_STORE_BUCKET is required to hand it to another lambda function')
+    with open_media(media_ref) as media_file:
+        image = base64.b64encode(media_file.read()).decode('ascii')
+    return {'image': image, 'media_type': mimetypes.guess_type(media_ref)[0] or 'image/jpeg'}
+
+
+def delete_media(media_ref):
+    """
+    Removes staged media once it is no longer needed, errors are logged rather than raised.
+
+    Parameters:
+    media_ref (str): A media reference returned by stage_media
+    """
+    parsed = urlparse(media_ref)
+    try:
+        if parsed.scheme == 'file':
+            if os.path.exists(parsed.path):
+                os.remove(parsed.path)
+        elif parsed.scheme == 's3':
+            get_s3_client().delete_object(
+                Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))
+    except Exception as e:
+        logger.warning(f'error deleting staged media: {media_ref}, error: {e}')
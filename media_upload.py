@@ -0,0 +1,224 @@
+import logging
+from os import environ
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Constants for API URLs
+MEDIA_UPLOAD_URL = 'https://upload.twitter.com/1.1/media/upload.json'
+
+# Twitter accepts segments of up to 5MB, smaller segments mean less to resend on a failure
+DEFAULT_SEGMENT_SIZE = int(environ.get('MEDIA_SEGMENT_SIZE', 1024 * 1024))
+MAX_SEGMENT_SIZE = 5 * 1024 * 1024
+DEFAULT_MAX_WORKERS = int(environ.get('MEDIA_UPLOAD_WORKERS', 1))
+# Longest twitter is waited on to process uploaded media, keep it well inside the lambda timeout
+DEFAULT_PROCESSING_MAX_WAIT = float(environ.get('MEDIA_PROCESSING_MAX_WAIT', 60))
+
+
+class MediaUploadError(Exception):
+    """
+    Raised when a chunked upload fails, 'state' holds the media_id and the acknowledged segments
+    so the upload can be resumed by passing it back to ChunkedMediaUploader.upload
+    """
+
+    def __init__(self, message, state):
+        super().__init__(message)
+        self.state = state
+
+
+class ChunkedMediaUploader:
+    """
+    Class that uploads media to twitter using the INIT/APPEND/FINALIZE chunked upload flow, streaming
+    segments from a file-like object or an iterable of bytes so only a few segments are held in memory
+    """
+
+    def __init__(self, oauth, upload_url=MEDIA_UPLOAD_URL, segment_size=DEFAULT_SEGMENT_SIZE,
+                 max_workers=DEFAULT_MAX_WORKERS, max_retries=3, backoff=1,
+                 processing_max_wait=DEFAULT_PROCESSING_MAX_WAIT):
+        """
+        Parameters:
+        oauth (OAuth1Session): The session used to make the requests
+        upload_url (str): The media upload endpoint, can be pointed at a local fake server
+        segment_size (int): Size in bytes of each APPEND segment
+        max_workers (int): Number of segments uploaded in parallel, 1 uploads sequentially
+        max_retries (int): Number of times a failed segment is retried before giving up
+        backoff (float): Seconds to wait before the first retry, doubled on every retry after
+        processing_max_wait (float): Longest to wait for twitter to process the media after FINALIZE, in seconds
+        """
+        if not 0 < segment_size <= MAX_SEGMENT_SIZE:
+            raise ValueError(f'segment_size must be between 1 and {MAX_SEGMENT_SIZE} bytes')
+        self.oauth = oauth
+        self.upload_url = upload_url
+        self.segment_size = segment_size
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.processing_max_wait = processing_max_wait
+
+    def upload(self, source, total_bytes, media_type, media_category=None, resume_state=None):
+        """
+        Uploads media in segments.
+
+        Parameters:
+        source (file-like or iterable): The media, either an object with read(size) or an iterable of bytes.
+                                        When resuming, the source must start from the beginning of the media again
+        total_bytes (int): The size of the media in bytes
+        media_type (str): The mime type of the media e.g. 'image/jpeg'
+        media_category (str): Optional media category e.g. 'tweet_image'
+        resume_state (dict): The 'state' of a MediaUploadError from a previous attempt
+
+        Returns:
+        str: The 'media_id_string' of the uploaded media
+        """
+        if resume_state:
+            state = {'media_id': resume_state['media_id'],
+                     'acknowledged': set(resume_state['acknowledged'])}
+            logger.info(
+                f"resuming media upload, media_id: {state['media_id']}, segments already acknowledged: {len(state['acknowledged'])}")
+        else:
+            state = {'media_id': self._init(total_bytes, media_type, media_category), 'acknowledged': set()}
+
+        self._append_all(source, state)
+        return self._finalize(state)
+
+    def _init(self, total_bytes, media_type, media_category):
+        data = {'command': 'INIT', 'total_bytes': total_bytes, 'media_type': media_type}
+        if media_category:
+            data['media_category'] = media_category
+
+        init_res = self.oauth.post(self.upload_url, data=data)
+        if init_res.status_code not in (200, 201, 202):
+            raise Exception({
+                'message': 'error initialising media upload',
+                'response_code': init_res.status_code,
+                'response_text': init_res.text,
+            })
+
+        media_id = init_res.json()['media_id_string']
+        logger.info(f'media upload initialised, media_id: {media_id}, bytes: {total_bytes}')
+        return media_id
+
+    def _segments(self, source, acknowledged):
+        """yields (segment_index, bytes) for every segment not yet acknowledged"""
+        if hasattr(source, 'read'):
+            # streams such as an s3 body have seek() but raise when it is called
+            seekable = hasattr(source, 'seek') and getattr(source, 'seekable', lambda: True)()
+            index = 0
+            while True:
+                if index in acknowledged and seekable:
+                    # skip acknowledged segments without reading them when the source allows it
+                    try:
+                        source.seek(self.segment_size, 1)
+                        index += 1
+                        continue
+                    except (io.UnsupportedOperation, OSError):
+                        # read past them instead
+                        seekable = False
+                segment = source.read(self.segment_size)
+                if not segment:
+                    return
+                if index not in acknowledged:
+                    yield index, segment
+                index += 1
+        else:
+            # re-buffer an iterable of arbitrarily sized chunks into fixed size segments
+            index = 0
+            buffer = bytearray()
+            for chunk in source:
+                buffer.extend(chunk)
+                while len(buffer) >= self.segment_size:
+                    if index not in acknowledged:
+                        yield index, bytes(buffer[:self.segment_size])
+                    del buffer[:self.segment_size]
+                    index += 1
+            if buffer and index not in acknowledged:
+                yield index, bytes(buffer)
+
+    def _append(self, media_id, index, segment):
+        """sends one segment, retrying with backoff, returns the segment index once acknowledged"""
+        data = {'command': 'APPEND', 'media_id': media_id, 'segment_index': index}
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                append_res = self.oauth.post(self.upload_url, data=data, files={'media': segment})
+                if 200 <= append_res.status_code < 300:
+                    return index
+                error = f'status code: {append_res.status_code}, response: {append_res.text}'
+            except Exception as e:
+                error = e
+            logger.warning(
+                f'error appending segment {index} of media_id: {media_id}, attempt {attempt + 1}, error: {error}')
+            if attempt < self.max_retries:
+                time.sleep(delay)
+                delay *= 2
+        raise Exception(f'segment {index} of media_id: {media_id} failed after {self.max_retries + 1} attempts, error: {error}')
+
+    def _append_all(self, source, state):
+        media_id = state['media_id']
+        try:
+            if self.max_workers == 1:
+                for index, segment in self._segments(source, state['acknowledged']):
+                    state['acknowledged'].add(self._append(media_id, index, segment))
+                return
+
+            # keep at most max_workers segments in flight so memory stays bounded
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = set()
+                try:
+                    for index, segment in self._segments(source, state['acknowledged']):
+                        if len(pending) >= self.max_workers:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            self._acknowledge(done, state)
+                        pending.add(executor.submit(self._append, media_id, index, segment))
+                    done, pending = wait(pending)
+                    self._acknowledge(done, state)
+                except Exception:
+                    # segments still in flight may yet be acknowledged, record them so a resume doesn't resend them
+                    done, pending = wait(pending)
+                    state['acknowledged'].update(future.result() for future in done if not future.exception())
+                    raise
+        except Exception as e:
+            logger.error(f'media upload failed, media_id: {media_id}, error: {e}')
+            raise MediaUploadError(
+                f'media upload failed, media_id: {media_id}, error: {e}',
+                {'media_id': media_id, 'acknowledged': sorted(state['acknowledged'])})
+
+    @staticmethod
+    def _acknowledge(futures, state):
+        """records every segment the futures sent, then raises the first failure"""
+        errors = [future.exception() for future in futures if future.exception()]
+        state['acknowledged'].update(future.result() for future in futures if not future.exception())
+        if errors:
+            raise errors[0]
+
+    def _finalize(self, state):
+        media_id = state['media_id']
+        finalize_res = self.oauth.post(self.upload_url, data={'command': 'FINALIZE', 'media_id': media_id})
+        if finalize_res.status_code not in (200, 201):
+            raise MediaUploadError(
+                f'error finalising media upload, media_id: {media_id}, status code: {finalize_res.status_code}, response: {finalize_res.text}',
+                {'media_id': media_id, 'acknowledged': sorted(state['acknowledged'])})
+
+        finalize_data = finalize_res.json()
+        processing_info = finalize_data.get('processing_info')
+
+        # wait for twitter to finish processing the media if it asks us to, but not past processing_max_wait
+        deadline = time.monotonic() + self.processing_max_wait
+        while processing_info and processing_info.get('state') in ('pending', 'in_progress'):
+            check_after = processing_info.get('check_after_secs', 1)
+            if time.monotonic() + check_after > deadline:
+                raise Exception(f'twitter did not process media_id: {media_id} within {self.processing_max_wait}s, '
+                                f'{processing_info}')
+            time.sleep(check_after)
+            status_res = self.oauth.get(self.upload_url, params={'command': 'STATUS', 'media_id': media_id})
+            processing_info = status_res.json().get('processing_info')
+
+        if processing_info and processing_info.get('state') == 'failed':
+            raise Exception(f'twitter failed to process media_id: {media_id}, {processing_info}')
+
+        logger.info(f'media upload finalised, media_id: {media_id}')
+        return finalize_data['media_id_string']
@@ -0,0 +1,213 @@
+import logging
+import re
+import threading
+from random import choice
+from string import Formatter
+from tracing import traced
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TWEET_LIMIT = 280
+# Twitter counts every link as 23 characters, whatever its real length, as it is wrapped in t.co
+URL_LENGTH = 23
+URL_PATTERN = re.compile(r'https?://\S+')
+ELLIPSIS = '…'
+# Shortest a truncated field is cut down to while another field still has text to give up
+MIN_FIELD_LENGTH = 12
+FORMAT_SPEC_PATTERN = re.compile(r'[\w.,<>^=+\- %#]*')
+
+# The templates each bot picks from, a template is picked at random and only that one is rendered
+TEMPLATE_SOURCES = {
+    'news': (
+        'some fascinating {topic} news:\n{title}\n{url}',
+        'wow look at this {topic} news:\n{title}\n{url}',
+        'interesting developments in the {topic} world, read about it here: \n{title}\n{url}',
+        'never a dull moment in {topic}. \n{title}\n{url}',
+        '{topic} news that has peaked my interest: \n{title}\n{url}',
+        "can't believe this {topic} news. \n{title}\n{url}",
+        'seen this {topic} news coming a mile off. \n{title}\n{url}',
+        'been waiting a long time for {topic} news like this. \n{title}\n{url}',
+        '{topic}! {topic}! read all about it!! \n{title}\n{url}',
+        'Intriguing update in the {topic} scene:\n{title}\n{url}',
+        'Shaking up the {topic} world with this: \n{title}\n{url}',
+        'Keep an eye on this unfolding {topic} story: \n{title}\n{url}',
+        'A must-read {topic} update: \n{title}\n{url}',
+        'Hot off the press, {topic} news. \n{title}\n{url}',
+        'In case you missed this {topic} news. \n{title}\n{url}',
+    ),
+    'weather_header': ('The next 7 days weather:\n',),
+    'weather_header_location': ('The next 7 days weather in {location}:\n',),
+    'weather_day': ('{day} {type} {temp}C\n',),
+    'spotify_number_1': ('The number 1 song for today was at the top on {date}, its {song} by {artist}, listen here:\n{link}',),
+    'spotify_reply': ('The number one song on {date} was {song} by {artist}, listen here:\n{link}',),
+    'nasa': ('The NASA image of the day today !\n{title}',),
+    'nasa_link': ("The NASA picture of the day isn't an image today, see it here !\n{title}\n{url}",),
+    'birthday': ('{user} Happy Birthday, you are {age} today, well done.',),
+}
+
+# Fields that may be shortened to keep a tweet within the limit, links are never shortened
+TRUNCATABLE_FIELDS = {
+    'news': ('title',),
+    'spotify_number_1': ('song', 'artist'),
+    'spotify_reply': ('song', 'artist'),
+    'nasa': ('title',),
+    'nasa_link': ('title',),
+    'weather_header_location': ('location',),
+}
+
+
+def tweet_length(text):
+    """returns the length twitter counts for a tweet, with every link counted as URL_LENGTH characters"""
+    length = len(text)
+    for url in URL_PATTERN.findall(text):
+        length += URL_LENGTH - len(url)
+    return length
+
+
+def shorten(value, by):
+    """shortens a value by at least 'by' characters, ending it with an ellipsis"""
+    if by <= 0:
+        return value
+    keep = len(value) - by - len(ELLIPSIS)
+    if keep <= 0:
+        return ELLIPSIS
+    return value[:keep].rstrip() + ELLIPSIS
+
+
+def split_excess(values, excess, keep):
+    """
+    Divides the characters to cut between fields in proportion to how far each is over keep characters,
+    so one long field isn't cut to nothing while another keeps all of its text.
+
+    Parameters:
+    values (dict): The truncatable field values
+    excess (int): Characters to cut in total
+    keep (int): Length no field is cut below
+
+    Returns:
+    dict: Characters to cut from each field, empty if none is over keep
+    """
+    spare = {name: len(value) - keep for name, value in values.items() if len(value) > keep}
+    total = sum(spare.values())
+    if not total:
+        return {}
+    # rounded up so the cuts add up to at least the excess, but never past what a field can spare
+    return {name: min(available, -(-excess * available // total)) for name, available in spare.items()}
+
+
+class Template:
+    """
+    A format string checked once, when it is loaded, and rendered with str.format_map, which formats
+    the whole message in one call as cheaply as the hand written f-strings it replaces.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.fields = set()
+
+        # only plain field names are allowed, so a template can't reach into attributes or items of a value
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            if field is None:
+                continue
+            if conversion or not field.isidentifier() or not FORMAT_SPEC_PATTERN.fullmatch(format_spec):
+                raise ValueError(f'template fields must be plain names with simple format specs: {source}')
+            self.fields.add(field)
+
+        self.render = source.format_map
+
+
+class TemplateSet:
+    """The templates for one kind of message, rendered within the tweet limit."""
+
+    def __init__(self, name, sources, truncatable=(), limit=TWEET_LIMIT):
+        self.name = name
+        self.templates = [Template(source) for source in sources]
+        self.truncatable = truncatable
+        self.limit = limit
+
+    def render(self, fields, index=None, limit=None):
+        """
+        Renders one template, picked at random unless index is given.
+
+        Parameters:
+        fields (dict): The values for the template's fields
+        index (int): Optional index of the template to render
+        limit (int): Optional limit in place of the set's, e.g. what is left of a tweet built from several parts
+
+        Returns:
+        str: The message, with truncatable fields shortened if it would be over the limit
+        """
+        limit = self.limit if limit is None else limit
+        template = choice(self.templates) if index is None else self.templates[index]
+        message = template.render(fields)
+
+        # every link counts as at most URL_LENGTH, so most messages are known to fit without measuring them
+        if len(message) + URL_LENGTH * message.count('http') <= limit:
+            return message
+
+        excess = tweet_length(message) - limit
+        truncatable = [name for name in self.truncatable if name in template.fields]
+        if excess > 0 and truncatable:
+            fields = {name: str(value) for name, value in fields.items()}
+            # share the cut between the fields, keeping MIN_FIELD_LENGTH of each while that is enough
+            for keep in (MIN_FIELD_LENGTH, len(ELLIPSIS)):
+                while excess > 0:
+                    cuts = split_excess({name: fields[name] for name in truncatable}, excess, keep)
+                    if not cuts:
+                        break
+                    for name, cut in cuts.items():
+                        fields[name] = shorten(fields[name], cut)
+                    message = template.render(fields)
+                    excess = tweet_length(message) - limit
+
+        if excess > 0:
+            logger.warning(f'{self.name} message is {excess} characters over the tweet limit')
+        return message
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def get_templates(name):
+    """returns the compiled TemplateSet for a kind of message, compiled once per container"""
+    try:
+        return _compiled[name]
+    except KeyError:
+        with _compiled_lock:
+            if name not in _compiled:
+                _compiled[name] = TemplateSet(name, TEMPLATE_SOURCES[name], TRUNCATABLE_FIELDS.get(name, ()))
+            return _compiled[name]
+
+
+@traced('render')
+def render(name, **fields):
+    """
+    Renders a message from one of the TEMPLATE_SOURCES.
+
+    Parameters:
+    name (str): The kind of message, a key of TEMPLATE_SOURCES
+    **fields: The values for the template's fields
+
+    Returns:
+    str: The message
+    """
+    return get_templates(name).render(fields)
+
+
+def render_within(name, limit, **fields):
+    """
+    Renders part of a message that has limit characters left for it, e.g. a header above lines
+    rendered separately.
+
+    Parameters:
+    name (str): The kind of message, a key of TEMPLATE_SOURCES
+    limit (int): Characters available for this part
+    **fields: The values for the template's fields
+
+    Returns:
+    str: The part, with truncatable fields shortened to fit limit
+    """
+    return get_templates(name).render(fields, limit=limit)
@@ -0,0 +1,166 @@
+"""
+Pool of news articles for tweet_news.
+
+One refresh fetches the top headlines of every category concurrently and keeps all the articles,
+not just the first, in SQLite. Runs are then served from the pool, skipping urls already tweeted,
+until it runs dry or the articles expire, so most runs make no calls to the News API.
+"""
+import logging
+from os import environ
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from random import choice
+from http_cache import get_http_session
+from tracing import span
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+NEWS_URL = 'https://newsapi.org/v2/top-headlines?'
+NEWS_CATEGORIES = ['business', 'entertainment', 'health', 'science', 'sports', 'technology']
+
+# kept in /tmp between warm invocations by default, see container_state
+NEWS_POOL_PATH = environ.get('NEWS_POOL_PATH', os.path.join(tempfile.gettempdir(), 'news_pool.sqlite3'))
+# Seconds articles stay in the pool before a refresh is needed
+NEWS_POOL_TTL = int(environ.get('NEWS_POOL_TTL', 6 * 60 * 60))
+# Seconds a tweeted url is remembered so a later refresh doesn't bring it back
+NEWS_TWEETED_TTL = int(environ.get('NEWS_TWEETED_TTL', 7 * 24 * 60 * 60))
+NEWS_PAGE_SIZE = int(environ.get('NEWS_PAGE_SIZE', 100))
+NEWS_TIMEOUT = float(environ.get('NEWS_TIMEOUT', 10))
+
+
+def fetch_category(category, page_size=NEWS_PAGE_SIZE, timeout=NEWS_TIMEOUT):
+    """
+    Fetches the top headlines for one category from the News API
+
+    Returns:
+    list: The article dictionaries returned for the category
+    """
+    params = {
+        'apikey': environ.get('NEWS_API_KEY'),
+        'category': category,
+        'language': 'en',
+        'pageSize': page_size,
+    }
+    with span('fetch', source='news', category=category) as fetch_span:
+        response = get_http_session().get(NEWS_URL, params=params, timeout=timeout)
+        fetch_span.set(status_code=response.status_code)
+        fetch_span.add_bytes(len(response.content))
+    try:
+        return response.json()['articles']
+    except (KeyError, ValueError):
+        logger.error(f'error getting {category} news, status code of request: {response.status_code}')
+        raise KeyError(f'No article data returned from api for {category}.')
+
+
+class NewsPool:
+    """
+    Class holding fetched articles in SQLite with the time they expire and, once tweeted, when they were tweeted.
+    """
+
+    def __init__(self, path=NEWS_POOL_PATH, ttl=NEWS_POOL_TTL, tweeted_ttl=NEWS_TWEETED_TTL):
+        self.ttl = ttl
+        self.tweeted_ttl = tweeted_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS articles ('
+            'url TEXT PRIMARY KEY, category TEXT NOT NULL, article TEXT NOT NULL, '
+            'expires REAL NOT NULL, tweeted REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS articles_available ON articles (tweeted, expires)')
+        self._db.commit()
+
+    def add(self, category, articles):
+        """adds articles to the pool, articles already in it keep whether they were tweeted. Returns the number added"""
+        expires = time.time() + self.ttl
+        rows = [(article['url'], category, json.dumps(article), expires)
+                for article in articles if article.get('url') and article.get('title')]
+        # insert then update rather than an upsert, which needs SQLite 3.24 and the python 3.9 lambda runtime has 3.7
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO articles (url, category, article, expires) VALUES (?, ?, ?, ?)', rows)
+            self._db.executemany(
+                'UPDATE articles SET expires = ? WHERE url = ? AND tweeted IS NULL',
+                [(expires, url) for url, _, _, _ in rows])
+            self._db.commit()
+        return len(rows)
+
+    def available(self):
+        """returns the number of untweeted articles that haven't expired, per category"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT category, COUNT(*) FROM articles WHERE tweeted IS NULL AND expires > ? GROUP BY category',
+                (time.time(),)).fetchall()
+        return dict(rows)
+
+    def take(self, category=None):
+        """
+        Picks an untweeted article that hasn't expired, from a random category unless one is given.
+
+        Returns:
+        dict: {'article_data', 'news_category'}, or None if the pool has run dry
+        """
+        available = self.available()
+        if category is None:
+            if not available:
+                return None
+            category = choice(list(available))
+        elif not available.get(category):
+            return None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT article FROM articles WHERE category = ? AND tweeted IS NULL AND expires > ? '
+                'ORDER BY rowid LIMIT 1', (category, time.time())).fetchone()
+        return {'article_data': json.loads(row[0]), 'news_category': category} if row else None
+
+    def mark_tweeted(self, url):
+        """records an article as tweeted so it isn't picked again"""
+        with self._lock:
+            self._db.execute('UPDATE articles SET tweeted = ? WHERE url = ?', (time.time(), url))
+            self._db.commit()
+
+    def prune(self):
+        """removes expired articles that weren't tweeted and tweeted ones older than tweeted_ttl"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM articles WHERE (tweeted IS NULL AND expires <= ?) OR tweeted <= ?',
+                (now, now - self.tweeted_ttl))
+            self._db.commit()
+
+    def refresh(self, categories=NEWS_CATEGORIES, fetch=fetch_category):
+        """
+        Fetches every category concurrently and adds the articles to the pool, a failed category is
+        logged and skipped so the others are still pooled.
+
+        Returns:
+        dict: category -> number of articles added, or the error for categories that failed
+        """
+        self.prune()
+        start = time.perf_counter()
+
+        def fetch_into_pool(category):
+            try:
+                return category, self.add(category, fetch(category))
+            except Exception as e:
+                logger.error(f'error refreshing {category} news, error: {e}')
+                return category, str(e)
+
+        with ThreadPoolExecutor(max_workers=len(categories)) as executor:
+            results = dict(executor.map(fetch_into_pool, categories))
+        logger.info(f'news pool refreshed in {time.perf_counter() - start:.3f}s, {results}')
+        return results
+
+
+@per_container
+def get_news_pool():
+    """returns the news pool, opened once per container"""
+    return NewsPool()
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, 'rate' tokens are added per second up to 'capacity'.
+    acquire() blocks until a token is available so callers are smoothed to the rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters:
+        rate (float): Tokens added per second
+        capacity (float): Maximum number of tokens held, defaults to one second's worth (at least 1)
+        """
+        self.rate = float(rate)
+        self.base_rate = self.rate
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """takes tokens if they are available, returns the seconds to wait until they will be (0 if taken)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            if self.rate <= 0:
+                return float('inf')
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, max_wait=None):
+        """
+        Blocks until tokens are available.
+
+        Parameters:
+        tokens (float): Number of tokens to take
+        max_wait (float): Seconds to wait at most, None waits as long as needed
+
+        Returns:
+        bool: True if the tokens were taken, False if max_wait would have been exceeded
+        """
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def set_state(self, tokens, reset_in):
+        """
+        Overwrites the bucket with a budget reported by the server.
+
+        Parameters:
+        tokens (float): Requests remaining in the current window
+        reset_in (float): Seconds until the window resets
+        """
+        with self._lock:
+            self.tokens = float(tokens)
+            self.updated = time.monotonic()
+            if reset_in > 0 and tokens < self.capacity:
+                # spread the remaining budget evenly over the rest of the window
+                self.rate = max(tokens, 1) / reset_in
+            else:
+                self.rate = self.base_rate
+
+
+class HostRateLimiter:
+    """Keeps a TokenBucket per host so requests to each host are limited separately."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url_or_host):
+        host = urlparse(url_or_host).netloc or url_or_host
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self.buckets[host]
+
+    def acquire(self, url_or_host, max_wait=None):
+        """blocks until a request to the url's host is allowed, see TokenBucket.acquire"""
+        return self.bucket(url_or_host).acquire(max_wait=max_wait)
@@ -0,0 +1,136 @@
+"""
+Storage for the Birthdays table.
+
+Every item carries a derived 'birthday_md' attribute (MM-DD) which is the partition key of the
+'birthday_md-index' global secondary index, so the daily lookup queries only today's birthdays
+instead of scanning the whole table.
+
+Backfill 'birthday_md' for items written before it existed with:
+python birthday_store.py migrate [--endpoint-url http://localhost:8000]
+"""
+import logging
+from os import environ
+import argparse
+import calendar
+from datetime import datetime
+import boto3
+from boto3.dynamodb.conditions import Key, Attr
+
+# set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+BIRTHDAYS_TABLE = environ.get('BIRTHDAYS_TABLE', 'Birthdays')
+MONTH_DAY_INDEX = environ.get('BIRTHDAYS_MONTH_DAY_INDEX', 'birthday_md-index')
+MONTH_DAY_ATTRIBUTE = 'birthday_md'
+
+# set DYNAMODB_ENDPOINT_URL to use DynamoDB Local or another stand-in
+DYNAMODB_ENDPOINT_URL = environ.get('DYNAMODB_ENDPOINT_URL')
+
+
+def get_birthdays_table(endpoint_url=DYNAMODB_ENDPOINT_URL):
+    """returns the Birthdays table resource"""
+    dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+    return dynamodb.Table(BIRTHDAYS_TABLE)
+
+
+def month_day(date_str):
+    """takes a date YYYY-MM-DD and returns its month and day as MM-DD"""
+    return datetime.strptime(date_str, '%Y-%m-%d').strftime('%m-%d')
+
+
+def month_day_keys(today):
+    """returns the MM-DD keys to be wished on a date, people born on the 29th of february
+    are wished on the 28th in years that aren't leap years"""
+    keys = [today.strftime('%m-%d')]
+    if today.month == 2 and today.day == 28 and not calendar.isleap(today.year):
+        keys.append('02-29')
+    return keys
+
+
+def put_birthday(username, date_str, table=None):
+    """
+    Adds or updates a user's birthday, writing the derived month-day attribute with it.
+
+    Parameters:
+    username (str): The twitter username
+    date_str (str): The birthday YYYY-MM-DD
+
+    Returns:
+    dict: The put_item response
+    """
+    table = table or get_birthdays_table()
+    return table.put_item(
+        Item={
+            'username': username,
+            'birthday': date_str,
+            MONTH_DAY_ATTRIBUTE: month_day(date_str),
+        }
+    )
+
+
+def query_birthdays(month_day_key, table=None):
+    """
+    Yields every item whose birthday falls on a month and day, following LastEvaluatedKey
+    so results past the 1MB page limit aren't lost.
+
+    Parameters:
+    month_day_key (str): The month and day MM-DD
+    """
+    table = table or get_birthdays_table()
+    kwargs = {
+        'IndexName': MONTH_DAY_INDEX,
+        'KeyConditionExpression': Key(MONTH_DAY_ATTRIBUTE).eq(month_day_key),
+    }
+    while True:
+        response = table.query(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def migrate_month_day(table=None):
+    """
+    One-shot migration that backfills the month-day attribute on items missing it.
+
+    Returns:
+    int: The number of items updated
+    """
+    table = table or get_birthdays_table()
+    kwargs = {'FilterExpression': Attr(MONTH_DAY_ATTRIBUTE).not_exists()}
+    updated = 0
+    while True:
+        response = table.scan(**kwargs)
+        for item in response['Items']:
+            try:
+                key = month_day(item['birthday'])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"skipping item with invalid birthday, username: {item.get('username')}, error: {e}")
+                continue
+            table.update_item(
+                Key={'username': item['username']},
+                UpdateExpression=f'SET {MONTH_DAY_ATTRIBUTE} = :md',
+                ExpressionAttributeValues={':md': key},
+            )
+            updated += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    logger.info(f'month-day attribute backfilled on {updated} items')
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--endpoint-url', default=DYNAMODB_ENDPOINT_URL, help='e.g. DynamoDB Local')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    migrate_month_day(get_birthdays_table(args.endpoint_url))
+
+
+if __name__ == '__main__':
+    main()
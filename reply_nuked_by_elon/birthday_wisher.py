@@ -1,25 +1,45 @@
 from datetime import datetime, date
 import logging
-import boto3
+from os import environ
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tweet_dispatcher import dispatch_tweet
+from rate_limit import TokenBucket
+from birthday_store import get_birthdays_table, month_day_keys, query_birthdays
+from message_templates import render
+from tracing import traced_handler
 
 # set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# birthday tweets are sent concurrently but no faster than the posting rate limit
+BIRTHDAY_WORKERS = int(environ.get('BIRTHDAY_WORKERS', 4))
+BIRTHDAY_TWEETS_PER_SECOND = float(environ.get('BIRTHDAY_TWEETS_PER_SECOND', 1))
+BIRTHDAY_MAX_ATTEMPTS = int(environ.get('BIRTHDAY_MAX_ATTEMPTS', 3))
+BIRTHDAY_RETRY_BACKOFF = float(environ.get('BIRTHDAY_RETRY_BACKOFF', 2))
 
+
+@traced_handler
 def lambda_handler(event, context):
     try:
         birthdays_today = check_birthdays()
-        for birthday in birthdays_today:
-            bday_tweet = write_birthday_message(birthday)
-            logger.info(f'tweet_text function called for {birthday}')
-            tweet_text(bday_tweet)
-        
+        report = send_birthday_tweets(birthdays_today)
+
+        # 207 when only some of the birthday messages could be sent
+        if not report['failed']:
+            status_code, message = 200, 'Birthday messages sent successfully!'
+        elif report['sent']:
+            status_code, message = 207, 'Some birthday messages could not be sent'
+        else:
+            status_code, message = 500, 'Birthday messages could not be sent'
+
         return {
-            'statusCode': 200,
+            'statusCode': status_code,
             'body': json.dumps({
-                'message': 'Birthday messages sent successfully!',
+                'message': message,
+                'report': report,
             }),
         }
     except Exception as e:
@@ -34,27 +54,24 @@ def lambda_handler(event, context):
         }
 
 def check_birthdays():
-    """reads the birthdays table and checks the data to see if any of the birthdays match the current date,
+    """queries the birthdays table for the birthdays that fall on the current date,
     if there are birthdays today returns a list of dictionaires, each dictionary containing the twitter username, 'user',
     and their age, 'age'.
     if there are no birthdays returns a empty list"""
     logger.info('checking datbase for birthdays')
-   
-    dynamodb = boto3.resource('dynamodb') # Instantiate a DynamoDB client
-    table = dynamodb.Table('Birthdays')
-    # Get today's date as a string
+
+    table = get_birthdays_table()
     today = datetime.now()
 
-    # Scan the entire table
-    response = table.scan()
+    # Query the month-day index so only today's birthdays are read
     todays_birthdays = []
-    for item in response['Items']:
-        bday = datetime.strptime(item['birthday'], '%Y-%m-%d')
-        if bday.day == today.day and bday.month == today.month:  # check if birthday is today
+    for key in month_day_keys(today):
+        for item in query_birthdays(key, table):
+            bday = datetime.strptime(item['birthday'], '%Y-%m-%d')
             logger.info(f"birthday found on {today} for {item['username']}")
             age = round((today - bday).days/365)
             todays_birthdays.append({'user': f"@{item['username']}", 'age': age})
-    print(todays_birthdays)
+    logger.info(f'birthdays today: {todays_birthdays}')
     return todays_birthdays
     
 
@@ -62,31 +79,50 @@ def write_birthday_message(data):
     """input is list item containing a dictionary from the Birthday class's check_birthdays method, writes a message to be tweeted"""
     user = data['user']
     age = data['age']
-    message = f"{user} Happy Birthday, you are {age} today, well done."
-    print(message)
+    message = render('birthday', user=user, age=age)
+    logger.info(f'birthday message written: {message}')
     return message
     
 
+def send_birthday_tweets(birthdays, workers=BIRTHDAY_WORKERS, rate=BIRTHDAY_TWEETS_PER_SECOND,
+                         max_attempts=BIRTHDAY_MAX_ATTEMPTS, backoff=BIRTHDAY_RETRY_BACKOFF):
+    """sends a birthday tweet for each item from check_birthdays using a bounded pool of workers, failed tweets are
+    retried with backoff and one user failing doesn't stop the others. returns a report dictionary with a list of
+    results for the users that were sent, 'sent', and that failed, 'failed'"""
+    limiter = TokenBucket(rate)
+    # every birthday gets at least one attempt
+    max_attempts = max(1, max_attempts)
+
+    def send(birthday):
+        bday_tweet = write_birthday_message(birthday)
+        delay = backoff
+        for attempt in range(1, max_attempts + 1):
+            limiter.acquire()
+            try:
+                logger.info(f'tweet_text function called for {birthday}, attempt {attempt}')
+                tweet_text(bday_tweet)
+                return {'user': birthday['user'], 'attempts': attempt}
+            except Exception as e:
+                error = str(e)
+                logger.error(f"error sending birthday tweet for {birthday['user']}, attempt {attempt}, error: {e}")
+                if attempt < max_attempts:
+                    time.sleep(delay)
+                    delay *= 2
+        return {'user': birthday['user'], 'attempts': max_attempts, 'error': error}
+
+    report = {'sent': [], 'failed': []}
+    if not birthdays:
+        return report
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(birthdays)))) as executor:
+        for result in executor.map(send, birthdays):
+            report['failed' if 'error' in result else 'sent'].append(result)
+
+    logger.info(f"birthday tweets sent: {len(report['sent'])}, failed: {len(report['failed'])}")
+    return report
+
+
 def tweet_text(message):
-    
-    lambda_client = boto3.client('lambda') # Initiate boto3 client for lambda
-    # Invoke the 'tweet_text' Lambda function
-    response = lambda_client.invoke(
-        FunctionName='twiter_bot_tweet_text',
-        InvocationType='RequestResponse',
-        Payload=json.dumps({'message': message})
-    )
-    response_payload = json.loads(response['Payload'].read())
-    if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-        logger.error('Error sending tweet')
-        logger.error(response_payload)
-        raise Exception(response_payload)
-    # Handle the response from the 'tweet_text' Lambda function
-    if response['StatusCode'] == 200:
-        logger.info('Tweet successfully sent')
-    else:
-        logger.error(response['StatusCode'])
-        logger.error()
-        raise Exception(
-            f'Tweet was not sent. status code {response["StatusCode"]}.')
+    """sends the message as a tweet, raises an exception if the tweet was not sent"""
+    dispatch_tweet(message)
 
@@ -0,0 +1,166 @@
+"""
+Storage for the mention ingestion state, in the MentionState table (partition key 'key').
+
+Two kinds of item live in the table:
+- 'cursor#<user id>' holds 'since_id', below which every mention has been handled, so each poll only
+  asks twitter for mentions after it. While a backlog too long for one run is worked through it also
+  holds 'until_id', the oldest mention read so far, and 'newest_id', where since_id moves once the
+  mentions between since_id and until_id have been read.
+- 'mention#<tweet id>' marks a mention as claimed for a reply. The claim is conditional, so a mention
+  fetched again by an overlapping or retried run is never replied to twice. A mention whose reply failed
+  is released to be claimed again, up to MENTION_MAX_ATTEMPTS times, and a claim left by a run that
+  died before replying is taken over once MENTION_CLAIM_TIMEOUT has passed. These items carry an
+  'expires_at' epoch, set it as the table's TTL attribute to keep the set small.
+"""
+import logging
+from os import environ
+import time
+from decimal import Decimal
+import boto3
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr
+from container_state import per_container
+
+# set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MENTIONS_TABLE = environ.get('MENTIONS_TABLE', 'MentionState')
+# seconds a processed mention id is remembered, well past how far back a since_id poll can reach
+MENTION_ID_TTL = int(environ.get('MENTION_ID_TTL', 30 * 24 * 60 * 60))
+# replies tried for a mention before it is given up on, so one that always fails can't hold the cursor back
+MENTION_MAX_ATTEMPTS = int(environ.get('MENTION_MAX_ATTEMPTS', 3))
+# seconds a claim is held before another run may take the mention over, longer than a run can last
+MENTION_CLAIM_TIMEOUT = int(environ.get('MENTION_CLAIM_TIMEOUT', 15 * 60))
+
+# set DYNAMODB_ENDPOINT_URL to use DynamoDB Local or another stand-in
+DYNAMODB_ENDPOINT_URL = environ.get('DYNAMODB_ENDPOINT_URL')
+
+
+@per_container
+def get_mentions_table():
+    """returns the MentionState table resource, created once per container"""
+    dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT_URL)
+    return dynamodb.Table(MENTIONS_TABLE)
+
+
+def get_cursor(user_id, table=None):
+    """
+    Reads where the next poll starts.
+
+    Parameters:
+    user_id (str): The bot account's user id
+
+    Returns:
+    dict: 'since_id', None before the first poll, and 'until_id' and 'newest_id', None unless a backlog
+          is being worked through
+    """
+    table = table or get_mentions_table()
+    item = table.get_item(Key={'key': f'cursor#{user_id}'}).get('Item') or {}
+    return {name: str(item[name]) if name in item else None for name in ('since_id', 'until_id', 'newest_id')}
+
+
+def save_cursor(user_id, since_id, until_id=None, newest_id=None, table=None):
+    """
+    Saves where the next poll starts, since_id is never moved backwards by an older run.
+
+    Parameters:
+    user_id (str): The bot account's user id
+    since_id (str): Id below which every mention has been handled
+    until_id (str): Oldest mention read while a backlog is worked through, the next poll reads the ones before it
+    newest_id (str): Where since_id moves once the backlog has been read
+
+    Returns:
+    bool: True if the cursor was saved
+    """
+    table = table or get_mentions_table()
+    values = {':since_id': Decimal(since_id), ':now': Decimal(int(time.time()))}
+    if until_id:
+        update = 'SET since_id = :since_id, until_id = :until_id, newest_id = :newest_id, updated_at = :now'
+        values.update({':until_id': Decimal(until_id), ':newest_id': Decimal(newest_id)})
+    else:
+        update = 'SET since_id = :since_id, updated_at = :now REMOVE until_id, newest_id'
+    try:
+        table.update_item(
+            Key={'key': f'cursor#{user_id}'},
+            UpdateExpression=update,
+            ConditionExpression=Attr('since_id').not_exists() | Attr('since_id').lte(Decimal(since_id)),
+            ExpressionAttributeValues=values,
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def claim_mention(mention_id, timeout=MENTION_CLAIM_TIMEOUT, table=None):
+    """
+    Claims a mention for a reply, only one caller can hold the claim. A released mention can be claimed
+    again until it has been tried MENTION_MAX_ATTEMPTS times, and a claim older than timeout is taken over.
+
+    Parameters:
+    mention_id (str): The mention's tweet id
+    timeout (int): Seconds after which a claim that was never replied to or released is taken over
+
+    Returns:
+    str: 'claimed' if the claim was made, 'held' if another run holds an unexpired claim on it, or 'done'
+         if it was replied to or given up on
+    """
+    table = table or get_mentions_table()
+    now = int(time.time())
+    try:
+        table.update_item(
+            Key={'key': f'mention#{mention_id}'},
+            UpdateExpression='SET #status = :status, claimed_at = :now, expires_at = :expires_at',
+            ConditionExpression=Attr('key').not_exists()
+            | (Attr('status').eq('released') & Attr('attempts').lt(MENTION_MAX_ATTEMPTS))
+            | (Attr('status').eq('replying') & Attr('claimed_at').lte(now - timeout)),
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'replying', ':now': now, ':expires_at': now + MENTION_ID_TTL},
+        )
+        return 'claimed'
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    item = table.get_item(Key={'key': f'mention#{mention_id}'}).get('Item', {})
+    return 'held' if item.get('status') == 'replying' else 'done'
+
+
+def mark_replied(mention_id, reply_id=None, table=None):
+    """records that the reply to a claimed mention was sent"""
+    table = table or get_mentions_table()
+    table.update_item(
+        Key={'key': f'mention#{mention_id}'},
+        UpdateExpression='SET #status = :status, reply_id = :reply_id',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':status': 'replied', ':reply_id': reply_id},
+    )
+
+
+def release_mention(mention_id, attempted=True, table=None):
+    """
+    Drops the claim on a mention whose reply wasn't sent so the next run tries it again.
+
+    Parameters:
+    mention_id (str): The mention's tweet id
+    attempted (bool): Whether a reply was tried and counts towards MENTION_MAX_ATTEMPTS, False when the
+                      run stopped before trying, e.g. when rate limited
+
+    Returns:
+    bool: True if the mention will be tried again, False if it has been given up on
+    """
+    table = table or get_mentions_table()
+    response = table.update_item(
+        Key={'key': f'mention#{mention_id}'},
+        UpdateExpression='SET #status = :status, attempts = if_not_exists(attempts, :zero) + :attempt',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':status': 'released', ':zero': 0, ':attempt': 1 if attempted else 0},
+        # an update that leaves attempts as it was may not return it with UPDATED_NEW
+        ReturnValues='ALL_NEW',
+    )
+    attempts = response['Attributes']['attempts']
+    if attempts >= MENTION_MAX_ATTEMPTS:
+        logger.warning(f'giving up on mention after {attempts} attempts, id: {mention_id}')
+        return False
+    return True
@@ -2,11 +2,18 @@ from datetime import datetime, timedelta
 import logging
 from os import environ
 import re
-from requests_oauthlib import OAuth1Session
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from twitter_client import get_twitter_client, RateLimitedError
+from tweet_dispatcher import get_lambda_client
+from billboard_index import chart_week
+from single_flight import SingleFlight
 from dateutil.parser import parse as dateparser
-import boto3
 import json
-import pprint
+from birthday_store import get_birthdays_table, put_birthday
+from mention_store import get_cursor, save_cursor, claim_mention, mark_replied, release_mention
+from message_templates import render
+from tracing import span, traced_handler
 
 ####                                                                                           ####
 #### NUKED BY ELON, APIPOCALYPSE, CAN NO LONGER READ TWEETS ON FREE TIER -> REPLIES IN THE BIN #### 
@@ -17,31 +24,38 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 user_id = environ.get('TWITTER_USER_ID')
-print(user_id)
-print(environ.get("TWITTER_API_KEY"),environ.get("TWITTER_API_SECRET"),environ.get("TWITTER_API_ACCESS_TOKEN"),environ.get("TWITTER_API_ACCESS_TOKEN_SECRET"))
 
 MENTIONS_LOOKUP_URL = f'https://api.twitter.com/2/users/{user_id}/mentions'
 TWEET_URL = 'https://api.twitter.com/2/tweets'
+MENTIONS_PAGE_SIZE = int(environ.get('MENTIONS_PAGE_SIZE', 100))
+MENTIONS_MAX_PAGES = int(environ.get('MENTIONS_MAX_PAGES', 10))
+# Number of replies worked out at once, each may invoke the spotify lambda
+REPLY_WORKERS = int(environ.get('REPLY_WORKERS', 8))
+# Seconds a chart week's song is remembered for, so a burst of mentions about one date makes one lookup
+SPOTIFY_REPLY_MEMO_TTL = int(environ.get('SPOTIFY_REPLY_MEMO_TTL', 15 * 60))
 
-oauth = OAuth1Session(
-            environ.get("TWITTER_API_KEY"),
-            client_secret=environ.get("TWITTER_API_SECRET"),
-            resource_owner_key=environ.get("TWITTER_API_ACCESS_TOKEN"),
-            resource_owner_secret=environ.get(
-                "TWITTER_API_ACCESS_TOKEN_SECRET"),
-        )
+# kept at module level so the memo carries over between warm invocations
+spotify_lookups = SingleFlight(ttl=SPOTIFY_REPLY_MEMO_TTL)
 
 
+@traced_handler
 def lambda_handler(event, context):
     try:
-        mentions_in_past_hour = get_mentions_in_past_hour()
-    
-        if mentions_in_past_hour:
+        # only mentions newer than the last one handled are fetched
+        cursor = get_cursor(user_id)
+        mentions = get_new_mentions(cursor['since_id'], cursor['until_id'])
+        counts = {}
+
+        if mentions:
             logger.info('reply_to_mentions function called')
-            reply_to_mentions(mentions=mentions_in_past_hour)
-            message = "replies sent succesfully"
+            counts = reply_to_mentions(mentions=mentions)
+            message = f"replies sent succesfully, {counts}"
         else:
             message = "no replies to send"
+
+        next_cursor = advance_cursor(cursor, mentions['meta'] if mentions else {}, counts.get('oldest_retry'))
+        if next_cursor:
+            save_cursor(user_id, *next_cursor)
         return {
                 'statusCode': 200,
                 'body': json.dumps({
@@ -60,67 +74,216 @@ def lambda_handler(event, context):
         }
 
 
-def get_mentions_in_past_hour():
-
-    dtformat = '%Y-%m-%dT%H:%M:%SZ'
-    time = datetime.utcnow()
-    one_hour = time - timedelta(hours=1)
-    one_hour = one_hour.strftime(dtformat)
-
-    params = {"user.fields": "username",
-              "expansions": "author_id", "start_time": one_hour}
-
-    # retrieve data for the mentions recieved in the past hour from the twitter api
-    mentions_res = oauth.get(url=MENTIONS_LOOKUP_URL, params=params)
-    print(mentions_res.text)
-
-    mentions_data = mentions_res.json()
-    pprint.pprint(mentions_data, indent=2)
-
-    if mentions_res.status_code == 200:
-        logger.info('request to retrieve mentions data successful')
+def get_new_mentions(since_id=None, until_id=None, max_results=MENTIONS_PAGE_SIZE, max_pages=MENTIONS_MAX_PAGES):
+    """
+    Fetches the mentions newer than since_id, following next_token through up to max_pages pages.
+
+    Parameters:
+    since_id (str): Id below which every mention has been handled, None on the first poll which then
+                    reads the past hour
+    until_id (str): Optional id to read the mentions before, to carry on through a backlog
+    max_results (int): Mentions per page, 100 is the most the api allows
+    max_pages (int): Most pages read in one run, the rest are fetched by the next run
+
+    Returns:
+    dict: The mentions 'data', 'includes' with the authors' 'users' and 'meta' with 'result_count',
+          'newest_id', 'oldest_id' and 'next_token' if there are pages left unread, or None if there
+          are no new mentions
+    """
+    params = {"user.fields": "username", "expansions": "author_id", "max_results": max_results}
+    if since_id:
+        params['since_id'] = since_id
     else:
-        logger.error(
-            f'error with request to retrieve mentions data, status code of response: {mentions_res.status_code}, response {mentions_res.text}')
-        return None
-
-    # if there are mentions from the past hour
-    if mentions_data['meta']['result_count'] > 0:
-        logger.info('mentions found in the past hour')
-        return mentions_data
+        one_hour = datetime.utcnow() - timedelta(hours=1)
+        params['start_time'] = one_hour.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if until_id:
+        params['until_id'] = until_id
+
+    client = get_twitter_client()
+    mentions = {'data': [], 'includes': {'users': []},
+                'meta': {'result_count': 0, 'newest_id': None, 'oldest_id': None}}
+    for page in range(max_pages):
+        # retrieve a page of mentions from the twitter api
+        mentions_res = client.get(MENTIONS_LOOKUP_URL, params=params)
+        if mentions_res.status_code != 200:
+            logger.error(
+                f'error with request to retrieve mentions data, status code of response: {mentions_res.status_code}, response {mentions_res.text}')
+            raise Exception(f'error retrieving mentions, status code: {mentions_res.status_code}')
+
+        mentions_data = mentions_res.json()
+        meta = mentions_data.get('meta', {})
+        mentions['data'].extend(mentions_data.get('data', []))
+        mentions['includes']['users'].extend(mentions_data.get('includes', {}).get('users', []))
+        # the first page holds the newest mentions and the last the oldest
+        mentions['meta']['newest_id'] = mentions['meta']['newest_id'] or meta.get('newest_id')
+        mentions['meta']['oldest_id'] = meta.get('oldest_id', mentions['meta']['oldest_id'])
+
+        if 'next_token' not in meta:
+            break
+        params['pagination_token'] = meta['next_token']
     else:
-        logger.info('no mentions in past hour')
+        # advance_cursor keeps the cursor below the pages left unread, the next run carries on from oldest_id
+        logger.warning(f"more than {max_pages} pages of mentions, the next run reads those before {mentions['meta']['oldest_id']}")
+        mentions['meta']['next_token'] = meta['next_token']
+
+    mentions['meta']['result_count'] = len(mentions['data'])
+    logger.info(f"{mentions['meta']['result_count']} new mentions read in {page + 1} pages")
+    return mentions if mentions['data'] else None
+
+
+def advance_cursor(cursor, meta, oldest_retry=None):
+    """
+    Works out where the next poll starts. since_id only moves past mentions that have all been dealt with,
+    so it stays below pages left unread and below mentions released to be tried again.
+
+    Parameters:
+    cursor (dict): The cursor the run started from, as returned by get_cursor
+    meta (dict): The 'meta' of the mentions read, empty if there were none
+    oldest_retry (str): Id of the oldest mention released to be tried again, if any
+
+    Returns:
+    tuple: The since_id, until_id and newest_id to save, or None if the cursor stays as it is
+    """
+    # the newest mention of the range being read, while carrying on through a backlog it was read by an earlier run
+    newest_id = cursor['newest_id'] if cursor['until_id'] else meta.get('newest_id')
+    if newest_id is None:
         return None
-
-
-def reply_to_mentions(mentions):
-
+    if oldest_retry:
+        # the mention is fetched again as long as since_id stays below it
+        newest_id = str(min(int(newest_id), int(oldest_retry) - 1))
+
+    # the first poll only reads back an hour, so there is no older backlog worth keeping its place for
+    if meta.get('next_token') and cursor['since_id']:
+        return cursor['since_id'], meta['oldest_id'], newest_id
+    return newest_id, None, None
+
+
+def reply_to_mentions(mentions, workers=REPLY_WORKERS):
+    """
+    Replies to each mention that hasn't been replied to before, as a pipeline: the mentions are claimed
+    and classified up front, replies needing a slow lookup (the spotify lambda, the birthdays table) are
+    worked out concurrently and each reply is posted through the rate limit aware client as soon as it is ready.
+
+    Parameters:
+    mentions (dict): Mentions as returned by get_new_mentions
+    workers (int): Number of reply lookups run at once
+
+    Returns:
+    dict: The number of replies 'sent', mentions 'skipped' as already processed and replies 'failed',
+          'oldest_retry' the oldest mention still to be replied to, released or claimed by another run, and 'stages' holding the count,
+          seconds and throughput of each stage
+    """
+    client = get_twitter_client()
+    counts = {'sent': 0, 'skipped': 0, 'failed': 0}
+    stages = {}
+    retry_ids = []
+
+    def release(mention_id, attempted=True):
+        counts['failed'] += 1
+        if release_mention(mention_id, attempted):
+            retry_ids.append(mention_id)
+
+    def record_stage(name, count, seconds):
+        stages[name] = {'count': count, 'seconds': round(seconds, 3),
+                        'per_second': round(count / seconds, 2) if seconds else None}
+
+    # usernames of the users who mentioned the bot account, looked up by author id
+    usernames = {user['id']: user['username'] for user in mentions['includes']['users']}
+
+    # claim and classify every mention, claiming first so a concurrent or retried run can't reply to it as well
+    start = time.perf_counter()
+    claimed = []
     for mention in mentions['data']:  # loop for each tweet mention recieved
-
-        message, reply_id, author_id = mention['text'], mention['id'], mention['author_id']
-        user = [user['username'] for user in mentions['includes']
-                ['users'] if author_id == user['id']]  # username of user who mentioned the bot account
-
-        logger.info('select_reply function called')
-        reply_message = select_reply(message, user[0])  # create reply messsage
-
+        claim = claim_mention(mention['id'])
+        if claim != 'claimed':
+            logger.info(f"mention {'claimed by another run' if claim == 'held' else 'already processed'}, id: {mention['id']}")
+            if claim == 'held':
+                # the run holding it may yet die before replying, the cursor stays below it until it's done
+                retry_ids.append(mention['id'])
+            counts['skipped'] += 1
+            continue
+        claimed.append((mention, usernames.get(mention['author_id']), classify_mention(mention['text'])))
+    record_stage('classify', len(mentions['data']), time.perf_counter() - start)
+
+    def post_reply(mention, user, reply_message):
+        reply_id = mention['id']
         reply = {"text": reply_message, "reply": {
             "in_reply_to_tweet_id": reply_id}}
-        # send reply tweet using twitter api
-        reply_res = oauth.post(url=TWEET_URL, json=reply)
-
+        # send reply tweet using twitter api, waits for rate limit budget if needed
+        with span('post', kind='reply') as post_span:
+            reply_res = client.post(TWEET_URL, json=reply)
+            post_span.set(status_code=reply_res.status_code)
         if reply_res.status_code == 201:
             logger.info(
                 f'succesfully sent reply to user: {user}, message: {reply_message}')
+            mark_replied(reply_id, reply_res.json()['data']['id'])
+            counts['sent'] += 1
         else:
             logger.error(
-                f'error sending reply, response status code: {reply_res.status_code}, user: {user}, message: {message}')
+                f"error sending reply, response status code: {reply_res.status_code}, user: {user}, message: {mention['text']}")
+            release(reply_id)
+
+    # create the shared lambda client and birthdays table before the workers use them,
+    # boto3's default session isn't thread safe so the workers mustn't create their own
+    if any(kind == 'spotify' for _, _, kind in claimed):
+        get_lambda_client()
+    birthdays_table = None
+    if any(kind == 'birthday' for _, _, kind in claimed):
+        birthdays_table = get_birthdays_table()
+
+    lookup_seconds, post_seconds, posted = 0.0, 0.0, 0
+    rate_limited = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        start = time.perf_counter()
+        futures = {executor.submit(select_reply, mention['text'], user, birthdays_table): (mention, user)
+                   for mention, user, kind in claimed}
+
+        for future in as_completed(futures):
+            mention, user = futures[future]
+            lookup_seconds = time.perf_counter() - start
+            if rate_limited:
+                # out of budget for this run, the next run picks the rest up
+                release(mention['id'], attempted=False)
+                continue
+
+            post_start = time.perf_counter()
+            try:
+                post_reply(mention, user, future.result())
+            except RateLimitedError as e:
+                logger.warning(f'replies stopped, rate limited: {e}')
+                rate_limited = e
+                release(mention['id'], attempted=False)
+            except Exception as e:
+                logger.error(f"error sending reply, user: {user}, message: {mention['text']}, error: {e}")
+                release(mention['id'])
+            post_seconds += time.perf_counter() - post_start
+            posted += 1
+
+    record_stage('lookup', len(claimed), lookup_seconds)
+    record_stage('post', posted, post_seconds)
+    counts['kinds'] = {kind: sum(1 for _, _, claimed_kind in claimed if claimed_kind == kind)
+                       for kind in ('spotify', 'birthday', 'help')}
+    counts['oldest_retry'] = min(retry_ids, key=int) if retry_ids else None
+    counts['stages'] = stages
+    counts['spotify_lookups'] = dict(spotify_lookups.stats)
+    logger.info(f'replies done, {counts}')
+    return counts
+
+
+def classify_mention(message):
+    """returns the kind of reply a mention needs, 'spotify', 'birthday' or 'help'"""
+    lowercase_message = message.lower()
+    if 'spotify' in lowercase_message:
+        return 'spotify'
+    elif 'birthday' in lowercase_message:
+        return 'birthday'
+    return 'help'
 
 
-def select_reply(message, user):
+def select_reply(message, user, birthdays_table=None):
     # messages to be recieved in form @botaccount spotify/birthday YYYY-MM-DD and strings handled accordingly
-    lowercase_message = message.lower()
-    if 'spotify' in lowercase_message:
+    kind = classify_mention(message)
+    if kind == 'spotify':
         logger.info('spotify reply selected')
         try:
             date_match = re.search(
@@ -132,34 +295,16 @@ def select_reply(message, user):
                 f'reply not selected the message was: {message}, error:{e}')
             return 'Hello there! It seems you have may have been trying to use my spotify song finding feature, however your date is invalid.'
         try:
-            lambda_client = boto3.client('lambda')
-            # invoke the spotify song lambda function to find the top song on the given year
-            response = lambda_client.invoke(
-                FunctionName='twiter_bot_spotify_song',
-                InvocationType='RequestResponse',
-                Payload=json.dumps({'date': date_str})
-            )
-            response_payload = json.loads(response['Payload'].read())
-            if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-                logger.error('Error finding spotify song')
-                logger.error(response_payload)
-                raise Exception(response_payload)
-            # Handle the response from the 'spotify_song' Lambda function
-            if response['StatusCode'] == 200:
-                logger.info('spotify song returned')
-                response_body = json.loads(response_payload.get('body'))
-                reply = response_body["reply"]
-                return reply
-            else:
-                logger.error(response['StatusCode'])
-                raise Exception(
-                    f'Tweet was not sent. status code {response["StatusCode"]}.')
+            # every date in a chart week has the same number one, so mentions asking about the same week
+            # share one lookup, and a week looked up recently is answered from the memo
+            song_info = spotify_lookups.do(chart_week(date_str), lambda: find_spotify_song(date_str))
+            return write_spotify_message(dict(song_info, date=date_str))
         except Exception as e:
             logger.error(
                 f'error finding song for date: {date_str}, error: {e}')
             return f'Hello there! It seems you have may have been trying to use my spotify song finding feature, there was an error finding the spotify link for the song on {date_str}. Feel free to try again or try another date.'
 
-    elif 'birthday' in lowercase_message:
+    elif kind == 'birthday':
         logger.info('birthday reply selected')
 
         try:
@@ -172,19 +317,10 @@ def select_reply(message, user):
                 f'reply not selected the message was: {message}, error:{e}')
             return 'Hello there! It seems you have may have been trying to use my birthday wishing feature, however your date is invalid.'
         try:
-            logger.info(f'adding birthday for user: {user} on birthday: {date}')
-
-            dynamodb = boto3.resource('dynamodb') # Instantiate a DynamoDB client
-            
-            table = dynamodb.Table('Birthdays')
-        
-            # Insert or update item
-            response = table.put_item(
-                Item={
-                    'username': user,
-                    'birthday': date
-                }
-            )
+            logger.info(f'adding birthday for user: {user} on birthday: {date_str}')
+
+            # Insert or update item, along with the month-day key the daily lookup queries
+            response = put_birthday(user, date_str, birthdays_table)
             if response['ResponseMetadata']['HTTPStatusCode'] == 200:
                 return 'your birthday has been added to the database !'
             else:
@@ -198,6 +334,41 @@ def select_reply(message, user):
         return "Hello there! If you send a message containing the word spotify and a date i can send you the number one in that year. Or containing birthday and your D.O.B i'll wish you happy birthday"
 
 
+def find_spotify_song(date_str):
+    """
+    Invokes the spotify song lambda function to find the top song on a date.
+
+    Parameters:
+    date_str (str): Date in the format YYYY-MM-DD
+
+    Returns:
+    dict: The song information with keys 'song', 'artist', 'link' and 'date'
+    """
+    # the shared client, creating clients isn't thread safe and replies are worked out concurrently
+    lambda_client = get_lambda_client()
+    with span('invoke', function='twiter_bot_spotify_song', transport='LambdaTransport') as invoke_span:
+        response = lambda_client.invoke(
+            FunctionName='twiter_bot_spotify_song',
+            InvocationType='RequestResponse',
+            Payload=json.dumps({'date': date_str})
+        )
+        response_payload = json.loads(response['Payload'].read())
+        invoke_span.set(status_code=response_payload.get('statusCode'))
+    if 'FunctionError' in response or response_payload.get('statusCode') != 200:
+        logger.error('Error finding spotify song')
+        logger.error(response_payload)
+        raise Exception(response_payload)
+    # Handle the response from the 'spotify_song' Lambda function
+    if response['StatusCode'] == 200:
+        logger.info('spotify song returned')
+        response_body = json.loads(response_payload.get('body'))
+        return response_body['song_info']
+    else:
+        logger.error(response['StatusCode'])
+        raise Exception(
+            f'Tweet was not sent. status code {response["StatusCode"]}.')
+
+
 def write_spotify_message(data):
     """input is a dictionary from the Spotify class's get_top_song_info method, writes a message to be tweeted"""
 
@@ -205,8 +376,5 @@ def write_spotify_message(data):
     song = data['song']
     artist = data['artist']
     date = data['date']
-    message = f'The number one song on {date} was {song} by {artist}, listen here:\n{link}'
+    message = render('spotify_reply', date=date, song=song, artist=artist, link=link)
     return message
-
-
-lambda_handler(event="", context="")
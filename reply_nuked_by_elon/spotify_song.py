@@ -1,28 +1,33 @@
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyClientCredentials
-from requests import get
-from bs4 import BeautifulSoup
 from os import environ
 import logging
 import json
+from billboard_index import get_index
+from spotify_cache import get_spotify_cache
+from billboard_parser import fetch_top_song
+from message_templates import render
+from http_cache import get_http_session
+from tracing import span, traced_handler
 
 # set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@traced_handler
 def lambda_handler(event, context):
     date = event['date']
     try:
         song_finder = SpotifySongFinder()
         song_info = song_finder.get_top_song_info(date)
+        logger.info(f'spotify search cache stats: {song_finder.search_cache.stats}')
         reply = write_spotify_message(song_info)
         logger.info('spotify reply created successfully')
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': f'Song found successfully',
-                'reply': reply
+                'reply': reply,
+                'song_info': song_info,
             }),
         }
     except Exception as e:
@@ -44,10 +49,27 @@ class SpotifySongFinder:
 
         self.cid = environ.get('SPOTIFY_CID')
         self.secret = environ.get('SPOTIFY_SECRET')
-        self.auth_manager = SpotifyClientCredentials(
-            client_id=self.cid, client_secret=self.secret)
-        self.sp = Spotify(client_credentials_manager=self.auth_manager)
+        self._sp = None  # spotify client, built on first use so index and cache hits never import spotipy
         self.songs = ''
+        self.index = get_index()  # local index of past number 1s, only weeks missing from it are scraped
+        self.search_cache = get_spotify_cache()  # previous spotify searches, including songs not found
+
+    @property
+    def sp(self):
+        """the spotify client, sharing the pooled http session"""
+        if self._sp is None:
+            from spotipy import Spotify
+            from spotipy.oauth2 import SpotifyClientCredentials
+
+            auth_manager = SpotifyClientCredentials(
+                client_id=self.cid, client_secret=self.secret, requests_session=get_http_session())
+            self._sp = Spotify(client_credentials_manager=auth_manager, requests_session=get_http_session())
+        return self._sp
+
+    def search_tracks(self, query):
+        """searches spotify for tracks matching a query, timed as the 'search' stage"""
+        with span('search', source='spotify'):
+            return self.sp.search(q=query, type='track')
 
     def scrape_top_song(self, date):
         """takes a string input of date YYYY-MM-DD and finds the billboard top 100 number 1
@@ -55,22 +77,8 @@ class SpotifySongFinder:
 
         logger.info(f'scraping billboard for top song on date: {date}')
         try:
-            response = get(
-                f'https://www.billboard.com/charts/hot-100/{date}/')  # get website html
-
-            website_html = response.text
-
-            soup = BeautifulSoup(website_html, 'html.parser')
-
-            soup_data = soup.find_all(
-                name='li', class_='o-chart-results-list__item', limit=4)  # scrap page for top song
-
-            soup_song = soup_data[3]
-
-            song = soup_song.find(name='h3', class_='c-title',
-                                  id="title-of-a-story").string.strip('\n')
-            artist = soup_song.find(
-                name='span', class_='c-label').string.strip('\n')
+            song_data = fetch_top_song(date)  # streams the page, stopping once the number 1 is found
+            song, artist = song_data['song'], song_data['artist']
             logger.info(
                 f'song found on billboard song: {song}, artist: {artist}')
             return {'song': song, 'artist': artist}
@@ -85,15 +93,24 @@ class SpotifySongFinder:
         for that song as a string"""
 
         logger.info('finding song uri code on spotify')
-        result = self.sp.search(
-            q=f'artist:{artist}%20track:{song}', type='track')  # search using song and artist
+        hit, uri_code = self.search_cache.get(song, artist)
+        if hit and uri_code:
+            logger.info(f'song uri code found in cache, uri code: {uri_code}')
+            return uri_code
+        elif hit:
+            logger.error(
+                f'song cached as not found on spotify using song: {song}, artist: {artist}')
+            raise Exception(
+                f'song not found on spotify using song: {song}, artist: {artist}, cached result')
+
+        result = self.search_tracks(f'artist:{artist}%20track:{song}')  # search using song and artist
         try:
             uri = result['tracks']['items'][0]['uri']
             url = result['tracks']['items'][0]['external_urls']['spotify']
             uri_code = uri.split(':')[2]
         except (IndexError, KeyError) as error:
             # search using song only
-            result = self.sp.search(q=f'track:{song}', type='track')
+            result = self.search_tracks(f'track:{song}')
             try:
                 uri = result['tracks']['items'][0]['uri']
                 url = result['tracks']['items'][0]['external_urls']['spotify']
@@ -101,9 +118,11 @@ class SpotifySongFinder:
             except (IndexError, KeyError) as error:
                 logger.error(
                     f'song not found on spotify using song: {song}, artist: {artist}')
+                self.search_cache.put(song, artist, None)
                 raise Exception(
                     f'song not found on spotify using song: {song}, artist: {artist}, error {error}')
         logger.info(f'song uri code found, uri code: {uri_code}')
+        self.search_cache.put(song, artist, uri_code)
         return uri_code
 
     def get_top_song_info(self, date):
@@ -112,10 +131,18 @@ class SpotifySongFinder:
         'date'-YYYY-MM-DD """
         logger.info(f'trying to find number one song on {date}')
         try:
-            song_data = self.scrape_top_song(date)
+            song_data = self.index.lookup(date)  # fall back to scraping billboard if the week isn't indexed
+            if song_data:
+                logger.info(f"song found in billboard index for week {song_data['week']}")
+            else:
+                song_data = self.scrape_top_song(date)
 
             song, artist = song_data['song'], song_data['artist']
-            uri_code = self.find_song_uri(song, artist)
+            uri_code = song_data.get('uri_code')
+            if not uri_code:
+                uri_code = self.find_song_uri(song, artist)
+                self.index.add(date, song, artist, uri_code)
+                self.index.save()
 
             link = f'https://open.spotify.com/track/{uri_code}'
             logger.info(f'song data returned for {song}, {artist}, {link}')
@@ -132,5 +159,5 @@ def write_spotify_message(data):
     song = data['song']
     artist = data['artist']
     date = data['date']
-    message = f'The number one song on {date} was {song} by {artist}, listen here:\n{link}'
+    message = render('spotify_reply', date=date, song=song, artist=artist, link=link)
     return message
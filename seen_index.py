@@ -0,0 +1,150 @@
+"""
+Index of content the bots have already tweeted, shared by tweet_news (article urls),
+tweet_number_1_song (chart weeks) and tweet_nasa_img (APOD dates).
+
+Values are stored as 64 bit hashes in SQLite, the exact store. A Bloom filter built from the store
+sits in front of it so a candidate that was never tweeted, the common case, is answered from memory
+without touching the database. Candidates are checked before any scraping, searching or uploading.
+"""
+import logging
+from os import environ
+import os
+import hashlib
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# kept in /tmp between warm invocations by default, see container_state
+SEEN_INDEX_PATH = environ.get('SEEN_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'seen_index.sqlite3'))
+SEEN_BLOOM_CAPACITY = int(environ.get('SEEN_BLOOM_CAPACITY', 100000))
+SEEN_BLOOM_ERROR_RATE = float(environ.get('SEEN_BLOOM_ERROR_RATE', 0.001))
+
+
+class AlreadySeenError(Exception):
+    """Raised when a candidate for a tweet has already been tweeted"""
+
+
+def content_hash(kind, value):
+    """
+    Hashes a piece of content into the key it is indexed on.
+
+    Parameters:
+    kind (str): The kind of content, e.g. 'news_url', keeps kinds from colliding
+    value (str): The content's identity, e.g. a url, uri or date
+
+    Returns:
+    bytes: A 16 byte digest, the first 8 bytes are the stored key and all 16 feed the Bloom filter
+    """
+    return hashlib.blake2b(f'{kind}\x1f{value}'.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Bloom filter over content hashes, answers 'definitely not seen' or 'maybe seen'.
+    """
+
+    def __init__(self, capacity=SEEN_BLOOM_CAPACITY, error_rate=SEEN_BLOOM_ERROR_RATE):
+        """
+        Parameters:
+        capacity (int): Number of values the filter is sized for
+        error_rate (float): False positive rate at capacity
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # double hashing, the k positions come from the two halves of the digest
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        # most lookups are for new content, so stop at the first unset bit
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            position = (first + i * second) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SeenIndex:
+    """
+    Class recording what has been tweeted, a Bloom filter in front of an exact SQLite store.
+    """
+
+    def __init__(self, path=SEEN_INDEX_PATH, capacity=SEEN_BLOOM_CAPACITY, error_rate=SEEN_BLOOM_ERROR_RATE):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            'hash INTEGER PRIMARY KEY, kind TEXT NOT NULL, digest BLOB NOT NULL, seen_at REAL NOT NULL)')
+        self._db.commit()
+        self.stats = {'bloom_negatives': 0, 'exact_checks': 0, 'false_positives': 0}
+
+        # rebuild the filter from the store, sized so it stays accurate as the index grows
+        start = time.perf_counter()
+        rows = self._db.execute('SELECT digest FROM seen').fetchall()
+        self.bloom = BloomFilter(max(capacity, 2 * len(rows)), error_rate)
+        for (digest,) in rows:
+            self.bloom.add(digest)
+        logger.info(f'seen index loaded {len(rows)} entries in {time.perf_counter() - start:.3f}s')
+
+    @staticmethod
+    def _key(digest):
+        return int.from_bytes(digest[:8], 'big', signed=True)
+
+    def seen(self, kind, value):
+        """
+        Checks whether content has been tweeted.
+
+        Parameters:
+        kind (str): The kind of content
+        value (str): The content's identity
+
+        Returns:
+        bool: True if it has been tweeted before
+        """
+        digest = content_hash(kind, value)
+        if digest not in self.bloom:
+            self.stats['bloom_negatives'] += 1
+            return False
+
+        self.stats['exact_checks'] += 1
+        with self._lock:
+            row = self._db.execute('SELECT 1 FROM seen WHERE hash = ?', (self._key(digest),)).fetchone()
+        if row is None:
+            self.stats['false_positives'] += 1
+        return row is not None
+
+    def add(self, kind, value):
+        """records content as tweeted"""
+        digest = content_hash(kind, value)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR IGNORE INTO seen (hash, kind, digest, seen_at) VALUES (?, ?, ?, ?)',
+                (self._key(digest), kind, digest, time.time()))
+            self._db.commit()
+        self.bloom.add(digest)
+
+
+@per_container
+def get_seen_index():
+    """returns the seen content index, loaded once per container"""
+    return SeenIndex()
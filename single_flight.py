@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class SingleFlight:
+    """
+    Thread safe request coalescing. Concurrent calls for the same key share one call of the function,
+    the first caller makes it and the rest wait for its result. Successful results are also memoised
+    for 'ttl' seconds so repeat calls within that window make no call at all, failures are never memoised.
+    """
+
+    def __init__(self, ttl=0, max_entries=1024):
+        """
+        Parameters:
+        ttl (float): Seconds a result is memoised for, 0 only coalesces calls in flight
+        max_entries (int): Most results memoised, the least recently used are dropped first
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {'calls': 0, 'joined': 0, 'memo_hits': 0}
+        self._in_flight = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Returns function's result for key, calling it only if no call for key is in flight or memoised.
+
+        Parameters:
+        key (hashable): What the call is coalesced on
+        function (callable): Takes no arguments and returns the result
+
+        Returns:
+        object: The result, exceptions raised by the call are raised to every caller that waited on it
+        """
+        with self._lock:
+            memoised = self._memo.get(key)
+            if memoised and memoised[1] > time.monotonic():
+                self._memo.move_to_end(key)
+                self.stats['memo_hits'] += 1
+                return memoised[0]
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.stats['calls'] += 1
+            else:
+                self.stats['joined'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self.ttl > 0:
+                self._memo[key] = (result, time.monotonic() + self.ttl)
+                self._memo.move_to_end(key)
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def forget(self, key):
+        """drops a memoised result"""
+        with self._lock:
+            self._memo.pop(key, None)
@@ -0,0 +1,145 @@
+import logging
+from os import environ
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The persistent tier is kept in /tmp between warm invocations by default, see container_state
+SPOTIFY_CACHE_PATH = environ.get(
+    'SPOTIFY_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'spotify_cache.sqlite3'))
+SPOTIFY_CACHE_SIZE = int(environ.get('SPOTIFY_CACHE_SIZE', 1024))
+SPOTIFY_CACHE_TTL = int(environ.get('SPOTIFY_CACHE_TTL', 30 * 24 * 60 * 60))
+SPOTIFY_CACHE_NEGATIVE_TTL = int(environ.get('SPOTIFY_CACHE_NEGATIVE_TTL', 24 * 60 * 60))
+
+
+def normalise_key(song, artist):
+    """
+    Normalises a song and artist into a cache key so small differences in case and spacing still hit.
+
+    Parameters:
+    song (str): The song's name
+    artist (str): The artist's name
+
+    Returns:
+    str: The cache key
+    """
+    def normalise(text):
+        return re.sub(r'\s+', ' ', (text or '').casefold()).strip()
+    return f'{normalise(song)}\x1f{normalise(artist)}'
+
+
+class SpotifySearchCache:
+    """
+    Class caching spotify uri codes found for a song and artist. Lookups go to an in-memory LRU first
+    and then a persistent SQLite tier. Songs that could not be found are cached too, with a shorter TTL,
+    so they do not trigger the double search again.
+    """
+
+    def __init__(self, path=SPOTIFY_CACHE_PATH, max_entries=SPOTIFY_CACHE_SIZE,
+                 ttl=SPOTIFY_CACHE_TTL, negative_ttl=SPOTIFY_CACHE_NEGATIVE_TTL):
+        """
+        Parameters:
+        path (str): Path of the SQLite database, None keeps the cache in memory only
+        max_entries (int): Maximum number of entries in the in-memory tier
+        ttl (int): Seconds a found uri code is cached for
+        negative_ttl (int): Seconds a not found result is cached for
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS spotify_search '
+                    '(key TEXT PRIMARY KEY, uri_code TEXT, expires REAL NOT NULL)')
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f'spotify cache database unavailable at {path}, using memory only, error: {e}')
+                self._db = None
+
+    def _remember(self, key, uri_code, expires):
+        self.memory[key] = (uri_code, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, song, artist):
+        """
+        Looks up a cached search result.
+
+        Parameters:
+        song (str): The song's name
+        artist (str): The artist's name
+
+        Returns:
+        tuple: (hit, uri_code), hit is False if nothing fresh is cached, uri_code is None for a cached not found
+        """
+        key = normalise_key(song, artist)
+        now = time.time()
+        with self._lock:
+            cached = self.memory.get(key)
+            if cached and cached[1] > now:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return True, cached[0]
+            if cached:
+                del self.memory[key]
+
+            if self._db:
+                row = self._db.execute(
+                    'SELECT uri_code, expires FROM spotify_search WHERE key = ?', (key,)).fetchone()
+                if row and row[1] > now:
+                    self._remember(key, row[0], row[1])
+                    self.stats['persistent_hits'] += 1
+                    return True, row[0]
+
+            self.stats['misses'] += 1
+            return False, None
+
+    def put(self, song, artist, uri_code):
+        """
+        Caches a search result.
+
+        Parameters:
+        song (str): The song's name
+        artist (str): The artist's name
+        uri_code (str): The spotify uri code, or None if the song was not found
+        """
+        key = normalise_key(song, artist)
+        expires = time.time() + (self.ttl if uri_code else self.negative_ttl)
+        with self._lock:
+            self._remember(key, uri_code, expires)
+            if self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO spotify_search (key, uri_code, expires) VALUES (?, ?, ?)',
+                    (key, uri_code, expires))
+                self._db.commit()
+
+    def purge_expired(self):
+        """removes expired entries from the persistent tier"""
+        if self._db:
+            with self._lock:
+                self._db.execute('DELETE FROM spotify_search WHERE expires <= ?', (time.time(),))
+                self._db.commit()
+
+
+@per_container
+def get_spotify_cache():
+    """returns the spotify search cache, created once per container"""
+    return SpotifySearchCache()
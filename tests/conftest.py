@@ -0,0 +1,123 @@
+"""
+Shared fixtures, the bots run against benchmarks/fake_upstream.py with HTTP_UPSTREAM_URL and DynamoDB
+is stood in for by moto.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks'), os.path.join(ROOT, 'reply_nuked_by_elon')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# read by the modules when they are imported
+os.environ.setdefault('TWITTER_USER_ID', '1000')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.pop('MEDIA_STORE_BUCKET', None)
+
+from fake_upstream import FakeUpstream, start_server  # noqa: E402
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """fake aws credentials and moto standing in for every aws service"""
+    from moto import mock_aws
+
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.delenv('DYNAMODB_ENDPOINT_URL', raising=False)
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def birthdays_table(aws):
+    """the Birthdays table with its month-day index, empty"""
+    import boto3
+    import birthday_store
+
+    return boto3.resource('dynamodb').create_table(
+        TableName=birthday_store.BIRTHDAYS_TABLE,
+        KeySchema=[{'AttributeName': 'username', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'username', 'AttributeType': 'S'},
+                              {'AttributeName': birthday_store.MONTH_DAY_ATTRIBUTE, 'AttributeType': 'S'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': birthday_store.MONTH_DAY_INDEX,
+            'KeySchema': [{'AttributeName': birthday_store.MONTH_DAY_ATTRIBUTE, 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+@pytest.fixture
+def mention_store(aws):
+    """the mention_store module with its table created, empty"""
+    import boto3
+    import mention_store
+
+    boto3.resource('dynamodb').create_table(
+        TableName=mention_store.MENTIONS_TABLE,
+        KeySchema=[{'AttributeName': 'key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'key', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    mention_store.get_mentions_table.reset()
+    yield mention_store
+    mention_store.get_mentions_table.reset()
+
+
+@pytest.fixture
+def start_upstream(monkeypatch):
+    """starts a fake upstream, by default a FakeUpstream, and sends every http request and tweet to it"""
+    import twitter_session
+    from twitter_client import get_twitter_client
+    from http_cache import reset_http_session
+
+    servers = []
+    for name in twitter_session.CREDENTIAL_VARS:
+        monkeypatch.setenv(name, name.lower())
+
+    def start(upstream=None):
+        upstream = upstream or FakeUpstream(image_bytes=1024)
+        server, url = start_server(upstream)
+        servers.append(server)
+        monkeypatch.setenv('HTTP_UPSTREAM_URL', url)
+        twitter_session.reset_oauth_session()
+        reset_http_session()
+        return upstream
+
+    yield start
+    twitter_session.reset_oauth_session()
+    reset_http_session()
+    get_twitter_client.reset()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def upstream(start_upstream):
+    return start_upstream()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """skips the backoff sleeps so retries run instantly"""
+    import time
+
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """turns tracing on and collects the records of the spans written"""
+    import tracing
+
+    records = []
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', True)
+    monkeypatch.setattr(tracing, '_write', lambda line: records.append(json.loads(line)))
+    return records
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import tweet_number_1_song
+from billboard_index import BillboardIndex, chart_week
+from spotify_cache import SpotifySearchCache
+
+
+@pytest.fixture
+def index(tmp_path):
+    return BillboardIndex(str(tmp_path / 'billboard_index.tsv'))
+
+
+@pytest.mark.parametrize('day, week', [
+    ('1985-07-13', '1985-07-13'),  # a saturday is its own chart week
+    ('1985-07-07', '1985-07-13'),
+    ('1985-07-12', '1985-07-13'),
+    ('1985-12-29', '1986-01-04'),  # weeks cross the new year
+])
+def test_chart_week_is_the_saturday_on_or_after_the_date(day, week):
+    assert chart_week(day) == week
+
+
+def test_any_day_of_an_indexed_week_is_found(index):
+    index.add('1985-07-13', 'Song A', 'Artist A', 'uri_a')
+
+    assert index.lookup('1985-07-08') == {'song': 'Song A', 'artist': 'Artist A', 'uri_code': 'uri_a',
+                                          'week': '1985-07-13'}
+    assert index.lookup('1985-07-14') is None
+    assert index.last_week == '1985-07-13'
+
+
+def test_index_survives_a_save_and_load(index):
+    # added out of order, with a tab that would break the file and no uri code
+    index.add('1990-01-06', 'Later\tSong', 'Artist B')
+    index.add('1985-07-13', 'Song A', 'Artist A', 'uri_a')
+    index.add('1985-07-13', 'Song C', 'Artist C', 'uri_c')
+    assert index.save()
+
+    loaded = BillboardIndex(index.path)
+
+    assert len(loaded) == 2
+    assert loaded.weeks == ['1985-07-13', '1990-01-06']
+    assert loaded.lookup('1985-07-13')['song'] == 'Song C'
+    assert loaded.lookup('1990-01-06') == {'song': 'Later Song', 'artist': 'Artist B', 'uri_code': None,
+                                           'week': '1990-01-06'}
+    assert not os.path.exists(f'{index.path}.tmp')
+
+
+def test_missing_file_is_an_empty_index_and_an_unwritable_one_is_not_saved(tmp_path):
+    index = BillboardIndex(str(tmp_path / 'missing' / 'billboard_index.tsv'))
+
+    assert len(index) == 0 and index.last_week is None
+    index.add('1985-07-13', 'Song A', 'Artist A')
+    assert index.save() is False
+
+
+def test_update_only_scrapes_weeks_after_the_last_indexed_one(index):
+    index.add('2000-01-01', 'Song', 'Artist', 'uri')
+    scraped = []
+
+    def scrape(week):
+        scraped.append(week)
+        return {'song': f'Song {week}', 'artist': 'Artist'}
+
+    def find_uri(song, artist):
+        if song.endswith('01-15'):
+            raise Exception('not on spotify')
+        return 'uri'
+
+    added = index.update(scrape, find_uri, until='2000-01-20')
+
+    assert added == 3
+    assert scraped == ['2000-01-08', '2000-01-15', '2000-01-22']
+    assert index.lookup('2000-01-15')['uri_code'] is None
+    assert index.lookup('2000-01-22')['uri_code'] == 'uri'
+
+
+@pytest.fixture
+def song_finder(index, tmp_path, monkeypatch):
+    monkeypatch.setenv('SPOTIFY_CID', 'cid')
+    monkeypatch.setenv('SPOTIFY_SECRET', 'secret')
+    monkeypatch.chdir(tmp_path)  # spotipy writes its token .cache to the working directory
+    monkeypatch.setattr(tweet_number_1_song, 'get_index', lambda: index)
+    search_cache = SpotifySearchCache(str(tmp_path / 'spotify_cache.sqlite3'))
+    monkeypatch.setattr(tweet_number_1_song, 'get_spotify_cache', lambda: search_cache)
+    return tweet_number_1_song.SpotifySongFinder()
+
+
+def test_indexed_week_is_answered_without_any_requests(upstream, index, song_finder):
+    index.add('1985-07-13', 'Song A', 'Artist A', 'uri_a')
+
+    song_info = song_finder.get_top_song_info('1985-07-10')
+
+    assert song_info == {'link': 'https://open.spotify.com/track/uri_a', 'artist': 'Artist A',
+                         'song': 'Song A', 'date': '1985-07-10'}
+    assert upstream.stats == {}
+
+
+def test_missing_week_is_scraped_and_added_to_the_index(upstream, index, song_finder):
+    song_info = song_finder.get_top_song_info('1985-07-10')
+
+    assert (song_info['song'], song_info['artist']) == ('Song 1', 'Artist 1')
+    assert upstream.stats['www.billboard.com']['requests'] == 1
+    assert BillboardIndex(index.path).lookup('1985-07-13')['uri_code'] == song_info['link'].rsplit('/', 1)[1]
+
+    song_finder.get_top_song_info('1985-07-11')
+    assert upstream.stats['www.billboard.com']['requests'] == 1
@@ -0,0 +1,68 @@
+import pytest
+
+from bench_billboard_parser import synthetic_page
+from billboard_parser import fetch_top_song, parse_top_song_soup, parse_top_song_stream
+from fake_upstream import FakeUpstream
+
+NUMBER_ONE = {'song': 'Song 1', 'artist': 'Artist 1'}
+
+
+def chunks_of(page, size):
+    return [page[start:start + size] for start in range(0, len(page), size)]
+
+
+def test_stream_stops_reading_once_the_number_one_is_found():
+    page = synthetic_page()
+
+    song_data, bytes_read = parse_top_song_stream(chunks_of(page, 4096))
+
+    assert song_data == NUMBER_ONE
+    assert bytes_read < len(page) / 10
+
+
+def test_stream_and_soup_agree():
+    page = synthetic_page(entries=5)
+
+    assert parse_top_song_stream([page])[0] == parse_top_song_soup(page.decode('utf-8')) == NUMBER_ONE
+
+
+def test_characters_split_across_chunks_are_decoded():
+    page = synthetic_page(entries=3).replace(b'Song 1', 'Beyoncé – Halo'.encode('utf-8'))
+
+    # one byte at a time splits every multi-byte character and every tag
+    song_data, _ = parse_top_song_stream(chunks_of(page, 1))
+
+    assert song_data == {'song': 'Beyoncé – Halo', 'artist': 'Artist 1'}
+
+
+@pytest.mark.parametrize('page', [
+    b'<html><body>no chart here</body></html>',
+    # the number 1's list item is there but has no title
+    synthetic_page(entries=1).replace(b'id="title-of-a-story"', b''),
+])
+def test_page_without_the_number_one_gives_none(page):
+    assert parse_top_song_stream(chunks_of(page, 64))[0] is None
+    assert parse_top_song_soup(page.decode('utf-8')) is None
+
+
+@pytest.mark.parametrize('mode', ['stream', 'soup'])
+def test_fetch_top_song_from_billboard(upstream, mode):
+    assert fetch_top_song('1985-07-13', mode=mode) == NUMBER_ONE
+    assert upstream.stats['www.billboard.com']['requests'] == 1
+
+
+class EmptyChartUpstream(FakeUpstream):
+    def billboard(self, path, query, headers, body):
+        return 200, {'content-type': 'text/html; charset=utf-8'}, b'<html><body></body></html>'
+
+
+def test_fetch_top_song_raises_when_the_page_has_no_number_one(start_upstream):
+    start_upstream(EmptyChartUpstream())
+
+    with pytest.raises(Exception, match='number one not found'):
+        fetch_top_song('1985-07-13')
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        fetch_top_song('1985-07-13', mode='regex')
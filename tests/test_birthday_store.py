@@ -0,0 +1,80 @@
+from datetime import date, datetime
+
+import pytest
+
+import birthday_wisher
+from birthday_store import migrate_month_day, month_day, month_day_keys, put_birthday, query_birthdays
+
+
+class PagedTable:
+    """the table with every query limited to a small page, counting the queries and scans made"""
+
+    def __init__(self, table, page_size=2):
+        self.table = table
+        self.page_size = page_size
+        self.queries = 0
+        self.scans = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return self.table.query(Limit=self.page_size, **kwargs)
+
+    def scan(self, **kwargs):
+        self.scans += 1
+        return self.table.scan(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def test_month_day():
+    assert month_day('1990-07-04') == '07-04'
+
+
+@pytest.mark.parametrize('today, keys', [
+    (date(2023, 2, 28), ['02-28', '02-29']),
+    (date(2024, 2, 28), ['02-28']),
+    (date(2024, 2, 29), ['02-29']),
+    (date(2023, 3, 1), ['03-01']),
+])
+def test_leap_day_birthdays_are_wished_on_the_28th_in_other_years(today, keys):
+    assert month_day_keys(today) == keys
+
+
+def test_query_follows_every_page_of_the_day(birthdays_table):
+    for n in range(5):
+        put_birthday(f'user{n}', f'199{n}-07-04', birthdays_table)
+    put_birthday('other', '1990-07-05', birthdays_table)
+    table = PagedTable(birthdays_table)
+
+    usernames = sorted(item['username'] for item in query_birthdays('07-04', table))
+
+    assert usernames == [f'user{n}' for n in range(5)]
+    assert table.queries == 3 and table.scans == 0
+
+
+def test_migration_backfills_items_written_without_the_month_day(birthdays_table):
+    birthdays_table.put_item(Item={'username': 'old', 'birthday': '1980-12-25'})
+    birthdays_table.put_item(Item={'username': 'broken', 'birthday': 'christmas'})
+    put_birthday('new', '1990-12-25', birthdays_table)
+
+    assert migrate_month_day(birthdays_table) == 1
+    assert sorted(item['username'] for item in query_birthdays('12-25', birthdays_table)) == ['new', 'old']
+    assert migrate_month_day(birthdays_table) == 0
+
+
+def test_check_birthdays_finds_only_todays_birthdays(birthdays_table, monkeypatch):
+    class Today(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2023, 2, 28, 12)
+
+    monkeypatch.setattr(birthday_wisher, 'datetime', Today)
+    put_birthday('feb28', '2000-02-28', birthdays_table)
+    put_birthday('leapling', '2000-02-29', birthdays_table)
+    put_birthday('march', '2000-03-01', birthdays_table)
+
+    birthdays = birthday_wisher.check_birthdays()
+
+    assert sorted(birthdays, key=lambda birthday: birthday['user']) == [
+        {'user': '@feb28', 'age': 23}, {'user': '@leapling', 'age': 23}]
@@ -0,0 +1,108 @@
+import functools
+import json
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+import birthday_wisher
+import tweet_dispatcher
+from birthday_store import put_birthday
+from fake_upstream import FakeUpstream
+from rate_limit import TokenBucket
+
+
+class FlakyTweetUpstream(FakeUpstream):
+    """fails every tweet mentioning a user in fail_users and the first tweet to each user in flaky_users"""
+
+    def __init__(self, fail_users=(), flaky_users=()):
+        super().__init__(image_bytes=1024)
+        self.fail_users = set(fail_users)
+        self.flaky_users = set(flaky_users)
+        self.attempts = Counter()
+
+    def tweet(self, path, query, headers, body):
+        text = json.loads(body)['text']
+        user = next(word.strip('@!.,') for word in text.split() if word.startswith('@'))
+        self.attempts[user] += 1
+        if user in self.fail_users or (user in self.flaky_users and self.attempts[user] == 1):
+            return self.json_response({'title': 'Service Unavailable'}, status=503)
+        return super().tweet(path, query, headers, body)
+
+
+@pytest.fixture
+def send_in_process(monkeypatch, no_sleep):
+    monkeypatch.setattr(tweet_dispatcher, 'TWEET_TRANSPORT', 'inprocess')
+    # no waiting on the posting rate or between attempts
+    monkeypatch.setattr(birthday_wisher, 'send_birthday_tweets',
+                        functools.partial(birthday_wisher.send_birthday_tweets, rate=1000, backoff=0))
+
+
+def birthdays(*users):
+    return [{'user': f'@{user}', 'age': 30} for user in users]
+
+
+def test_failed_tweets_are_retried_and_reported_per_user(start_upstream, send_in_process):
+    upstream = start_upstream(FlakyTweetUpstream(fail_users=['down'], flaky_users=['flaky']))
+
+    report = birthday_wisher.send_birthday_tweets(birthdays('ok', 'flaky', 'down'), max_attempts=3)
+
+    assert sorted(report['sent'], key=lambda result: result['user']) == [
+        {'user': '@flaky', 'attempts': 2}, {'user': '@ok', 'attempts': 1}]
+    assert [(result['user'], result['attempts']) for result in report['failed']] == [('@down', 3)]
+    assert '503' in report['failed'][0]['error']
+    assert upstream.attempts == {'ok': 1, 'flaky': 2, 'down': 3}
+
+
+def test_every_birthday_gets_at_least_one_attempt(start_upstream, send_in_process):
+    upstream = start_upstream(FlakyTweetUpstream())
+
+    report = birthday_wisher.send_birthday_tweets(birthdays('ok'), max_attempts=0)
+
+    assert report == {'sent': [{'user': '@ok', 'attempts': 1}], 'failed': []}
+    assert upstream.attempts == {'ok': 1}
+
+
+def test_tweets_are_paced_to_the_posting_rate(start_upstream, monkeypatch):
+    monkeypatch.setattr(tweet_dispatcher, 'TWEET_TRANSPORT', 'inprocess')
+    start_upstream(FlakyTweetUpstream())
+    waits = []
+
+    class RecordingBucket(TokenBucket):
+        """records how long each tweet would have waited instead of waiting"""
+
+        def acquire(self, tokens=1, max_wait=None):
+            waits.append(self.try_acquire(tokens))
+            return True
+
+    monkeypatch.setattr(birthday_wisher, 'TokenBucket', RecordingBucket)
+
+    birthday_wisher.send_birthday_tweets(birthdays('a', 'b', 'c'), workers=1, rate=0.5)
+
+    # the first tweet goes straight away, the others wait for the bucket to refill
+    assert waits[0] == 0
+    assert len(waits) == 3 and all(wait > 1 for wait in waits[1:])
+
+
+@pytest.mark.parametrize('fail_users, status_code', [
+    ((), 200),
+    (('down',), 207),
+    (('ok', 'down'), 500),
+])
+def test_handler_status_reflects_the_report(start_upstream, send_in_process, birthdays_table, monkeypatch,
+                                            fail_users, status_code):
+    class Today(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 7, 4, 12)
+
+    monkeypatch.setattr(birthday_wisher, 'datetime', Today)
+    start_upstream(FlakyTweetUpstream(fail_users=fail_users))
+    put_birthday('ok', '1990-07-04', birthdays_table)
+    put_birthday('down', '1991-07-04', birthdays_table)
+
+    response = birthday_wisher.lambda_handler({}, None)
+
+    assert response['statusCode'] == status_code
+    report = json.loads(response['body'])['report']
+    assert len(report['sent']) + len(report['failed']) == 2
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from fake_upstream import FakeUpstream
+from http_cache import HTTPCache, parse_max_age
+
+URL = 'https://api.openweathermap.org/data/2.5/onecall'
+PARAMS = {'lat': 1, 'lon': 2}
+
+
+class ConditionalUpstream(FakeUpstream):
+    """serves a forecast with an ETag, answering 304 to a request that has it, or 503s while down"""
+
+    def __init__(self, cache_control=None):
+        super().__init__()
+        self.cache_control = cache_control
+        self.version = 1
+        self.down = False
+        self.conditional = []
+
+    def weather(self, path, query, headers, body):
+        if self.down:
+            return self.json_response({'message': 'down'}, status=503)
+        self.conditional.append(headers.get('if-none-match'))
+        etag = f'"v{self.version}"'
+        response_headers = {'etag': etag}
+        if self.cache_control:
+            response_headers['cache-control'] = self.cache_control
+        if headers.get('if-none-match') == etag:
+            return 304, response_headers, b''
+        return self.json_response({'version': self.version}, headers=response_headers)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HTTPCache(str(tmp_path / 'http_cache.sqlite3'))
+
+
+@pytest.mark.parametrize('cache_control, max_age', [
+    ('public, max-age=600', 600),
+    ('no-cache', 0),
+    ('private, no-store, max-age=600', 0),
+    ('', None),
+])
+def test_parse_max_age(cache_control, max_age):
+    assert parse_max_age({'cache-control': cache_control}) == max_age
+
+
+def test_fresh_response_is_served_without_a_request(start_upstream, cache):
+    upstream = start_upstream(ConditionalUpstream())
+
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=60) == (b'{"version": 1}', 'miss')
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=60) == (b'{"version": 1}', 'hit')
+    assert upstream.stats['api.openweathermap.org']['requests'] == 1
+
+
+def test_stale_response_is_revalidated_with_its_etag(start_upstream, cache):
+    upstream = start_upstream(ConditionalUpstream())
+    cache.fetch('weather:1:2', URL, PARAMS, max_age=0)
+
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=0) == (b'{"version": 1}', 'revalidated')
+    upstream.version = 2
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=0) == (b'{"version": 2}', 'miss')
+    assert upstream.conditional == [None, '"v1"', '"v1"']
+
+
+def test_cache_control_max_age_beats_the_default(start_upstream, cache):
+    upstream = start_upstream(ConditionalUpstream(cache_control='max-age=600'))
+    cache.fetch('weather:1:2', URL, PARAMS, max_age=0)
+
+    entry = cache.get('weather:1:2')
+    assert entry['expires'] - entry['fetched'] == pytest.approx(600)
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=0)[1] == 'hit'
+    assert upstream.stats['api.openweathermap.org']['requests'] == 1
+
+
+def test_stale_copy_is_served_while_the_upstream_is_down(start_upstream, cache, monkeypatch):
+    upstream = start_upstream(ConditionalUpstream())
+    cache.fetch('weather:1:2', URL, PARAMS, max_age=0)
+    upstream.down = True
+
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=0, stale_if_error=60) == (b'{"version": 1}', 'stale-error')
+
+    # past the stale-if-error window the error is raised
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    with pytest.raises(Exception, match='503'):
+        cache.fetch('weather:1:2', URL, PARAMS, max_age=0, stale_if_error=60)
+
+
+def test_error_with_nothing_cached_is_raised(start_upstream, cache):
+    upstream = start_upstream(ConditionalUpstream())
+    upstream.down = True
+
+    with pytest.raises(Exception, match='503'):
+        cache.fetch('weather:1:2', URL, PARAMS, stale_if_error=60)
+    assert cache.get('weather:1:2') is None
+
+
+def test_stale_while_revalidate_answers_at_once_and_refreshes_in_the_background(start_upstream, cache):
+    upstream = start_upstream(ConditionalUpstream())
+    cache.fetch('weather:1:2', URL, PARAMS, max_age=0)
+    upstream.version = 2
+
+    assert cache.fetch('weather:1:2', URL, PARAMS, max_age=0, stale_while_revalidate=60) == (
+        b'{"version": 1}', 'stale')
+
+    deadline = time.time() + 5
+    while cache.get('weather:1:2')['body'] != b'{"version": 2}':
+        assert time.time() < deadline, 'the background refresh never stored the new response'
+        time.sleep(0.01)
@@ -0,0 +1,103 @@
+import pytest
+from requests import Request, Response, Session
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+import http_transport
+from http_cache import get_http_session, reset_http_session
+from http_transport import TracedAdapter, UpstreamAdapter, build_adapter, mount_adapter, set_adapter_factory
+
+
+class CannedAdapter(BaseAdapter):
+    """answers every request with a 200 and its own url, remembering the requests sent"""
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.kwargs = kwargs
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        response = Response()
+        response.status_code = 200
+        response.headers['content-length'] = str(len(request.url))
+        response._content = request.url.encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def adapter_factory():
+    adapters = []
+
+    def factory(**kwargs):
+        adapters.append(CannedAdapter(**kwargs))
+        return adapters[-1]
+
+    set_adapter_factory(factory)
+    reset_http_session()
+    yield adapters
+    set_adapter_factory(None)
+    reset_http_session()
+
+
+def test_requests_are_sent_to_the_upstream_with_their_real_host(upstream):
+    response = get_http_session().get('https://api.spotify.com/v1/search', params={'q': 'track:song'})
+
+    assert response.status_code == 200
+    assert response.json()['tracks']['items'][0]['uri'].startswith('spotify:track:')
+    assert upstream.stats == {'api.spotify.com': {'requests': 1, 'errors': 0}}
+
+
+def test_upstream_url_is_read_when_the_adapter_is_built(monkeypatch):
+    monkeypatch.delenv('HTTP_UPSTREAM_URL', raising=False)
+    assert type(build_adapter()) is HTTPAdapter
+
+    monkeypatch.setenv('HTTP_UPSTREAM_URL', 'http://127.0.0.1:8080/')
+    adapter = build_adapter(pool_maxsize=3)
+    assert isinstance(adapter, UpstreamAdapter)
+    assert adapter.upstream_url == 'http://127.0.0.1:8080'
+    assert adapter._pool_maxsize == 3
+
+
+def test_injected_adapter_carries_every_request_until_restored(adapter_factory, monkeypatch):
+    monkeypatch.delenv('HTTP_UPSTREAM_URL', raising=False)
+
+    response = get_http_session().get('https://www.billboard.com/charts/hot-100/1985-07-13/')
+
+    assert response.text == 'https://www.billboard.com/charts/hot-100/1985-07-13/'
+    assert len(adapter_factory) == 1 and adapter_factory[0].kwargs['pool_maxsize'] > 0
+
+    set_adapter_factory(None)
+    assert type(build_adapter()) is HTTPAdapter
+
+
+def test_upstream_adapter_keeps_the_path_and_query(monkeypatch):
+    sent = []
+    # stop at the pooled HTTPAdapter, the request has been rewritten by then
+    monkeypatch.setattr(HTTPAdapter, 'send', lambda adapter, request, **kwargs: sent.append(request))
+    request = Request('GET', 'https://api.nasa.gov/planetary/apod', params={'thumbs': 'True'}).prepare()
+
+    UpstreamAdapter('http://fake:8080/').send(request)
+
+    assert sent[0].url == 'http://fake:8080/planetary/apod?thumbs=True'
+    assert sent[0].headers[http_transport.UPSTREAM_HOST_HEADER] == 'api.nasa.gov'
+
+
+def test_traced_adapter_times_each_request_with_its_real_host(spans, monkeypatch):
+    monkeypatch.setattr(http_transport, 'TRACING_ENABLED', True)
+    session = mount_adapter(Session())
+    adapter = session.get_adapter('https://example.com')
+    assert isinstance(adapter, TracedAdapter)
+    adapter.adapter = CannedAdapter()
+
+    session.get('https://apod.nasa.gov/apod/image/fake.jpg')
+
+    assert len(spans) == 1
+    record = spans[0]
+    assert (record['Stage'], record['host'], record['method'], record['status_code'], record['status']) == (
+        'http', 'apod.nasa.gov', 'GET', 200, 'ok')
+    assert record['Bytes'] == len('https://apod.nasa.gov/apod/image/fake.jpg')
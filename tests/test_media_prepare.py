@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+from fake_upstream import fake_jpeg
+from media_prepare import ImageTooLargeError, image_info, prepare_image
+
+
+def noise_image(path, size, image_format='JPEG'):
+    """an image of random pixels, which compresses badly so it is big on disk"""
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(path, image_format, quality=95)
+    return str(path)
+
+
+@pytest.mark.parametrize('image_format, expected', [('JPEG', 'jpeg'), ('PNG', 'png'), ('GIF', 'gif')])
+def test_image_info_reads_the_header(tmp_path, image_format, expected):
+    path = noise_image(tmp_path / f'image.{expected}', (320, 200), image_format)
+
+    info = image_info(path)
+
+    assert (info['format'], info['width'], info['height']) == (expected, 320, 200)
+    assert info['bytes'] == os.path.getsize(path)
+
+
+def test_image_info_finds_the_frame_header_after_other_markers(tmp_path):
+    path = tmp_path / 'apod.jpg'
+    path.write_bytes(fake_jpeg(2048, 1365, 4096))
+
+    info = image_info(str(path))
+    assert (info['format'], info['width'], info['height']) == ('jpeg', 2048, 1365)
+
+
+def test_image_within_the_limits_is_unchanged(tmp_path):
+    path = noise_image(tmp_path / 'small.jpg', (200, 100))
+
+    report = prepare_image(path, max_bytes=1024 * 1024, max_dimension=1024)
+
+    assert report['status'] == 'unchanged' and report['path'] == path and report['bytes_saved'] == 0
+
+
+def test_oversized_image_is_downscaled_then_cached(tmp_path):
+    path = noise_image(tmp_path / 'big.jpg', (1600, 1200))
+    max_bytes = 150 * 1024
+
+    report = prepare_image(path, max_bytes=max_bytes, max_dimension=1024)
+
+    assert report['status'] == 'downscaled'
+    assert report['bytes'] == os.path.getsize(report['path']) <= max_bytes
+    assert report['bytes_saved'] == os.path.getsize(path) - report['bytes'] > 0
+    info = image_info(report['path'])
+    assert info['format'] == 'jpeg' and max(info['width'], info['height']) <= 1024
+
+    again = prepare_image(path, max_bytes=max_bytes, max_dimension=1024)
+    assert again['status'] == 'cached' and again['path'] == report['path']
+
+
+def test_oversized_image_is_refused_without_pillow(tmp_path, monkeypatch):
+    path = noise_image(tmp_path / 'big.jpg', (1600, 1200))
+    monkeypatch.setitem(sys.modules, 'PIL', None)
+
+    with pytest.raises(ImageTooLargeError, match='Pillow'):
+        prepare_image(path, max_bytes=150 * 1024, max_dimension=1024)
+
+
+def test_oversized_file_that_is_not_an_image_is_refused(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'\x00' * 4096)
+
+    with pytest.raises(ImageTooLargeError):
+        prepare_image(str(path), max_bytes=1024)
@@ -0,0 +1,167 @@
+import base64
+import io
+import json
+import re
+import time
+
+import pytest
+import requests
+
+from fake_upstream import FakeUpstream
+from http_transport import mount_adapter
+from media_upload import ChunkedMediaUploader, MediaUploadError
+
+SEGMENT_SIZE = 1024
+MEDIA = bytes(range(256)) * 14  # 3.5 segments
+
+
+class RecordingUpstream(FakeUpstream):
+    """records every media upload command and fails the APPENDs of the segments in fail_segments"""
+
+    def __init__(self, fail_segments=None, **kwargs):
+        super().__init__(image_bytes=1024, **kwargs)
+        self.fail_segments = dict(fail_segments or {})
+        self.commands = []
+        self.segments = {}
+
+    def media_upload(self, path, query, headers, body):
+        if headers.get('content-type', '').startswith('multipart/'):
+            index = int(re.search(rb'name="segment_index"\r\n\r\n(\d+)', body).group(1))
+            self.commands.append(('APPEND', index))
+            if self.fail_segments.get(index):
+                self.fail_segments[index] -= 1
+                return 503, {'content-type': 'application/json'}, b'{"error": "segment failed"}'
+            self.segments[index] = re.search(rb'name="media"; filename="media"\r\n\r\n(.*)\r\n--', body, re.S).group(1)
+        else:
+            self.commands.append((re.search(rb'command=(\w+)', body).group(1).decode(), None))
+        return super().media_upload(path, query, headers, body)
+
+    def uploaded(self):
+        return b''.join(self.segments[index] for index in sorted(self.segments))
+
+
+class StreamingBody:
+    """like botocore's StreamingBody, it has seek() but it raises"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def seek(self, offset, whence=0):
+        raise io.UnsupportedOperation('seek')
+
+
+def make_uploader(max_workers=1, max_retries=0):
+    session = mount_adapter(requests.Session())
+    return ChunkedMediaUploader(session, segment_size=SEGMENT_SIZE, max_workers=max_workers,
+                                max_retries=max_retries, backoff=0)
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_upload_sends_init_append_finalize(start_upstream, max_workers):
+    upstream = start_upstream(RecordingUpstream())
+
+    media_id = make_uploader(max_workers).upload(io.BytesIO(MEDIA), len(MEDIA), 'image/jpeg', 'tweet_image')
+
+    assert media_id
+    assert upstream.commands[0] == ('INIT', None)
+    assert upstream.commands[-1] == ('FINALIZE', None)
+    assert sorted(index for command, index in upstream.commands if command == 'APPEND') == [0, 1, 2, 3]
+    assert upstream.uploaded() == MEDIA
+
+
+def test_upload_rebuffers_iterable_chunks(start_upstream):
+    upstream = start_upstream(RecordingUpstream())
+    chunks = (MEDIA[i:i + 700] for i in range(0, len(MEDIA), 700))
+
+    make_uploader().upload(chunks, len(MEDIA), 'image/jpeg')
+
+    assert upstream.uploaded() == MEDIA
+
+
+def test_failed_segment_is_retried(start_upstream):
+    upstream = start_upstream(RecordingUpstream(fail_segments={2: 1}))
+
+    make_uploader(max_retries=1).upload(io.BytesIO(MEDIA), len(MEDIA), 'image/jpeg')
+
+    assert [index for command, index in upstream.commands if command == 'APPEND'] == [0, 1, 2, 2, 3]
+    assert upstream.uploaded() == MEDIA
+
+
+@pytest.mark.parametrize('source', [io.BytesIO, StreamingBody])
+def test_resume_only_sends_unacknowledged_segments(start_upstream, source):
+    upstream = start_upstream(RecordingUpstream(fail_segments={2: 1}))
+    uploader = make_uploader()
+
+    with pytest.raises(MediaUploadError) as error:
+        uploader.upload(source(MEDIA), len(MEDIA), 'image/jpeg')
+    assert error.value.state['acknowledged'] == [0, 1]
+
+    del upstream.commands[:]
+    media_id = uploader.upload(source(MEDIA), len(MEDIA), 'image/jpeg', resume_state=error.value.state)
+
+    assert media_id == error.value.state['media_id']
+    assert upstream.commands == [('APPEND', 2), ('APPEND', 3), ('FINALIZE', None)]
+    assert upstream.uploaded() == MEDIA
+
+
+def test_tweet_img_resumes_failed_upload(start_upstream, no_sleep):
+    import tweet_img
+
+    image = bytes(range(256)) * 4096 * 2  # two 1MB segments
+    # more failures than the uploader retries, so the first attempt gives up on segment 1
+    upstream = start_upstream(RecordingUpstream(fail_segments={1: 4}))
+
+    response = tweet_img.lambda_handler({'message': 'hello', 'image': base64.b64encode(image).decode()}, None)
+
+    assert response['statusCode'] == 200, json.loads(response['body'])
+    assert [command for command, index in upstream.commands].count('INIT') == 1
+    assert [index for command, index in upstream.commands if command == 'APPEND'] == [0, 1, 1, 1, 1, 1]
+    assert upstream.uploaded() == image
+
+
+class SlowUpstream(RecordingUpstream):
+    """acknowledges every segment but the first slowly, so they are still in flight when it fails"""
+
+    def media_upload(self, path, query, headers, body):
+        if headers.get('content-type', '').startswith('multipart/') and b'name="segment_index"\r\n\r\n0' not in body:
+            time.sleep(0.2)
+        return super().media_upload(path, query, headers, body)
+
+
+class StuckUpstream(RecordingUpstream):
+    """never finishes processing the media"""
+
+    def media_upload(self, path, query, headers, body):
+        status, response_headers, response_body = super().media_upload(path, query, headers, body)
+        if self.commands[-1][0] == 'FINALIZE':
+            data = dict(json.loads(response_body), processing_info={'state': 'pending', 'check_after_secs': 1})
+            return self.json_response(data)
+        return status, response_headers, response_body
+
+    def media_status(self, path, query, headers, body):
+        self.commands.append(('STATUS', None))
+        return self.json_response({'media_id_string': query['media_id'][0],
+                                   'processing_info': {'state': 'in_progress', 'check_after_secs': 1}})
+
+
+def test_parallel_failure_keeps_every_acknowledged_segment(start_upstream):
+    upstream = start_upstream(SlowUpstream(fail_segments={0: 1}))
+
+    with pytest.raises(MediaUploadError) as error:
+        make_uploader(max_workers=3).upload(io.BytesIO(MEDIA), len(MEDIA), 'image/jpeg')
+
+    assert error.value.state['acknowledged'] == [1, 2]
+    assert sorted(upstream.segments) == [1, 2]
+
+
+def test_processing_is_waited_on_until_processing_max_wait(start_upstream):
+    upstream = start_upstream(StuckUpstream())
+    uploader = make_uploader()
+    uploader.processing_max_wait = 1.5
+
+    with pytest.raises(Exception, match='did not process'):
+        uploader.upload(io.BytesIO(MEDIA), len(MEDIA), 'image/jpeg')
+    assert upstream.commands.count(('STATUS', None)) == 1
@@ -0,0 +1,69 @@
+import pytest
+
+import message_templates
+from message_templates import (ELLIPSIS, MIN_FIELD_LENGTH, TWEET_LIMIT, Template, TemplateSet, render,
+                               split_excess, tweet_length)
+
+LINK = 'https://open.spotify.com/track/abc'
+
+
+def test_template_renders_with_format_specs():
+    assert Template('{day} {temp:.1f}C').render({'day': 'Monday', 'temp': 3.14159}) == 'Monday 3.1C'
+
+
+@pytest.mark.parametrize('source', ['{user.name}', '{items[0]}', '{value!r}', '{value:{width}}'])
+def test_template_refuses_anything_but_plain_fields(source):
+    with pytest.raises(ValueError):
+        Template(source)
+
+
+def test_links_count_as_url_length():
+    assert tweet_length('see https://example.com/' + 'x' * 100) == len('see ') + message_templates.URL_LENGTH
+
+
+def test_split_excess_is_proportional_and_keeps_a_minimum():
+    cuts = split_excess({'song': 's' * 112, 'artist': 'a' * 62}, 50, 12)
+
+    assert cuts == {'song': 34, 'artist': 17}
+    assert split_excess({'song': 's' * 10}, 5, 12) == {}
+
+
+def test_short_message_is_rendered_as_is():
+    assert render('birthday', user='@someone', age=30) == '@someone Happy Birthday, you are 30 today, well done.'
+
+
+def test_long_fields_share_the_cut():
+    message = render('spotify_reply', date='2001-01-01', song='s' * 200, artist='a' * 150, link=LINK)
+
+    assert tweet_length(message) <= TWEET_LIMIT
+    assert message.endswith(LINK)
+    song = message.split(' was ')[1].split(' by ')[0]
+    artist = message.split(' by ')[1].split(', listen')[0]
+    assert song.endswith(ELLIPSIS) and artist.endswith(ELLIPSIS)
+    assert len(song) > len(artist) > MIN_FIELD_LENGTH
+
+
+def test_fields_are_cut_below_the_minimum_when_that_is_the_only_way_to_fit():
+    templates = TemplateSet('test', ['{a} {b} {c}'], ('a', 'b'), limit=20)
+
+    message = templates.render({'a': 'a' * 30, 'b': 'b' * 30, 'c': 'c' * 15})
+
+    assert tweet_length(message) <= 20 and message.endswith('c' * 15)
+
+
+def test_render_within_a_smaller_limit():
+    header = message_templates.render_within('weather_header_location', 40, location='x' * 100)
+
+    assert len(header) <= 40 and header.endswith(':\n') and ELLIPSIS in header
+
+
+def test_weather_message_fits_with_a_long_location():
+    from tweet_weather import write_weather_message
+
+    days = [{'weather': [{'main': 'Thunderstorm'}], 'temp': {'day': -12.34}}] * 8
+
+    message = write_weather_message(days, 'Llanfairpwllgwyngyllgogerychwyrndrobwllllantysiliogogogoch ' * 4)
+
+    assert tweet_length(message) <= TWEET_LIMIT
+    assert message.count('Thunderstorm -12.34C') == 8
+    assert message.startswith('The next 7 days weather in Llanfair')
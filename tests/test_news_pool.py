@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from news_pool import NewsPool, NEWS_CATEGORIES
+
+
+def articles(*names):
+    return [{'title': f'story {name}', 'url': f'https://news.example.com/{name}'} for name in names]
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return NewsPool(str(tmp_path / 'news_pool.sqlite3'), ttl=60, tweeted_ttl=60)
+
+
+def test_refresh_pools_every_category_from_the_news_api(upstream, pool, monkeypatch):
+    monkeypatch.setenv('NEWS_API_KEY', 'key')
+
+    results = pool.refresh()
+
+    assert set(results) == set(NEWS_CATEGORIES)
+    assert all(added == 100 for added in results.values())
+    assert pool.available() == {category: 100 for category in NEWS_CATEGORIES}
+    assert upstream.stats['newsapi.org']['requests'] == len(NEWS_CATEGORIES)
+
+
+def test_failed_category_is_skipped(pool):
+    def fetch(category):
+        if category == 'sports':
+            raise KeyError('no articles')
+        return articles(category)
+
+    results = pool.refresh(['science', 'sports'], fetch=fetch)
+
+    assert results['science'] == 1 and 'no articles' in results['sports']
+    assert pool.available() == {'science': 1}
+
+
+def test_tweeted_article_is_not_taken_again_after_a_refresh(pool):
+    pool.add('science', articles('a', 'b'))
+    first = pool.take('science')['article_data']
+    pool.mark_tweeted(first['url'])
+
+    # the api still returns the tweeted article, it stays tweeted
+    pool.refresh(['science'], fetch=lambda category: articles('a', 'b'))
+
+    assert pool.available() == {'science': 1}
+    assert pool.take('science')['article_data']['url'] != first['url']
+
+
+def test_articles_expire_and_a_refresh_extends_untweeted_ones(pool, monkeypatch):
+    now = time.time()
+    pool.add('science', articles('a', 'b'))
+    pool.mark_tweeted('https://news.example.com/b')
+
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert pool.available() == {}
+    assert pool.take() is None
+
+    pool.add('science', articles('a', 'b'))
+    assert pool.available() == {'science': 1}
+    assert pool.take()['article_data']['url'] == 'https://news.example.com/a'
+
+
+def test_prune_forgets_tweeted_articles_after_tweeted_ttl(pool, monkeypatch):
+    now = time.time()
+    pool.add('science', articles('a'))
+    pool.mark_tweeted('https://news.example.com/a')
+
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    pool.prune()
+    pool.add('science', articles('a'))
+
+    assert pool.available() == {'science': 1}
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import rate_limit
+from bench_billboard_parser import synthetic_page
+from billboard_backfill import BillboardBackfill, chart_weeks, fixture_page_fetcher, fixture_uri_finder
+from billboard_index import BillboardIndex
+from rate_limit import HostRateLimiter, TokenBucket
+
+
+class FakeClock:
+    """stands in for the time module in rate_limit, sleeping moves the clock on instead of waiting"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_bucket_refills_at_its_rate_up_to_its_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    for _ in range(4):
+        assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 1
+    assert bucket.try_acquire(2) == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    # an idle bucket never holds more than its capacity
+    clock.now += 60
+    assert bucket.try_acquire(4) == 0
+    assert bucket.try_acquire() > 0
+
+
+def test_acquire_waits_for_a_token_unless_that_is_over_max_wait(clock):
+    bucket = TokenBucket(rate=0.5, capacity=1)
+    assert bucket.acquire()
+
+    assert bucket.acquire(max_wait=1) is False
+    assert clock.sleeps == []
+    assert bucket.acquire(max_wait=2)
+    assert clock.sleeps == [pytest.approx(2)]
+
+
+def test_server_budget_is_spread_over_the_rest_of_the_window(clock):
+    bucket = TokenBucket(rate=1, capacity=100)
+
+    bucket.set_state(tokens=10, reset_in=100)
+    assert bucket.rate == pytest.approx(0.1)
+
+    # an empty bucket still refills, slowly, rather than never
+    bucket.set_state(tokens=0, reset_in=100)
+    assert bucket.try_acquire() == pytest.approx(100)
+
+    bucket.set_state(tokens=100, reset_in=100)
+    assert bucket.rate == 1
+
+
+def test_each_host_has_its_own_bucket(clock):
+    limiter = HostRateLimiter(rate=1)
+
+    assert limiter.acquire('https://www.billboard.com/charts/hot-100/', max_wait=0)
+    assert limiter.acquire('api.spotify.com', max_wait=0)
+    assert not limiter.acquire('https://www.billboard.com/other', max_wait=0)
+    assert set(limiter.buckets) == {'www.billboard.com', 'api.spotify.com'}
+
+
+def test_date_range_is_deduped_to_chart_weeks():
+    assert chart_weeks('1985-07-07', '1985-07-21') == ['1985-07-13', '1985-07-20', '1985-07-27']
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    pages = tmp_path / 'pages'
+    pages.mkdir()
+    for week in ['1985-07-13', '1985-07-20', '1985-08-03']:
+        (pages / f'{week}.html').write_bytes(synthetic_page(entries=2).replace(b'Song 1', week.encode()))
+    uris = tmp_path / 'uris.json'
+    uris.write_text(json.dumps({'1985-07-13|Artist 1': 'uri_a', '1985-08-03|Artist 1': 'uri_c'}))
+    return fixture_page_fetcher(str(pages)), fixture_uri_finder(str(uris))
+
+
+def test_backfill_fills_the_index_from_fixtures(tmp_path, fixtures, clock):
+    index = BillboardIndex(str(tmp_path / 'billboard_index.tsv'))
+    index.add('1985-07-06', 'Indexed', 'Artist', 'uri_indexed')
+    fetch_page, find_song_uri = fixtures
+
+    stats = BillboardBackfill(index, fetch_page, find_song_uri, workers=2, batch_size=2).run(
+        chart_weeks('1985-07-06', '1985-08-03'))
+
+    # the week of 07-27 has no recorded page and the week of 07-20 has no recorded uri
+    assert stats == {'weeks': 5, 'fetched': 3, 'resolved': 2, 'failed': 1, 'skipped': 1}
+    saved = BillboardIndex(index.path)
+    assert len(saved) == 4
+    assert saved.weeks == ['1985-07-06', '1985-07-13', '1985-07-20', '1985-08-03']
+    assert saved.lookup('1985-07-13')['uri_code'] == 'uri_a'
+    assert saved.lookup('1985-07-20') == {'song': '1985-07-20', 'artist': 'Artist 1', 'uri_code': None,
+                                          'week': '1985-07-20'}
+
+
+def test_backfill_keeps_to_the_rate_of_each_host(tmp_path, fixtures, clock):
+    fetch_page, find_song_uri = fixtures
+    index = BillboardIndex(str(tmp_path / 'billboard_index.tsv'))
+
+    BillboardBackfill(index, fetch_page, find_song_uri, workers=1, rate=2).run(
+        ['1985-07-13', '1985-07-20', '1985-08-03'])
+
+    # each host starts with a second's worth of tokens, the third request to each waits half a second
+    assert clock.now == pytest.approx(1.0)
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
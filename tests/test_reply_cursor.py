@@ -0,0 +1,148 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from fake_upstream import FakeUpstream
+
+USER_ID = '1000'
+
+
+class MentionsUpstream(FakeUpstream):
+    """serves the mentions in mention_ids a few a page, newest first, and fails the replies to fail_ids"""
+
+    def __init__(self, mention_ids, page_size=2, fail_ids=()):
+        super().__init__(image_bytes=1024)
+        self.mention_ids = sorted(mention_ids, reverse=True)
+        self.page_size = page_size
+        self.fail_ids = set(fail_ids)
+        self.replies = []
+        self.routes.insert(0, ('api.twitter.com', 'GET', '/2/users/', self.mentions))
+
+    def mentions(self, path, query, headers, body):
+        since_id = int(query.get('since_id', ['0'])[0])
+        until_id = int(query.get('until_id', [str(10 ** 19)])[0])
+        ids = [mention_id for mention_id in self.mention_ids if since_id < mention_id < until_id]
+        start = int(query.get('pagination_token', ['0'])[0])
+        page = ids[start:start + min(self.page_size, int(query['max_results'][0]))]
+        meta = {'result_count': len(page)}
+        if page:
+            meta.update(newest_id=str(page[0]), oldest_id=str(page[-1]))
+        if start + len(page) < len(ids):
+            meta['next_token'] = str(start + len(page))
+        data = [{'id': str(mention_id), 'text': '@bot hello', 'author_id': '7'} for mention_id in page]
+        return self.json_response({'data': data, 'includes': {'users': [{'id': '7', 'username': 'someone'}]},
+                                   'meta': meta} if page else {'meta': meta})
+
+    def tweet(self, path, query, headers, body):
+        reply_to = int(json.loads(body)['reply']['in_reply_to_tweet_id'])
+        self.replies.append(reply_to)
+        if reply_to in self.fail_ids:
+            return self.json_response({'title': 'Forbidden'}, status=403)
+        return super().tweet(path, query, headers, body)
+
+
+def run(handler):
+    response = handler({}, None)
+    assert response['statusCode'] == 200, response['body']
+
+
+@pytest.mark.parametrize('cursor, meta, oldest_retry, expected', [
+    # nothing read, nothing to move
+    ({'since_id': '10', 'until_id': None, 'newest_id': None}, {}, None, None),
+    ({'since_id': '10', 'until_id': None, 'newest_id': None}, {'newest_id': '50', 'oldest_id': '20'}, None,
+     ('50', None, None)),
+    # stays below a mention to be tried again
+    ({'since_id': '10', 'until_id': None, 'newest_id': None}, {'newest_id': '50', 'oldest_id': '20'}, '30',
+     ('29', None, None)),
+    # pages left unread, carry on from the oldest read
+    ({'since_id': '10', 'until_id': None, 'newest_id': None},
+     {'newest_id': '50', 'oldest_id': '20', 'next_token': 't'}, None, ('10', '20', '50')),
+    # the last of a backlog read, move to the newest of the whole backlog
+    ({'since_id': '10', 'until_id': '20', 'newest_id': '50'}, {'newest_id': '19', 'oldest_id': '11'}, None,
+     ('50', None, None)),
+    ({'since_id': '10', 'until_id': '20', 'newest_id': '50'}, {}, None, ('50', None, None)),
+    ({'since_id': '10', 'until_id': '20', 'newest_id': '50'}, {'newest_id': '19', 'oldest_id': '11'}, '12',
+     ('11', None, None)),
+    # a first poll only reads back an hour, pages past the limit aren't kept
+    ({'since_id': None, 'until_id': None, 'newest_id': None},
+     {'newest_id': '50', 'oldest_id': '20', 'next_token': 't'}, None, ('50', None, None)),
+])
+def test_advance_cursor(cursor, meta, oldest_retry, expected):
+    from reply_to_tweets import advance_cursor
+
+    assert advance_cursor(cursor, meta, oldest_retry) == expected
+
+
+def test_backlog_longer_than_max_pages_is_read_over_several_runs(start_upstream, mention_store):
+    import reply_to_tweets
+
+    mention_ids = range(101, 101 + 25)
+    upstream = start_upstream(MentionsUpstream(mention_ids, page_size=2))
+    mention_store.save_cursor(USER_ID, '100')
+
+    # 10 pages of 2 a run, the oldest 5 are left for the next run
+    run(reply_to_tweets.lambda_handler)
+    assert mention_store.get_cursor(USER_ID) == {'since_id': '100', 'until_id': '106', 'newest_id': '125'}
+
+    run(reply_to_tweets.lambda_handler)
+    assert mention_store.get_cursor(USER_ID) == {'since_id': '125', 'until_id': None, 'newest_id': None}
+
+    run(reply_to_tweets.lambda_handler)
+    assert sorted(upstream.replies) == list(mention_ids)
+
+
+def test_failing_mention_holds_the_cursor_until_given_up_on(start_upstream, mention_store):
+    import reply_to_tweets
+
+    upstream = start_upstream(MentionsUpstream(range(101, 106), page_size=10, fail_ids={103}))
+    mention_store.save_cursor(USER_ID, '100')
+
+    for _ in range(mention_store.MENTION_MAX_ATTEMPTS - 1):
+        run(reply_to_tweets.lambda_handler)
+        assert mention_store.get_cursor(USER_ID)['since_id'] == '102'
+
+    run(reply_to_tweets.lambda_handler)
+    assert mention_store.get_cursor(USER_ID)['since_id'] == '105'
+
+    run(reply_to_tweets.lambda_handler)
+    assert sorted(upstream.replies) == [101, 102] + [103] * mention_store.MENTION_MAX_ATTEMPTS + [104, 105]
+
+
+def test_claim_left_by_a_crashed_run_is_taken_over(start_upstream, mention_store, monkeypatch):
+    import reply_to_tweets
+
+    upstream = start_upstream(MentionsUpstream(range(101, 104), page_size=10))
+    mention_store.save_cursor(USER_ID, '100')
+    # a run claimed 102 and died before replying
+    assert mention_store.claim_mention('102') == 'claimed'
+
+    run(reply_to_tweets.lambda_handler)
+    assert sorted(upstream.replies) == [101, 103]
+    assert mention_store.get_cursor(USER_ID)['since_id'] == '101'
+
+    later = time.time() + mention_store.MENTION_CLAIM_TIMEOUT + 1
+    monkeypatch.setattr(mention_store, 'time', SimpleNamespace(time=lambda: later))
+    run(reply_to_tweets.lambda_handler)
+    assert sorted(upstream.replies) == [101, 102, 103]
+    assert mention_store.get_cursor(USER_ID)['since_id'] == '103'
+
+
+def test_claim_states(mention_store):
+    assert mention_store.claim_mention('5') == 'claimed'
+    assert mention_store.claim_mention('5') == 'held'
+    assert mention_store.claim_mention('5', timeout=0) == 'claimed'
+    mention_store.mark_replied('5', '9')
+    assert mention_store.claim_mention('5', timeout=0) == 'done'
+
+
+def test_release_without_an_attempt_is_not_counted(mention_store):
+    for _ in range(mention_store.MENTION_MAX_ATTEMPTS + 1):
+        assert mention_store.claim_mention('6') == 'claimed'
+        assert mention_store.release_mention('6', attempted=False)
+
+    for attempt in range(1, mention_store.MENTION_MAX_ATTEMPTS + 1):
+        assert mention_store.claim_mention('6') == 'claimed'
+        assert mention_store.release_mention('6') == (attempt < mention_store.MENTION_MAX_ATTEMPTS)
+    assert mention_store.claim_mention('6') == 'done'
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+import pytest
+
+import reply_to_tweets
+from fake_upstream import FakeUpstream
+from single_flight import SingleFlight
+
+
+class RepliesUpstream(FakeUpstream):
+    """records the replies posted, answering each with a 429 past the run's wait while rate_limited is set"""
+
+    def __init__(self, rate_limited=False):
+        super().__init__(image_bytes=1024)
+        self.rate_limited = rate_limited
+        self.replies = {}
+
+    def tweet(self, path, query, headers, body):
+        if self.rate_limited:
+            return self.json_response({'title': 'Too Many Requests'}, status=429, headers={
+                'x-rate-limit-limit': '200', 'x-rate-limit-remaining': '0',
+                'x-rate-limit-reset': str(int(time.time()) + 900)})
+        reply = json.loads(body)
+        self.replies[reply['reply']['in_reply_to_tweet_id']] = reply['text']
+        return super().tweet(path, query, headers, body)
+
+
+def mentions(*mentions):
+    """builds get_new_mentions' result from (id, author_id, text) tuples, the authors are looked up by id"""
+    authors = {'7': 'someone', '8': 'alice'}
+    return {
+        'data': [{'id': mention_id, 'author_id': author_id, 'text': text} for mention_id, author_id, text in mentions],
+        'includes': {'users': [{'id': author_id, 'username': username} for author_id, username in authors.items()]},
+        'meta': {'result_count': len(mentions)},
+    }
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """a fresh spotify memo and a slow stand-in for the spotify lambda, recording the dates looked up"""
+    dates = []
+    in_flight = {'now': 0, 'most': 0}
+    lock = threading.Lock()
+
+    def find_spotify_song(date_str):
+        with lock:
+            dates.append(date_str)
+            in_flight['now'] += 1
+            in_flight['most'] = max(in_flight['most'], in_flight['now'])
+        time.sleep(0.2)
+        with lock:
+            in_flight['now'] -= 1
+        return {'song': f'Song {date_str}', 'artist': 'Artist', 'link': 'https://open.spotify.com/track/x'}
+
+    monkeypatch.setattr(reply_to_tweets, 'spotify_lookups', SingleFlight(ttl=60))
+    monkeypatch.setattr(reply_to_tweets, 'find_spotify_song', find_spotify_song)
+    return dates, in_flight
+
+
+def test_each_mention_gets_the_reply_its_kind_needs(start_upstream, mention_store, birthdays_table, lookups):
+    upstream = start_upstream(RepliesUpstream())
+
+    counts = reply_to_tweets.reply_to_mentions(mentions(
+        ('11', '8', '@bot birthday 1990-07-04'),
+        ('12', '7', '@bot spotify 1985-07-10'),
+        ('13', '7', '@bot hello'),
+    ))
+
+    assert (counts['sent'], counts['failed'], counts['skipped']) == (3, 0, 0)
+    assert counts['kinds'] == {'spotify': 1, 'birthday': 1, 'help': 1}
+    # the birthday is stored under the username of the mention's author
+    assert birthdays_table.get_item(Key={'username': 'alice'})['Item']['birthday'] == '1990-07-04'
+    assert 'database' in upstream.replies['11']
+    assert 'Song 1985-07-10' in upstream.replies['12']
+    assert 'spotify' in upstream.replies['13']
+
+
+def test_lookups_run_concurrently_and_one_per_chart_week(start_upstream, mention_store, lookups):
+    upstream = start_upstream(RepliesUpstream())
+    dates, in_flight = lookups
+    # four chart weeks, two mentions in the week of 1985-07-13
+    texts = ['1985-07-08', '1985-07-10', '1986-01-01', '1990-05-05', '2000-10-10']
+
+    start = time.perf_counter()
+    counts = reply_to_tweets.reply_to_mentions(
+        mentions(*((str(20 + n), '7', f'@bot spotify {date}') for n, date in enumerate(texts))), workers=4)
+    elapsed = time.perf_counter() - start
+
+    assert counts['sent'] == 5 and len(upstream.replies) == 5
+    assert len(dates) == 4 and in_flight['most'] > 1
+    assert elapsed < 4 * 0.2
+    assert counts['stages']['lookup']['count'] == 5
+
+
+def test_mention_already_processed_is_skipped(start_upstream, mention_store):
+    upstream = start_upstream(RepliesUpstream())
+    mention_store.claim_mention('31')
+    mention_store.mark_replied('31', '99')
+
+    counts = reply_to_tweets.reply_to_mentions(mentions(('31', '7', '@bot hi'), ('32', '7', '@bot hi')))
+
+    assert (counts['sent'], counts['skipped']) == (1, 1)
+    assert list(upstream.replies) == ['32']
+
+
+def test_rate_limited_run_leaves_the_rest_for_the_next_run(start_upstream, mention_store):
+    upstream = start_upstream(RepliesUpstream(rate_limited=True))
+
+    counts = reply_to_tweets.reply_to_mentions(
+        mentions(*((str(40 + n), '7', '@bot hi') for n in range(3))), workers=1)
+
+    assert (counts['sent'], counts['failed']) == (0, 3)
+    assert counts['oldest_retry'] == '40'
+    assert upstream.stats['api.twitter.com']['requests'] == 1
+
+    # releasing them without an attempt doesn't count towards giving up on them
+    upstream.rate_limited = False
+    for _ in range(mention_store.MENTION_MAX_ATTEMPTS):
+        for n in range(3):
+            assert mention_store.claim_mention(str(40 + n)) == 'claimed'
+            mention_store.release_mention(str(40 + n), attempted=False)
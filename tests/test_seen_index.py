@@ -0,0 +1,74 @@
+import pytest
+
+import tweet_number_1_song
+from seen_index import BloomFilter, SeenIndex, content_hash
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / 'seen_index.sqlite3')
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for n in range(1000):
+        bloom.add(content_hash('news_url', f'https://news.example.com/{n}'))
+
+    assert all(content_hash('news_url', f'https://news.example.com/{n}') in bloom for n in range(1000))
+    false_positives = sum(content_hash('news_url', f'https://other.example.com/{n}') in bloom for n in range(10000))
+    assert false_positives < 300
+
+
+def test_added_content_is_seen_and_kinds_do_not_collide(index_path):
+    index = SeenIndex(index_path)
+    index.add('apod_date', '2024-01-01')
+
+    assert index.seen('apod_date', '2024-01-01')
+    assert not index.seen('song_week', '2024-01-01')
+    assert not index.seen('apod_date', '2024-01-02')
+
+
+def test_unseen_content_is_answered_by_the_bloom_filter(index_path):
+    index = SeenIndex(index_path)
+    index.add('news_url', 'https://news.example.com/1')
+
+    for n in range(2, 100):
+        assert not index.seen('news_url', f'https://news.example.com/{n}')
+    assert index.stats['bloom_negatives'] == 98
+    assert index.stats['exact_checks'] == 0
+
+
+def test_bloom_false_positive_falls_back_to_the_table(index_path):
+    # a filter this small is saturated by a few values, so it says 'maybe' to everything
+    index = SeenIndex(index_path, capacity=1, error_rate=0.5)
+    for n in range(20):
+        index.add('news_url', f'https://news.example.com/{n}')
+    assert content_hash('news_url', 'https://news.example.com/new') in index.bloom
+
+    assert not index.seen('news_url', 'https://news.example.com/new')
+    assert index.seen('news_url', 'https://news.example.com/3')
+    assert index.stats == {'bloom_negatives': 0, 'exact_checks': 2, 'false_positives': 1}
+
+
+def test_filter_is_rebuilt_from_the_table(index_path):
+    SeenIndex(index_path).add('song_week', '1985-07-13')
+
+    index = SeenIndex(index_path)
+
+    assert index.bloom.count == 1
+    assert index.seen('song_week', '1985-07-13')
+
+
+def test_chart_week_already_tweeted_is_not_picked(index_path, monkeypatch):
+    seen_index = SeenIndex(index_path)
+    seen_index.add('song_week', '1985-07-13')
+    monkeypatch.setattr(tweet_number_1_song, 'get_seen_index', lambda: seen_index)
+    song_finder = tweet_number_1_song.SpotifySongFinder()
+    dates = iter(['1985-07-10', '1985-07-13', '1985-07-14'])
+    monkeypatch.setattr(song_finder, 'generate_random_date', lambda: next(dates))
+
+    assert song_finder.generate_new_date() == '1985-07-14'
+
+    monkeypatch.setattr(song_finder, 'generate_random_date', lambda: '1985-07-08')
+    with pytest.raises(Exception, match='3 attempts'):
+        song_finder.generate_new_date(max_attempts=3)
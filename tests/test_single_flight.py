@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import single_flight
+from single_flight import SingleFlight
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(single_flight, 'time', clock)
+    return clock
+
+
+def blocking_call(release, result):
+    """a call that returns result once release is set, counting how often it was made"""
+    calls = []
+
+    def call():
+        calls.append(1)
+        assert release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call, calls
+
+
+@contextmanager
+def run_concurrently(flight, key, call, callers):
+    """starts the callers, waits until all but the leader are waiting on the leader's call, then lets it finish"""
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(flight.do, key, call) for _ in range(callers)]
+        deadline = time.monotonic() + 5
+        while flight.stats['joined'] < callers - 1:
+            assert time.monotonic() < deadline, 'callers never joined the call in flight'
+            time.sleep(0.01)
+        yield futures
+
+
+def test_concurrent_calls_for_a_key_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    call, calls = blocking_call(release, 'song')
+
+    with run_concurrently(flight, '1985-07-13', call, callers=5) as futures:
+        release.set()
+        assert [future.result() for future in futures] == ['song'] * 5
+
+    assert len(calls) == 1
+    assert flight.stats == {'calls': 1, 'joined': 4, 'memo_hits': 0}
+
+
+def test_failure_is_raised_to_every_waiter_and_not_remembered():
+    flight = SingleFlight(ttl=60)
+    release = threading.Event()
+    call, calls = blocking_call(release, ValueError('lambda failed'))
+
+    with run_concurrently(flight, 'week', call, callers=3) as futures:
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match='lambda failed'):
+                future.result()
+
+    assert flight.do('week', lambda: 'song') == 'song'
+    assert len(calls) == 1 and flight.stats['calls'] == 2
+
+
+def test_result_is_memoised_until_the_ttl_passes(clock):
+    flight = SingleFlight(ttl=60)
+    results = iter(['first', 'second'])
+
+    assert flight.do('week', lambda: next(results)) == 'first'
+    clock.now = 59
+    assert flight.do('week', lambda: next(results)) == 'first'
+    clock.now = 61
+    assert flight.do('week', lambda: next(results)) == 'second'
+    assert flight.stats == {'calls': 2, 'joined': 0, 'memo_hits': 1}
+
+
+def test_without_a_ttl_only_calls_in_flight_are_shared(clock):
+    flight = SingleFlight()
+
+    flight.do('week', lambda: 'song')
+    flight.do('week', lambda: 'song')
+
+    assert flight.stats['calls'] == 2
+
+
+def test_least_recently_used_result_is_dropped_and_forget_drops_one(clock):
+    flight = SingleFlight(ttl=60, max_entries=2)
+    for key in ['a', 'b']:
+        flight.do(key, lambda: key)
+    flight.do('a', lambda: 'new a')
+    flight.do('c', lambda: 'c')
+
+    assert flight.do('b', lambda: 'new b') == 'new b'
+    assert flight.do('c', lambda: 'new c') == 'c'
+    flight.forget('c')
+    assert flight.do('c', lambda: 'new c') == 'new c'
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import tweet_number_1_song
+from fake_upstream import FakeUpstream
+from spotify_cache import SpotifySearchCache, normalise_key
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'spotify_cache.sqlite3')
+
+
+def test_key_ignores_case_and_spacing():
+    assert normalise_key('  Like  a\tPrayer ', 'MADONNA') == normalise_key('like a prayer', 'madonna')
+    assert normalise_key('Song', 'Artist A') != normalise_key('Song', 'Artist B')
+
+
+def test_least_recently_used_entry_is_evicted_from_memory():
+    cache = SpotifySearchCache(path=None, max_entries=2)
+    cache.put('a', 'x', 'uri_a')
+    cache.put('b', 'x', 'uri_b')
+    cache.get('a', 'x')
+    cache.put('c', 'x', 'uri_c')
+
+    assert cache.get('b', 'x') == (False, None)
+    assert cache.get('a', 'x') == (True, 'uri_a')
+    assert cache.get('c', 'x') == (True, 'uri_c')
+    assert cache.stats == {'memory_hits': 3, 'persistent_hits': 0, 'misses': 1}
+
+
+def test_persistent_tier_is_shared_with_a_new_cache(cache_path):
+    SpotifySearchCache(cache_path).put('Song', 'Artist', 'uri')
+
+    cache = SpotifySearchCache(cache_path)
+
+    assert cache.get('song', 'artist') == (True, 'uri')
+    assert cache.get('song', 'artist') == (True, 'uri')
+    assert cache.stats == {'memory_hits': 1, 'persistent_hits': 1, 'misses': 0}
+
+
+def test_not_found_expires_before_a_found_uri(cache_path, monkeypatch):
+    now = time.time()
+    cache = SpotifySearchCache(cache_path, ttl=100, negative_ttl=10)
+    cache.put('found', 'artist', 'uri')
+    cache.put('missing', 'artist', None)
+    assert cache.get('missing', 'artist') == (True, None)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('missing', 'artist') == (False, None)
+    assert cache.get('found', 'artist') == (True, 'uri')
+
+    monkeypatch.setattr(time, 'time', lambda: now + 101)
+    assert cache.get('found', 'artist') == (False, None)
+    cache.purge_expired()
+    assert SpotifySearchCache(cache_path).get('found', 'artist') == (False, None)
+
+
+def test_unusable_database_falls_back_to_memory(tmp_path):
+    cache = SpotifySearchCache(str(tmp_path / 'missing' / 'spotify_cache.sqlite3'))
+    cache.put('Song', 'Artist', 'uri')
+
+    assert cache.get('Song', 'Artist') == (True, 'uri')
+
+
+class NotOnSpotifyUpstream(FakeUpstream):
+    """spotify finds nothing for any search"""
+
+    def spotify_search(self, path, query, headers, body):
+        return self.json_response({'tracks': {'items': []}})
+
+
+@pytest.fixture
+def song_finder(cache_path, tmp_path, monkeypatch):
+    monkeypatch.setenv('SPOTIFY_CID', 'cid')
+    monkeypatch.setenv('SPOTIFY_SECRET', 'secret')
+    monkeypatch.chdir(tmp_path)  # spotipy writes its token .cache to the working directory
+    search_cache = SpotifySearchCache(cache_path)
+    monkeypatch.setattr(tweet_number_1_song, 'get_spotify_cache', lambda: search_cache)
+    return tweet_number_1_song.SpotifySongFinder()
+
+
+def test_found_song_is_only_searched_for_once(upstream, song_finder):
+    uri_code = song_finder.find_song_uri('Song', 'Artist')
+
+    assert song_finder.find_song_uri('SONG', 'artist') == uri_code
+    assert upstream.stats['api.spotify.com']['requests'] == 1
+
+
+def test_song_not_on_spotify_is_not_searched_for_again(start_upstream, song_finder):
+    upstream = start_upstream(NotOnSpotifyUpstream())
+
+    for _ in range(2):
+        with pytest.raises(Exception, match='not found on spotify'):
+            song_finder.find_song_uri('Song', 'Artist')
+
+    # the artist and song search and the song only search, then the cached result
+    assert upstream.stats['api.spotify.com']['requests'] == 2
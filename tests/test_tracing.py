@@ -0,0 +1,120 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import tracing
+from trace_report import read_spans, summarise
+from tracing import NOOP_SPAN, emf_record, span, traced, traced_handler
+
+
+def test_emf_record_shape():
+    record = emf_record('search', 12.34567, byte_count=2048, properties={'source': 'spotify'}, timestamp=1700000000.5)
+
+    assert record == {
+        'source': 'spotify',
+        'Bytes': 2048,
+        '_aws': {
+            'Timestamp': 1700000000500,
+            'CloudWatchMetrics': [{
+                'Namespace': tracing.TRACING_NAMESPACE,
+                'Dimensions': [['Service', 'Stage']],
+                'Metrics': [{'Name': 'Duration', 'Unit': 'Milliseconds'}, {'Name': 'Bytes', 'Unit': 'Bytes'}],
+            }],
+        },
+        'Service': tracing.SERVICE,
+        'Stage': 'search',
+        'Duration': 12.346,
+    }
+    # every metric named in the metadata is a top level field, as CloudWatch requires
+    for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+        assert isinstance(record[metric['Name']], (int, float))
+
+
+def test_record_without_bytes_only_has_the_duration_metric():
+    record = emf_record('parse', 1.0)
+
+    assert record['_aws']['CloudWatchMetrics'][0]['Metrics'] == [{'Name': 'Duration', 'Unit': 'Milliseconds'}]
+    assert 'Bytes' not in record
+
+
+def test_nested_spans_name_their_parent_and_errors_are_recorded(spans):
+    with pytest.raises(KeyError):
+        with span('fetch', source='billboard') as fetch_span:
+            fetch_span.add_bytes(100)
+            fetch_span.add_bytes(50)
+            with span('parse', mode='stream') as parse_span:
+                parse_span.set(cache='miss')
+            raise KeyError('no number one')
+
+    parse_record, fetch_record = spans
+    assert (parse_record['Stage'], parse_record['parent'], parse_record['status'], parse_record['cache']) == (
+        'parse', 'fetch', 'ok', 'miss')
+    assert (fetch_record['Stage'], fetch_record['status'], fetch_record['error'], fetch_record['Bytes']) == (
+        'fetch', 'error', 'KeyError', 150)
+    assert 'parent' not in fetch_record
+
+
+def test_handler_span_tags_the_spans_of_its_invocation(spans):
+    @traced('render', template='weather')
+    def render():
+        return 'message'
+
+    @traced_handler
+    def lambda_handler(event, context):
+        render()
+        return {'statusCode': 207}
+
+    assert lambda_handler({}, SimpleNamespace(aws_request_id='req-1')) == {'statusCode': 207}
+
+    render_record, handler_record = spans
+    assert (render_record['Stage'], render_record['template'], render_record['parent']) == ('render', 'weather', 'handler')
+    assert (handler_record['Stage'], handler_record['status_code']) == ('handler', 207)
+    for record in spans:
+        assert (record['handler'], record['request_id']) == (__name__, 'req-1')
+
+    # spans after the invocation are not tagged with it
+    with span('post'):
+        pass
+    assert 'request_id' not in spans[-1]
+
+
+def test_tracing_off_costs_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', False)
+
+    def handler(event, context):
+        return {}
+
+    assert span('fetch', source='x') is NOOP_SPAN
+    assert traced('render')(handler) is handler
+    assert traced_handler(handler) is handler
+
+
+def test_spans_are_appended_to_the_tracing_path(tmp_path, monkeypatch):
+    path = tmp_path / 'spans.log'
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', True)
+    monkeypatch.setattr(tracing, 'TRACING_PATH', str(path))
+    monkeypatch.setattr(tracing, '_output', None)
+
+    with span('fetch', source='weather'):
+        pass
+    tracing._output.close()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1 and json.loads(lines[0])['Stage'] == 'fetch'
+
+
+def test_report_groups_spans_read_from_log_lines(spans):
+    for _ in range(3):
+        with span('fetch', source='weather') as fetch_span:
+            fetch_span.add_bytes(10)
+    with pytest.raises(ValueError):
+        with span('fetch', source='nasa'):
+            raise ValueError()
+    lines = ['START RequestId: 1', 'not json {'] + [f'2024-01-01T00:00:00Z\treq\t{json.dumps(record)}' for record in spans]
+
+    summary = summarise(read_spans(lines), group_by=('Stage', 'source'))
+
+    assert [(row['Stage'], row['source'], row['count'], row['errors'], row['bytes']) for row in summary] == [
+        ('fetch', 'weather', 3, 0, 30), ('fetch', 'nasa', 1, 1, 0)]
+    assert all(row['p50_ms'] <= row['p95_ms'] <= row['max_ms'] for row in summary)
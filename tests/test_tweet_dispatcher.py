@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+import media_store
+from tweet_dispatcher import dispatch_tweet, InProcessTransport
+from tweet_outbox import TweetOutbox, SQLiteOutboxBackend
+
+
+class FlakyLambdaTransport:
+    """stands in for a transport to another lambda, failing the first failures sends"""
+
+    local_media = False
+    max_inline_bytes = 1024 * 1024
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.payloads = []
+
+    def send(self, kind, payload):
+        self.payloads.append((kind, payload))
+        if len(self.payloads) <= self.failures:
+            return {'statusCode': 500, 'body': json.dumps({'message': 'flaky'})}
+        return {'statusCode': 200, 'body': json.dumps({'message': 'sent'})}
+
+
+@pytest.fixture
+def local_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_DIR', str(tmp_path / 'media'))
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_BUCKET', None)
+    return media_store.stage_media([b'\xff\xd8' + b'\x00' * 2048], '.jpg')
+
+
+def local_path(media_ref):
+    return media_ref[len('file://'):]
+
+
+def test_local_media_is_sent_inline_and_deleted_once_sent(local_image):
+    transport = FlakyLambdaTransport(failures=0)
+
+    dispatch_tweet('hello', media_ref=local_image, transport=transport)
+
+    kind, payload = transport.payloads[0]
+    assert kind == 'image'
+    assert 'media_ref' not in payload and payload['media_type'] == 'image/jpeg'
+    assert not os.path.exists(local_path(local_image))
+
+
+def test_local_media_is_kept_when_the_send_fails(local_image):
+    with pytest.raises(Exception):
+        dispatch_tweet('hello', media_ref=local_image, transport=FlakyLambdaTransport(failures=1))
+
+    assert os.path.exists(local_path(local_image))
+
+
+def test_outbox_retries_an_image_tweet_with_the_same_reference(local_image, tmp_path):
+    transport = FlakyLambdaTransport(failures=2)
+    outbox = TweetOutbox(SQLiteOutboxBackend(str(tmp_path / 'outbox.sqlite3')), transport=transport,
+                         max_attempts=3, backoff=0)
+    outbox.enqueue('hello', local_image)
+
+    assert outbox.drain() == {'sent': 1, 'retry': 2, 'failed': 0, 'skipped': 0}
+    assert len({payload['image'] for _, payload in transport.payloads}) == 1
+    assert not os.path.exists(local_path(local_image))
+
+
+def test_local_media_is_handed_over_in_process(upstream, local_image):
+    response = dispatch_tweet('hello', media_ref=local_image, transport=InProcessTransport())
+
+    assert response['statusCode'] == 200
+    assert upstream.stats['upload.twitter.com']['requests'] >= 3
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import media_store
+import tweet_nasa_img
+from fake_upstream import FakeUpstream, fake_jpeg
+from http_cache import HTTPCache
+from seen_index import AlreadySeenError, SeenIndex
+
+IMAGE_URL = 'https://apod.nasa.gov/apod/image/2401/nebula.jpg'
+HD_URL = 'https://apod.nasa.gov/apod/image/2401/nebula_hd.jpg'
+
+
+class ApodUpstream(FakeUpstream):
+    """serves one APOD, its hd image is big, and records the conditional headers of image requests"""
+
+    def __init__(self, apod):
+        super().__init__(image_bytes=4096)
+        self.apod_data = apod
+        self.hd_image = fake_jpeg(4096, 2730, 64 * 1024)
+        self.image_requests = []
+
+    def apod(self, path, query, headers, body):
+        return self.json_response(self.apod_data)
+
+    def apod_image(self, path, query, headers, body):
+        self.image_requests.append((path, headers.get('if-none-match')))
+        if path.endswith('_hd.jpg'):
+            return 200, {'content-type': 'image/jpeg'}, self.hd_image
+        return super().apod_image(path, query, headers, body)
+
+
+def apod(media_type='image', **fields):
+    return dict({'date': '2024-01-01', 'title': 'A nebula', 'media_type': media_type}, **fields)
+
+
+@pytest.fixture
+def nasa(tmp_path, monkeypatch):
+    cache = HTTPCache(str(tmp_path / 'http_cache.sqlite3'))
+    seen_index = SeenIndex(str(tmp_path / 'seen_index.sqlite3'))
+    monkeypatch.setattr(tweet_nasa_img, 'get_http_cache', lambda: cache)
+    monkeypatch.setattr(tweet_nasa_img, 'get_seen_index', lambda: seen_index)
+    monkeypatch.setattr(tweet_nasa_img, 'NASA_IMAGE_CACHE_DIR', str(tmp_path / 'nasa_images'))
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_DIR', str(tmp_path / 'media'))
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_BUCKET', None)
+    os.makedirs(tweet_nasa_img.NASA_IMAGE_CACHE_DIR)
+    return tweet_nasa_img
+
+
+@pytest.mark.parametrize('nasa_data, candidates', [
+    (apod(url=IMAGE_URL, hdurl=HD_URL), [HD_URL, IMAGE_URL]),
+    (apod(url=IMAGE_URL, hdurl=IMAGE_URL), [IMAGE_URL]),
+    (apod('video', url='https://www.youtube.com/embed/x', thumbnail_url=IMAGE_URL), [IMAGE_URL]),
+    (apod('video', url='https://www.youtube.com/embed/x'), []),
+    (apod('other'), []),
+])
+def test_image_candidates_follow_the_media_type(nasa_data, candidates):
+    assert tweet_nasa_img.image_candidates(nasa_data) == candidates
+
+
+def test_metadata_is_fetched_once_per_day(start_upstream, nasa):
+    upstream = start_upstream(ApodUpstream(apod(url=IMAGE_URL)))
+
+    assert nasa.get_apod() == nasa.get_apod() == apod(url=IMAGE_URL)
+    assert upstream.stats['api.nasa.gov']['requests'] == 1
+
+
+def test_cached_image_is_revalidated_instead_of_downloaded_again(start_upstream, nasa, tmp_path):
+    upstream = start_upstream(ApodUpstream(apod(url=IMAGE_URL)))
+    cache = nasa.get_http_cache()
+    path = str(tmp_path / 'image.jpg')
+
+    assert cache.fetch_file('apod_image', IMAGE_URL, path, max_age=0) == (path, 'miss')
+    assert cache.fetch_file('apod_image', IMAGE_URL, path, max_age=0) == (path, 'revalidated')
+
+    assert upstream.image_requests == [('/apod/image/2401/nebula.jpg', None),
+                                       ('/apod/image/2401/nebula.jpg', upstream.image_etag)]
+    with open(path, 'rb') as image_file:
+        assert image_file.read() == upstream.image
+
+
+def test_image_over_the_download_limit_falls_back_to_the_standard_one(start_upstream, nasa, monkeypatch):
+    upstream = start_upstream(ApodUpstream(apod(url=IMAGE_URL, hdurl=HD_URL)))
+    monkeypatch.setattr(nasa, 'NASA_MAX_DOWNLOAD_BYTES', 32 * 1024)
+
+    image_data = nasa.get_nasa_image()
+
+    assert image_data['image_url'] == IMAGE_URL
+    with open(image_data['media_ref'][len('file://'):], 'rb') as image_file:
+        assert image_file.read() == upstream.image
+    # the hd image was refused before its body was written
+    assert [name for name in os.listdir(nasa.NASA_IMAGE_CACHE_DIR) if 'partial' in name] == []
+
+
+def test_video_without_a_thumbnail_is_tweeted_as_a_link(start_upstream, nasa):
+    upstream = start_upstream(ApodUpstream(apod('video', url='https://www.youtube.com/embed/x')))
+
+    image_data = nasa.get_nasa_image()
+
+    assert image_data['media_ref'] is None and image_data['media_type'] == 'video'
+    assert image_data['page_url'] == 'https://apod.nasa.gov/apod/ap240101.html'
+    assert upstream.image_requests == []
+
+
+def test_day_already_tweeted_is_stopped_before_downloading(start_upstream, nasa):
+    upstream = start_upstream(ApodUpstream(apod(url=IMAGE_URL)))
+    nasa.get_seen_index().add('apod_date', '2024-01-01')
+
+    with pytest.raises(AlreadySeenError):
+        nasa.get_nasa_image()
+    assert upstream.image_requests == []
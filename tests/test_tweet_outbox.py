@@ -0,0 +1,101 @@
+import os
+import time
+
+import boto3
+import pytest
+
+import media_store
+from fake_upstream import FakeUpstream
+from tweet_dispatcher import InProcessTransport
+from tweet_outbox import TweetOutbox, SQLiteOutboxBackend, DynamoDBOutboxBackend, OUTBOX_DUE_INDEX
+
+
+def tweets_posted(upstream):
+    return upstream.stats.get('api.twitter.com', {}).get('requests', 0)
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def make_backend(request, tmp_path):
+    """returns a function building backends that share one store, as separate drains would"""
+    if request.param == 'sqlite':
+        yield lambda: SQLiteOutboxBackend(str(tmp_path / 'outbox.sqlite3'))
+        return
+
+    aws = request.getfixturevalue('aws')  # noqa: F841
+    boto3.resource('dynamodb').create_table(
+        TableName='TweetOutbox',
+        KeySchema=[{'AttributeName': 'key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'key', 'AttributeType': 'S'},
+                              {'AttributeName': 'status', 'AttributeType': 'S'},
+                              {'AttributeName': 'next_attempt', 'AttributeType': 'N'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': OUTBOX_DUE_INDEX,
+            'KeySchema': [{'AttributeName': 'status', 'KeyType': 'HASH'},
+                          {'AttributeName': 'next_attempt', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    yield lambda: DynamoDBOutboxBackend('TweetOutbox')
+
+
+def test_duplicate_tweets_are_posted_once(upstream, make_backend):
+    outbox = TweetOutbox(make_backend(), transport=InProcessTransport())
+
+    key, added = outbox.enqueue('hello')
+    assert added
+    assert outbox.enqueue('hello') == (key, False)
+
+    assert outbox.drain() == {'sent': 1, 'retry': 0, 'failed': 0, 'skipped': 0}
+    assert outbox.enqueue('hello') == (key, False)
+    assert outbox.drain()['sent'] == 0
+    assert outbox.backend.get(key)['status'] == 'sent'
+    assert tweets_posted(upstream) == 1
+
+
+def test_tweet_claimed_by_another_drain_is_skipped(upstream, make_backend):
+    first = TweetOutbox(make_backend(), transport=InProcessTransport())
+    second = TweetOutbox(make_backend(), transport=InProcessTransport())
+    first.enqueue('hello')
+
+    # both drains read the tweet as due, only the first to claim it posts it
+    due = first.backend.due(10, time.time())
+    assert second.drain()['sent'] == 1
+    assert first._deliver(due[0]) == 'skipped'
+    assert tweets_posted(upstream) == 1
+
+
+def test_expired_claim_is_taken_over(upstream, make_backend):
+    outbox = TweetOutbox(make_backend(), transport=InProcessTransport(), claim_timeout=0)
+    key, _ = outbox.enqueue('hello')
+
+    # a drain that died after claiming leaves the tweet in 'sending'
+    assert outbox.backend.claim(key, time.time(), 0)
+    assert outbox.backend.get(key)['status'] == 'sending'
+
+    assert outbox.drain()['sent'] == 1
+    assert tweets_posted(upstream) == 1
+
+
+def test_failed_tweet_is_retried_then_given_up_on(start_upstream, make_backend):
+    upstream = start_upstream(FakeUpstream(error_rate=1.0))
+    outbox = TweetOutbox(make_backend(), transport=InProcessTransport(), max_attempts=2, backoff=0)
+    key, _ = outbox.enqueue('hello')
+
+    assert outbox.drain() == {'sent': 0, 'retry': 1, 'failed': 1, 'skipped': 0}
+    item = outbox.backend.get(key)
+    assert item['status'] == 'failed'
+    assert int(item['attempts']) == 2
+    assert tweets_posted(upstream) == 2
+
+
+def test_media_of_a_failed_tweet_is_deleted(start_upstream, make_backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_DIR', str(tmp_path / 'media'))
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_BUCKET', None)
+    media_ref = media_store.stage_media([b'\xff\xd8' + b'\x00' * 2048], '.jpg')
+    start_upstream(FakeUpstream(error_rate=1.0))
+    outbox = TweetOutbox(make_backend(), transport=InProcessTransport(), max_attempts=2, backoff=0)
+    key, _ = outbox.enqueue('hello', media_ref)
+
+    assert outbox.drain()['failed'] == 1
+    assert not os.path.exists(media_ref[len('file://'):])
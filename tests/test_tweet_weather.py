@@ -0,0 +1,79 @@
+import json
+import time
+
+import pytest
+
+import tweet_dispatcher
+import tweet_weather
+from fake_upstream import FakeUpstream
+from http_cache import HTTPCache
+
+
+class LocationsUpstream(FakeUpstream):
+    """forecasts that are slow for the latitudes in slow, fail for those in failing, and a record of tweets"""
+
+    def __init__(self, slow=(), failing=()):
+        super().__init__(seed=1)
+        self.slow = set(slow)
+        self.failing = set(failing)
+        self.tweets = []
+
+    def weather(self, path, query, headers, body):
+        lat = float(query['lat'][0])
+        if lat in self.slow:
+            time.sleep(0.5)
+        if lat in self.failing:
+            return self.json_response({'message': 'down'}, status=503)
+        return super().weather(path, query, headers, body)
+
+    def tweet(self, path, query, headers, body):
+        self.tweets.append(json.loads(body)['text'])
+        return super().tweet(path, query, headers, body)
+
+
+@pytest.fixture
+def weather(tmp_path, monkeypatch):
+    monkeypatch.setattr(tweet_dispatcher, 'TWEET_TRANSPORT', 'inprocess')
+    cache = HTTPCache(str(tmp_path / 'http_cache.sqlite3'))
+    monkeypatch.setattr(tweet_weather, 'get_http_cache', lambda: cache)
+    return tweet_weather
+
+
+def location(name, lat, lon=0.0):
+    return {'name': name, 'lat': lat, 'lon': lon}
+
+
+def test_locations_sharing_a_forecast_fetch_it_once(start_upstream, weather):
+    upstream = start_upstream(LocationsUpstream())
+
+    results = weather.tweet_weather_for_locations(
+        [location('Bolton', 53.571, -2.42), location('Farnworth', 53.5699, -2.4201), location('Leeds', 53.8, -1.55)])
+
+    assert sorted(result['name'] for result in results) == ['Bolton', 'Farnworth', 'Leeds']
+    assert all('weather_data' in result for result in results)
+    assert upstream.stats['api.openweathermap.org']['requests'] == 2
+    # each location still gets its own tweet
+    assert sorted(tweet.split(' in ', 1)[1].split(':', 1)[0] for tweet in upstream.tweets) == [
+        'Bolton', 'Farnworth', 'Leeds']
+
+
+def test_slow_location_does_not_hold_up_the_others(start_upstream, weather):
+    upstream = start_upstream(LocationsUpstream(slow=[1.0]))
+
+    results = weather.tweet_weather_for_locations([location('Slow', 1.0), location('Fast', 2.0)], workers=2)
+
+    assert [result['name'] for result in results] == ['Fast', 'Slow']
+    assert 'Fast' in upstream.tweets[0]
+
+
+@pytest.mark.parametrize('failing, status_code', [((), 200), ((1.0,), 207), ((1.0, 2.0), 500)])
+def test_handler_status_reflects_the_failed_locations(start_upstream, weather, failing, status_code):
+    upstream = start_upstream(LocationsUpstream(failing=failing))
+
+    response = weather.lambda_handler({'locations': [location('One', 1.0), location('Two', 2.0)]}, None)
+
+    assert response['statusCode'] == status_code
+    results = json.loads(response['body'])['locations']
+    assert sorted(result['name'] for result in results if 'error' in result) == [
+        {1.0: 'One', 2.0: 'Two'}[lat] for lat in failing]
+    assert len(upstream.tweets) == 2 - len(failing)
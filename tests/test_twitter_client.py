@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from fake_upstream import FakeUpstream
+from twitter_client import TwitterClient, RateLimitedError, endpoint_key
+
+TWEET_URL = 'https://api.twitter.com/2/tweets'
+
+
+class RateLimitedUpstream(FakeUpstream):
+    """answers the first rate_limited tweets with a 429 whose window resets reset_in seconds later"""
+
+    def __init__(self, rate_limited, reset_in=0):
+        super().__init__(image_bytes=1024)
+        self.rate_limited = rate_limited
+        self.reset_in = reset_in
+        self.tweets = 0
+
+    def tweet(self, path, query, headers, body):
+        self.tweets += 1
+        if self.tweets <= self.rate_limited:
+            return self.json_response({'title': 'Too Many Requests'}, status=429, headers={
+                'x-rate-limit-limit': '200', 'x-rate-limit-remaining': '0',
+                'x-rate-limit-reset': str(int(time.time() + self.reset_in))})
+        return super().tweet(path, query, headers, body)
+
+
+def test_endpoint_key_groups_ids():
+    assert endpoint_key('get', 'https://api.twitter.com/2/users/12345/mentions?x=1') == 'GET /2/users/:id/mentions'
+
+
+def test_request_is_sent_once_with_no_attempts_configured(upstream):
+    response = TwitterClient(max_attempts=0).post(TWEET_URL, json={'text': 'hello'})
+
+    assert response.status_code == 201
+
+
+def test_budget_follows_the_rate_limit_headers(upstream):
+    client = TwitterClient()
+    client.post(TWEET_URL, json={'text': 'hello'})
+
+    budget = client.budget()['POST /2/tweets']
+    assert budget['limit'] == 200 and budget['remaining'] == 199
+
+
+def test_429_is_retried_once_the_window_resets(start_upstream):
+    upstream = start_upstream(RateLimitedUpstream(rate_limited=1, reset_in=1))
+
+    response = TwitterClient(max_wait=5).post(TWEET_URL, json={'text': 'hello'})
+
+    assert response.status_code == 201
+    assert upstream.tweets == 2
+
+
+def test_429_resetting_after_max_wait_raises(start_upstream):
+    start_upstream(RateLimitedUpstream(rate_limited=1, reset_in=600))
+
+    with pytest.raises(RateLimitedError) as error:
+        TwitterClient(max_wait=5).post(TWEET_URL, json={'text': 'hello'})
+    assert error.value.retry_after > 5
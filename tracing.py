@@ -0,0 +1,209 @@
+"""
+Per-stage timing for the lambda handlers.
+
+Stages are wrapped in a span, either a context manager or a decorator:
+
+    with span('search', source='spotify') as s:
+        result = sp.search(...)
+        s.add_bytes(size)
+
+    @traced('render')
+    def render(...):
+
+Each finished span is written as one CloudWatch embedded metric format (EMF) json line, so in a lambda
+the line printed to stdout becomes a 'Duration' (and 'Bytes') metric with Service and Stage dimensions,
+and the other fields stay searchable in the log. benchmarks/trace_report.py works out percentiles per
+stage from saved log lines.
+
+Tracing is off unless TRACING_ENABLED is 'true'. It is read when modules are imported like the other
+settings: traced() then returns the function it decorates unchanged and span() returns a shared span
+that does nothing, so the instrumented code costs next to nothing when it is off.
+"""
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from os import environ
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TRACING_ENABLED = environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+TRACING_NAMESPACE = environ.get('TRACING_NAMESPACE', 'TwitterBots')
+# Spans are appended to this file when set, otherwise printed to stdout where CloudWatch picks them up
+TRACING_PATH = environ.get('TRACING_PATH')
+SERVICE = environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+# the innermost open span and the handler invocation it belongs to, per thread of execution
+_current_span = contextvars.ContextVar('current_span', default=None)
+_invocation = contextvars.ContextVar('invocation', default=None)
+
+_write_lock = threading.Lock()
+_output = None
+
+
+def _write(line):
+    global _output
+    with _write_lock:
+        if _output is None:
+            _output = open(TRACING_PATH, 'a', buffering=1) if TRACING_PATH else sys.stdout
+        _output.write(line + '\n')
+        _output.flush()
+
+
+def emf_record(stage, duration_ms, byte_count=None, properties=None, timestamp=None):
+    """
+    Builds a span's record in CloudWatch embedded metric format.
+
+    Parameters:
+    stage (str): The stage e.g. 'fetch', 'search' or 'post'
+    duration_ms (float): How long the stage took
+    byte_count (int): Optional bytes the stage moved
+    properties (dict): Other fields logged with the record, not dimensions
+
+    Returns:
+    dict: The record
+    """
+    metrics = [{'Name': 'Duration', 'Unit': 'Milliseconds'}]
+    record = dict(properties or {})
+    if byte_count is not None:
+        metrics.append({'Name': 'Bytes', 'Unit': 'Bytes'})
+        record['Bytes'] = byte_count
+    record.update({
+        '_aws': {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': TRACING_NAMESPACE,
+                'Dimensions': [['Service', 'Stage']],
+                'Metrics': metrics,
+            }],
+        },
+        'Service': SERVICE,
+        'Stage': stage,
+        'Duration': round(duration_ms, 3),
+    })
+    return record
+
+
+class Span:
+    """A timed stage, written out when it closes with its status, byte count and properties."""
+
+    __slots__ = ('stage', 'properties', 'byte_count', 'start', '_token')
+
+    def __init__(self, stage, properties):
+        self.stage = stage
+        self.properties = properties
+        self.byte_count = None
+
+    def add_bytes(self, count):
+        """adds to the bytes the stage moved, e.g. a response or upload size"""
+        if count is not None:
+            self.byte_count = (self.byte_count or 0) + count
+
+    def set(self, **properties):
+        """adds properties to the record, e.g. a cache status or response code"""
+        self.properties.update(properties)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        _current_span.reset(self._token)
+        parent = _current_span.get()
+
+        properties = self.properties
+        properties.setdefault('status', 'error' if exc_type else 'ok')
+        if exc_type:
+            properties['error'] = exc_type.__name__
+        if parent is not None:
+            properties['parent'] = parent.stage
+        invocation = _invocation.get()
+        if invocation:
+            properties.update(invocation)
+        try:
+            _write(json.dumps(emf_record(self.stage, duration_ms, self.byte_count, properties), default=str))
+        except Exception as e:
+            # timing must never break the code it is timing
+            logger.warning(f'could not write {self.stage} span, error: {e}')
+        return False
+
+
+class NoopSpan:
+    """Stands in for a Span when tracing is off."""
+
+    __slots__ = ()
+
+    def add_bytes(self, count):
+        pass
+
+    def set(self, **properties):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def span(stage, **properties):
+    """
+    Times a stage used as a context manager.
+
+    Parameters:
+    stage (str): The stage e.g. 'fetch', 'parse', 'search', 'render', 'upload', 'post' or 'invoke'
+    **properties: Fields logged with the record e.g. source='billboard'
+
+    Returns:
+    Span: The span, or NOOP_SPAN when tracing is off
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(stage, properties)
+
+
+def traced(stage, **properties):
+    """decorator timing every call of a function as a stage, returns the function unchanged when tracing is off"""
+    def decorator(function):
+        if not TRACING_ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(stage, dict(properties)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_handler(function):
+    """
+    Decorator for a lambda_handler, times the whole invocation as the 'handler' stage with its statusCode
+    and tags every span opened during it with the handler and the lambda request id.
+    """
+    if not TRACING_ENABLED:
+        return function
+    handler = function.__module__
+
+    @functools.wraps(function)
+    def wrapper(event, context):
+        token = _invocation.set({'handler': handler, 'request_id': getattr(context, 'aws_request_id', None)})
+        try:
+            with Span('handler', {}) as handler_span:
+                response = function(event, context)
+                if isinstance(response, dict) and 'statusCode' in response:
+                    handler_span.set(status_code=response['statusCode'])
+                return response
+        finally:
+            _invocation.reset(token)
+    return wrapper
@@ -0,0 +1,201 @@
+import logging
+from os import environ
+import json
+from media_store import is_local_media, inline_media, delete_media
+from tracing import span
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The lambda functions that post tweets
+TWEET_FUNCTIONS = {
+    'text': 'twiter_bot_tweet_text',
+    'image': 'twiter_bot_tweet_image',
+}
+
+# Which transport is used to post tweets, one of 'inprocess', 'lambda', 'async' or 'outbox'.
+# 'inprocess' calls the posting code directly and needs the twitter credentials in this function's environment,
+# 'outbox' queues the tweet in tweet_outbox for a drainer to post
+TWEET_TRANSPORT = environ.get('TWEET_TRANSPORT', 'lambda')
+
+# With the outbox transport, post straight away after queueing rather than leaving it to the drainer
+OUTBOX_DRAIN_ON_ENQUEUE = environ.get('OUTBOX_DRAIN_ON_ENQUEUE', 'false').lower() == 'true'
+
+# Largest invoke payloads lambda accepts, less room for the message and the rest of the json
+LAMBDA_SYNC_PAYLOAD_LIMIT = 6 * 1024 * 1024 - 16 * 1024
+LAMBDA_ASYNC_PAYLOAD_LIMIT = 256 * 1024 - 16 * 1024
+
+@per_container
+def get_lambda_client():
+    """returns a boto3 lambda client, created once per container"""
+    # boto3 takes a few hundred ms to import, only pay for it when a lambda is actually invoked
+    import boto3
+    return boto3.client('lambda')
+
+
+def check_remote_media(payload):
+    """
+    Refuses a payload for another lambda function that refers to media on this function's local disk,
+    which the other function can't read. dispatch_tweet sends such media inline instead.
+    """
+    media_ref = payload.get('media_ref')
+    if media_ref and is_local_media(media_ref):
+        raise ValueError(f'local media reference {media_ref} can not be read by another lambda function, '
+                         f'stage it in s3 with MEDIA_STORE_BUCKET or send it through dispatch_tweet')
+
+
+# Each transport says whether media staged on this function's local disk ('file://' references) can
+# be handed to it, and if not the largest base64 image it can carry inline instead (None for none)
+
+class InProcessTransport:
+    """Posts tweets by calling the tweet_text / tweet_img handlers directly, no lambda invoke."""
+
+    local_media = True
+    max_inline_bytes = None
+
+    def send(self, kind, payload):
+        if kind == 'image':
+            import tweet_img
+            return tweet_img.lambda_handler(payload, None)
+        import tweet_text
+        return tweet_text.lambda_handler(payload, None)
+
+
+class LambdaTransport:
+    """Posts tweets by synchronously invoking the tweet lambda functions."""
+
+    local_media = False
+    max_inline_bytes = LAMBDA_SYNC_PAYLOAD_LIMIT
+
+    def send(self, kind, payload):
+        check_remote_media(payload)
+        response = get_lambda_client().invoke(
+            FunctionName=TWEET_FUNCTIONS[kind],
+            InvocationType='RequestResponse',
+            Payload=json.dumps(payload)
+        )
+        response_payload = json.loads(response['Payload'].read())
+
+        # Check if there was an error invoking the function
+        if 'FunctionError' in response or response['StatusCode'] != 200:
+            logger.error(f"error invoking {TWEET_FUNCTIONS[kind]}, status code: {response['StatusCode']}")
+            return {'statusCode': 500, 'body': json.dumps(response_payload)}
+        return response_payload
+
+
+class AsyncLambdaTransport:
+    """Posts tweets by invoking the tweet lambda functions fire-and-forget, the result is not waited for."""
+
+    local_media = False
+    max_inline_bytes = LAMBDA_ASYNC_PAYLOAD_LIMIT
+
+    def send(self, kind, payload):
+        check_remote_media(payload)
+        response = get_lambda_client().invoke(
+            FunctionName=TWEET_FUNCTIONS[kind],
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+        if response['StatusCode'] != 202:
+            logger.error(f"error invoking {TWEET_FUNCTIONS[kind]}, status code: {response['StatusCode']}")
+            return {'statusCode': 500, 'body': json.dumps({'message': 'async invoke was not accepted'})}
+        return {'statusCode': 202, 'body': json.dumps({'message': 'Tweet queued'})}
+
+
+class OutboxTransport:
+    """Queues tweets in the durable outbox, duplicates of a tweet already queued or sent are dropped."""
+
+    # a sqlite outbox lives on this function's disk alongside the media, a dynamodb one is drained elsewhere
+    local_media = environ.get('OUTBOX_BACKEND', 'sqlite') == 'sqlite'
+    max_inline_bytes = None
+
+    def send(self, kind, payload):
+        from tweet_outbox import get_outbox
+
+        outbox = get_outbox()
+        key, added = outbox.enqueue(payload['message'], payload.get('media_ref'), payload.get('idempotency_key'))
+        if OUTBOX_DRAIN_ON_ENQUEUE:
+            outbox.drain()
+        message = 'Tweet queued' if added else 'Duplicate tweet, already queued or sent'
+        return {'statusCode': 202, 'body': json.dumps({'message': message, 'key': key})}
+
+
+TRANSPORTS = {
+    'inprocess': InProcessTransport,
+    'lambda': LambdaTransport,
+    'async': AsyncLambdaTransport,
+    'outbox': OutboxTransport,
+}
+
+
+def get_transport(name=None):
+    """
+    Returns the transport used to post tweets.
+
+    Parameters:
+    name (str): 'inprocess', 'lambda', 'async' or 'outbox', defaults to the TWEET_TRANSPORT environment variable
+
+    Returns:
+    object: A transport with a send(kind, payload) method
+    """
+    name = name or TWEET_TRANSPORT
+    try:
+        return TRANSPORTS[name]()
+    except KeyError:
+        raise ValueError(f'unknown tweet transport: {name}, expected one of {list(TRANSPORTS)}')
+
+
+def dispatch_tweet(message, media_ref=None, transport=None, idempotency_key=None):
+    """
+    Posts a tweet through the configured transport and checks the response.
+
+    Parameters:
+    message (str): The text to be tweeted
+    media_ref (str): Optional reference to staged media (see media_store) to attach to the tweet
+    transport (object): Optional transport, defaults to get_transport()
+    idempotency_key (str): Optional key the outbox deduplicates on, defaults to a hash of the text and media
+
+    Returns:
+    dict: The response payload from the tweet handler
+    """
+    transport = transport or get_transport()
+    kind = 'image' if media_ref else 'text'
+    payload = {'message': message}
+    inlined = False
+    if media_ref and is_local_media(media_ref) and not getattr(transport, 'local_media', True):
+        # another function can't read this one's disk, send the image in the payload as before staging
+        if not getattr(transport, 'max_inline_bytes', None):
+            raise ValueError(f'{type(transport).__name__} can not carry local media {media_ref}, '
+                             f'MEDIA_STORE_BUCKET is required to stage it in s3')
+        logger.warning(f'media staged locally, sending it inline to {TWEET_FUNCTIONS[kind]}, '
+                       f'set MEDIA_STORE_BUCKET to hand it over by reference')
+        payload.update(inline_media(media_ref, transport.max_inline_bytes))
+        inlined = True
+    elif media_ref:
+        payload['media_ref'] = media_ref
+    if idempotency_key:
+        payload['idempotency_key'] = idempotency_key
+
+    logger.info(f'{TWEET_FUNCTIONS[kind]} called using {type(transport).__name__}')
+    with span('invoke', function=TWEET_FUNCTIONS[kind], transport=type(transport).__name__) as invoke_span:
+        response_payload = transport.send(kind, payload)
+        invoke_span.set(status_code=response_payload.get('statusCode'))
+
+    # Handle the response, 202 means an async or outbox transport accepted the tweet
+    if response_payload.get('statusCode') not in (200, 202):
+        logger.error('Error sending tweet')
+        logger.error(response_payload)
+        raise Exception(response_payload)
+
+    # the local copy is only needed until the tweet has been handed over, a failed send keeps it for a retry
+    # with the same reference, and whoever owns the reference deletes it if they give up
+    if inlined:
+        delete_media(media_ref)
+
+    if response_payload['statusCode'] == 202:
+        logger.info('Tweet queued')
+    else:
+        logger.info('Tweet successfully sent')
+    return response_payload
@@ -1,8 +1,15 @@
-from requests_oauthlib import OAuth1Session
-from os import environ
+from twitter_client import get_twitter_client, RateLimitedError
 import logging
 import json
+from os import environ
 import base64
+import io
+import mimetypes
+from contextlib import nullcontext
+from media_store import open_media, media_size, delete_media
+from media_upload import ChunkedMediaUploader, MediaUploadError
+from media_prepare import MEDIA_MAX_IMAGE_BYTES
+from tracing import span, traced_handler
 
 # Set up logging
 logger = logging.getLogger()
@@ -12,52 +19,60 @@ logger.setLevel(logging.INFO)
 TWEET_URL = 'https://api.twitter.com/2/tweets'
 MEDIA_UPLOAD_URL = 'https://upload.twitter.com/1.1/media/upload.json'
 
+# Times an upload is tried, a retry resumes the same media_id and only sends the segments not yet acknowledged
+MEDIA_UPLOAD_ATTEMPTS = int(environ.get('MEDIA_UPLOAD_ATTEMPTS', 2))
+
+@traced_handler
 def lambda_handler(event, context):
     """
     AWS Lambda function to post a tweet with an image.
 
     Parameters:
     event (dict): AWS Lambda uses this parameter to pass in event data to the handler. 
-                  It should include 'image' (base64 encoded string) and 'message' (the text string that will be tweeted)
+                  It should include 'media_ref' (a reference from media_store.stage_media) and 'message'
+                  (the text string that will be tweeted). 'image' (base64 encoded string, with an optional
+                  'media_type') is still accepted in place of 'media_ref', for older callers and for media
+                  staged on another function's local disk.
 
     Returns:
     dict: A response object with the status code and the success message or an error message
     """
     try:
-        # Extract image and message from event
-        image_base64_str = event['image']
+        # Extract message and image reference from event
         message = event['message']
+        media_ref = event.get('media_ref')
 
-        # Decode the base64 string into bytes
-        image_bytes = base64.b64decode(image_base64_str)
-
-        # Create an OAuth1Session
-        oauth = OAuth1Session(
-            environ.get("TWITTER_API_KEY"),
-            client_secret=environ.get("TWITTER_API_SECRET"),
-            resource_owner_key=environ.get("TWITTER_API_ACCESS_TOKEN"),
-            resource_owner_secret=environ.get("TWITTER_API_ACCESS_TOKEN_SECRET"),
-        )
-
-        # Prepare the files dict for the POST request
-        files = {'media': image_bytes}
+        # Get the shared rate limit aware client, reused between warm invocations
+        client = get_twitter_client()
 
-        # Upload the image so it can be attached to a tweet
-        upload_res = oauth.post(MEDIA_UPLOAD_URL, files=files)
-
-        # Extract the 'media_id_string' from the response
-        upload_res_data = upload_res.json()
-        media_id = upload_res_data['media_id_string']
+        # Upload the image so it can be attached to a tweet, staged media is streamed from the
+        # media store, base64 images are only decoded for callers still sending them in the payload
+        if media_ref:
+            media_type = mimetypes.guess_type(media_ref)[0] or 'image/jpeg'
+            total_bytes = media_size(media_ref)
+            # Fail before uploading anything rather than after INIT, callers should prepare images with media_prepare
+            if total_bytes > MEDIA_MAX_IMAGE_BYTES and media_type != 'image/gif':
+                raise ValueError(f'image is {total_bytes} bytes, over the upload limit of {MEDIA_MAX_IMAGE_BYTES}')
+            media_id = upload_media(client, lambda: open_media(media_ref), total_bytes, media_type)
+        else:
+            image_bytes = base64.b64decode(event['image'])
+            media_type = event.get('media_type', 'image/jpeg')
+            media_id = upload_media(client, lambda: nullcontext(io.BytesIO(image_bytes)), len(image_bytes), media_type)
 
         # Prepare the tweet data
         tweet = {"text": message, "media": {"media_ids": [media_id]}}
 
         # Post the tweet
-        tweet_res = oauth.post(url=TWEET_URL, json=tweet)
+        with span('post', kind='image') as post_span:
+            tweet_res = client.post(TWEET_URL, json=tweet)
+            post_span.set(status_code=tweet_res.status_code)
+        logger.info(f'twitter rate limit budget: {client.budget()}')
 
         # Handle the response
         if tweet_res.status_code == 201:
             logger.info(f'tweet successful, message: {message}')
+            if media_ref:
+                delete_media(media_ref)
             return {
                 'statusCode': 200,
                 'body': json.dumps({
@@ -73,6 +88,15 @@ def lambda_handler(event, context):
                 'response_code': tweet_res.status_code,
                 'response_json': tweet_res.json(),
             })
+    except RateLimitedError as e:
+        logger.warning(f'image tweet not sent, rate limited: {e}')
+        return {
+            'statusCode': 429,
+            'body': json.dumps({
+                'message': 'Rate limited: {}'.format(e),
+                'retry_after': round(e.retry_after),
+            }),
+        }
     except Exception as e:
         logger.exception(
             'An error occurred, traceback message:\n {}'.format(e))
@@ -83,3 +107,35 @@ def lambda_handler(event, context):
                 'message': 'An error occurred: {}'.format(e)
             }),
         }
+
+
+def upload_media(client, open_source, total_bytes, media_type, attempts=MEDIA_UPLOAD_ATTEMPTS):
+    """
+    Uploads an image to twitter in segments so it can be attached to a tweet, resuming a failed upload
+    from the segments twitter already acknowledged.
+
+    Parameters:
+    client (TwitterClient): The client used to make the requests
+    open_source (callable): Returns a context manager yielding the image from its start as a file-like
+                            object, read a segment at a time, called again for each attempt
+    total_bytes (int): The size of the image in bytes
+    media_type (str): The mime type of the image e.g. 'image/jpeg'
+    attempts (int): Number of times the upload is tried
+
+    Returns:
+    str: The 'media_id_string' of the uploaded image
+    """
+    uploader = ChunkedMediaUploader(client, upload_url=MEDIA_UPLOAD_URL)
+    resume_state = None
+    with span('upload', media_type=media_type) as upload_span:
+        upload_span.add_bytes(total_bytes)
+        for attempt in range(1, max(1, attempts) + 1):
+            with open_source() as media_file:
+                try:
+                    return uploader.upload(media_file, total_bytes, media_type, media_category='tweet_image',
+                                           resume_state=resume_state)
+                except MediaUploadError as e:
+                    if attempt >= attempts:
+                        raise
+                    logger.warning(f"media upload attempt {attempt} failed, resuming media_id: {e.state['media_id']}")
+                    resume_state = e.state
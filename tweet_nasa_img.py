@@ -1,16 +1,33 @@
 import logging
 from os import environ
-from requests import get
-import boto3
+import os
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 import json
-import base64
+from media_store import stage_media, delete_media, CHUNK_SIZE
+from http_cache import get_http_cache
+from media_prepare import prepare_image
+from tweet_dispatcher import dispatch_tweet
+from tweet_outbox import idempotency_key
+from message_templates import render
+from seen_index import AlreadySeenError, get_seen_index
+from tracing import traced_handler
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initiate boto3 client for lambda
-lambda_client = boto3.client('lambda')
+NASA_APOD_URL = 'https://api.nasa.gov/planetary/apod?'
+# Seconds the APOD metadata is reused for, so a retried or re-run lambda doesn't call the api again
+NASA_APOD_MAX_AGE = int(environ.get('NASA_APOD_MAX_AGE', 60 * 60))
+NASA_TIMEOUT = float(environ.get('NASA_TIMEOUT', 10))
+# Largest image downloaded, bigger images fall back to the standard resolution one. Downloaded images over
+# twitter's limits are downscaled to fit, see media_prepare
+NASA_MAX_DOWNLOAD_BYTES = int(environ.get('NASA_MAX_DOWNLOAD_BYTES', 50 * 1024 * 1024))
+NASA_IMAGE_CACHE_DIR = environ.get('NASA_IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nasa_images'))
 
+@traced_handler
 def lambda_handler(event, context):
     """
     AWS Lambda function to retrieve a NASA image of the day and tweet it.
@@ -23,40 +40,41 @@ def lambda_handler(event, context):
         image_data = get_nasa_image()
 
         title = image_data['title']
-        image_obj = image_data['image']
+        media_ref = image_data['media_ref']
+        image_url = image_data['image_url']
+
+        # Compose the tweet message, with a link to the APOD page when there is no image to attach
+        message = write_nasa_message(title, None if media_ref else image_data['page_url'])
+
+        # Send the tweet, raises an exception if the tweet was not sent
+        # The staged copy gets a new reference each run so dedupe on the image's url instead
+        try:
+            dispatch_tweet(message, media_ref=media_ref, idempotency_key=idempotency_key(message, image_url))
+        except Exception:
+            # a retry stages the image again, don't leave this copy behind in the media store
+            if media_ref:
+                delete_media(media_ref)
+            raise
+        get_seen_index().add('apod_date', image_data['date'])
 
-        # Compose the tweet message
-        message = write_nasa_message(title)
-
-        logger.info('tweet_image function called')
-
-        # Invoke the 'twiter_bot_tweet_image' lambda function
-        response = lambda_client.invoke(
-            FunctionName='twiter_bot_tweet_image',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({'message': message, 'image': image_obj})
-        )
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Image tweet successfully sent!' if media_ref else 'Link tweet successfully sent!',
+                'prepared': image_data['prepared'],
+            }),
+        }
 
-        response_payload = json.loads(response['Payload'].read())
+    except AlreadySeenError as e:
+        # a retry after the image was tweeted, nothing left to do
+        logger.info(str(e))
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': str(e),
+            }),
+        }
 
-        # Handle the response from the 'tweet_image' Lambda function
-        if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-            logger.error('Error sending tweet')
-            logger.error(response_payload)
-            raise Exception(response_payload)
-        
-        if response['StatusCode'] == 200:
-            logger.info('Tweet successfully sent')
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Image tweet successfully sent!',
-                }),
-            }
-        else:
-            logger.error(response['StatusCode'])
-            raise Exception(f'Tweet was not sent. status code {response["StatusCode"]}.')
-            
     except Exception as e:
         logger.exception('An error occurred, traceback message:\n {}'.format(e))
         return {
@@ -67,53 +85,132 @@ def lambda_handler(event, context):
         }
         
 
+def get_apod():
+    """
+    Gets today's APOD metadata, from the cache if it was fetched recently, e.g. by an earlier
+    attempt of a retried run. thumbs=True asks for a thumbnail url on video days.
+
+    Returns:
+    dict: The APOD metadata
+    """
+    params = {'api_key': environ.get('NASA_API_KEY'), 'thumbs': 'True'}
+    # The cache key leaves out the api key
+    key = f"apod:{datetime.now(timezone.utc).strftime('%Y-%m-%d')}"
+    body, cache_status = get_http_cache().fetch(
+        key, NASA_APOD_URL, params=params, max_age=NASA_APOD_MAX_AGE, timeout=NASA_TIMEOUT)
+    logger.info(f'NASA APOD metadata cache status: {cache_status}')
+    return json.loads(body)
+
+
+def image_candidates(nasa_data):
+    """
+    Picks the urls of the images that could be posted for an APOD, best first, by its media_type.
+    Videos and other media can't be posted as images so only their thumbnail is a candidate.
+
+    Parameters:
+    nasa_data (dict): The APOD metadata
+
+    Returns:
+    list: Image urls, empty if there is nothing that can be posted
+    """
+    if nasa_data.get('media_type') == 'image':
+        urls = [nasa_data.get('hdurl'), nasa_data.get('url')]
+    else:
+        urls = [nasa_data.get('thumbnail_url')]
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+def fetch_image(date, image_url):
+    """
+    Downloads an APOD image into the per date image cache, revalidating a cached copy with a conditional
+    GET, prepares it to fit twitter's image limits and stages it for tweet_img. Images over
+    NASA_MAX_DOWNLOAD_BYTES are refused before their body is read.
+
+    Returns:
+    tuple: (the media reference of the staged image, the media_prepare report)
+    """
+    suffix = os.path.splitext(urlparse(image_url).path)[1]
+    path = os.path.join(NASA_IMAGE_CACHE_DIR, f'{date}-{hashlib.sha256(image_url.encode()).hexdigest()[:16]}{suffix}')
+    path, cache_status = get_http_cache().fetch_file(
+        f'apod_image:{image_url}', image_url, path, timeout=NASA_TIMEOUT, max_bytes=NASA_MAX_DOWNLOAD_BYTES,
+        chunk_size=CHUNK_SIZE)
+    logger.info(f'NASA image cache status: {cache_status}, url: {image_url}')
+
+    # Images from earlier days are no longer needed
+    for name in os.listdir(NASA_IMAGE_CACHE_DIR):
+        if not name.startswith(date):
+            os.remove(os.path.join(NASA_IMAGE_CACHE_DIR, name))
+
+    # Downscale the image if it is over the upload limits, the prepared copy is cached alongside it
+    report = prepare_image(path)
+
+    # Stage the image a chunk at a time rather than holding it all in memory
+    with open(report['path'], 'rb') as image_file:
+        media_ref = stage_media(
+            iter(lambda: image_file.read(CHUNK_SIZE), b''), suffix=os.path.splitext(report['path'])[1])
+    return media_ref, report
+
+
 def get_nasa_image():
     """
     Connects to the NASA image of the day API.
 
     Returns:
-    dict: A dictionary containing the title of the image and the image (as a base64 encoded string)
+    dict: A dictionary containing the title, date and media_type of the APOD, a reference to the staged image,
+          'media_ref', its url, 'image_url', and the media_prepare report, 'prepared', all None when there is no
+          image that can be posted, and 'page_url', the APOD page
     """
     logger.info('getting nasa image from nasa api')
     
     try:
-        params = {'api_key': environ.get('NASA_API_KEY')}
-        response = get('https://api.nasa.gov/planetary/apod?', params=params)
-        
-        if response.status_code == 200:
-            logger.info('NASA API returned response with 200 status code')
-            nasa_data = response.json()
-            
-            title = nasa_data['title']
-            # Get the image URL from the NASA API
-            image_url = nasa_data['hdurl']
-            
-            response = get(image_url, stream=True)  # Stream the image
-            image_bytes = response.content
-            image_base64_str = base64.b64encode(image_bytes).decode('utf-8') # Encode the image to base64
-            
-            image_data = {'title': title, 'image': image_base64_str}
-            
-            logger.info('NASA image successfully streamed using URL retrieved from API')
-            return image_data
+        nasa_data = get_apod()
+        title = nasa_data['title']
+        date = nasa_data['date']
+        media_type = nasa_data.get('media_type', 'image')
+
+        # Stop before downloading anything if today's image has already been tweeted
+        if get_seen_index().seen('apod_date', date):
+            raise AlreadySeenError(f'NASA image for {date} has already been tweeted')
+
+        image_data = {
+            'title': title, 'date': date, 'media_type': media_type, 'media_ref': None, 'image_url': None,
+            'prepared': None,
+            'page_url': f"https://apod.nasa.gov/apod/ap{date[2:].replace('-', '')}.html",
+        }
+
+        # Try each image that could be posted, falling back to the next if one is too big or fails
+        for image_url in image_candidates(nasa_data):
+            try:
+                image_data['media_ref'], image_data['prepared'] = fetch_image(date, image_url)
+                image_data['image_url'] = image_url
+                logger.info(f'NASA {media_type} image staged from {image_url}')
+                break
+            except Exception as e:
+                logger.warning(f'NASA image not used, url: {image_url}, error: {e}')
         else:
-            logger.error(f'Error getting data from NASA API, status code: {response.status_code}')
-            raise Exception(f'Error getting data from NASA API, status code: {response.status_code}, {response.text}')
+            logger.info(f'no image can be posted for the NASA {media_type} of the day, tweeting a link instead')
+
+        return image_data
+    except AlreadySeenError:
+        raise
     except Exception as e:
         logger.error(f'Error getting NASA image: {e}')
         raise Exception(f'Error getting NASA image: {e}')
 
 
-def write_nasa_message(data):
+def write_nasa_message(data, page_url=None):
     """
     Composes a tweet message from the given NASA image data.
 
     Parameters:
     data (dict): NASA image data
+    page_url (str): Optional link to the APOD page, for days there is no image to attach
 
     Returns:
     str: The composed tweet message
     """
     title = data
-    message = f"The NASA image of the day today !\n{title}"
+    if page_url:
+        return render('nasa_link', title=title, url=page_url)
+    message = render('nasa', title=title)
     return message
@@ -1,17 +1,23 @@
 import logging
-from requests import get
 from random import choice
 from os import environ
 import json
-import boto3
+from tweet_dispatcher import dispatch_tweet
+from message_templates import render
+from news_pool import NEWS_CATEGORIES, NEWS_URL, get_news_pool
+from http_cache import get_http_session
+from seen_index import get_seen_index
+from tracing import traced_handler
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize boto3 client for lambda
-lambda_client = boto3.client('lambda')
+# 'pool' serves articles from a pool refreshed with every category at once, 'single' fetches one
+# random category on every run
+NEWS_MODE = environ.get('NEWS_MODE', 'pool')
 
+@traced_handler
 def lambda_handler(event, context):
     """
     AWS Lambda function to retrieve news data and invoke a tweet function.
@@ -25,37 +31,19 @@ def lambda_handler(event, context):
         news_data = get_news()
         message = write_news_message(news_data)
 
-        # Invoke the 'tweet_text' Lambda function
-        response = lambda_client.invoke(
-            FunctionName='twiter_bot_tweet_text',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({'message': message})
-        )
-
-        # Load the response payload
-        response_payload = json.loads(response['Payload'].read())
+        # Send the tweet, raises an exception if the tweet was not sent
+        dispatch_tweet(message)
+        get_seen_index().add('news_url', news_data['article_data']['url'])
+        if NEWS_MODE == 'pool':
+            get_news_pool().mark_tweeted(news_data['article_data']['url'])
 
-        # Check if there was an error invoking the function
-        if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-            logger.error('Error sending tweet')
-            logger.error(response_payload)
-            raise Exception(response_payload)
-
-        # Check the response status code if tweet successful return succesful response else raise exception
-        if response['StatusCode'] == 200:
-            logger.info('Tweet successfully sent')
-            return {
+        return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Tweet successfully sent!',
                 'news_data': news_data,
             }),
         }
-        else:
-            logger.error(response['StatusCode'])
-            raise Exception(
-                f'Tweet was not sent. status code {response["StatusCode"]}. reponse {response.text}'
-            )
 
     except Exception as e:
         # log error and return unsuccessful response
@@ -71,6 +59,49 @@ def lambda_handler(event, context):
 
 
 def get_news():
+    """
+    Gets an article to tweet, from the news pool or straight from the News API depending on NEWS_MODE
+
+    Returns:
+    dict: News article data and its category
+    """
+    if NEWS_MODE == 'pool':
+        return get_pooled_news()
+    return get_single_news()
+
+
+def get_pooled_news():
+    """
+    Takes an untweeted article from the news pool, refreshing the pool first if it has run dry
+
+    Returns:
+    dict: News article data for a random category
+    """
+    pool = get_news_pool()
+    seen_index = get_seen_index()
+    refreshed = False
+    while True:
+        news_data = pool.take()
+        if news_data is None:
+            if refreshed:
+                raise KeyError('No article data returned from api.')
+            logger.info('news pool is empty, refreshing it from news api')
+            pool.refresh()
+            refreshed = True
+            continue
+
+        # articles tweeted before, e.g. by an earlier pool or in single mode, are dropped from the pool
+        url = news_data['article_data']['url']
+        if seen_index.seen('news_url', url):
+            logger.info(f'skipping article already tweeted, url: {url}')
+            pool.mark_tweeted(url)
+            continue
+
+        logger.info(f'news data taken from pool, {sum(pool.available().values())} articles left')
+        return news_data
+
+
+def get_single_news():
     """
     Fetches news data from the News API with a random category
 
@@ -80,9 +111,8 @@ def get_news():
 
     logger.info('getting news data from news api')
 
-    # Set up possible news categories and choose one randomly
-    categories = ['business', 'entertainment', 'health', 'science', 'sports', 'technology']
-    category = choice(categories)
+    # Choose one of the news categories randomly
+    category = choice(NEWS_CATEGORIES)
 
     # Set API parameters
     params = {
@@ -92,12 +122,17 @@ def get_news():
     }
 
     # Send request to API
-    response = get('https://newsapi.org/v2/top-headlines?', params=params)
+    response = get_http_session().get(NEWS_URL, params=params)
 
     try:
-        # Extract top article data and category
-        article_data = response.json()['articles'][0]
+        # Extract the top article that hasn't been tweeted before, and its category
+        seen_index = get_seen_index()
+        article_data = next(
+            article for article in response.json()['articles'] if not seen_index.seen('news_url', article['url']))
         news_data = {'article_data': article_data, 'news_category': category}
+    except StopIteration:
+        logger.error(f'every {category} article returned has already been tweeted')
+        raise KeyError('No new article data returned from api.')
     except KeyError:
         logger.error(
             f'error getting news data status code of request: {response.status_code}'
@@ -126,26 +161,7 @@ def write_news_message(data):
     news_article = data['article_data']
     news_topic = data['news_category']
 
-    # Construct message for tweet
-    article_string = f"\n{news_article['title']}\n{news_article['url']}"
-    message_options = [
-        f"some fascinating {news_topic} news:{article_string}",
-        f"wow look at this {news_topic} news:{article_string}",
-        f"interesting developments in the {news_topic} world, read about it here: {article_string}",
-        f"never a dull moment in {news_topic}. {article_string}",
-        f"{news_topic} news that has peaked my interest: {article_string}",
-        f"can't believe this {news_topic} news. {article_string}",
-        f"seen this {news_topic} news coming a mile off. {article_string}",
-        f"been waiting a long time for {news_topic} news like this. {article_string}",
-        f"{news_topic}! {news_topic}! read all about it!! {article_string}",
-        f"Intriguing update in the {news_topic} scene:{article_string}",
-        f"Shaking up the {news_topic} world with this: {article_string}",
-        f"Keep an eye on this unfolding {news_topic} story: {article_string}",
-        f"A must-read {news_topic} update: {article_string}",
-        f"Hot off the press, {news_topic} news. {article_string}",
-        f"In case you missed this {news_topic} news. {article_string}"
-    ]
-
-    # Choose one message option randomly
-    message = choice(message_options)
+    # Construct message for tweet from one of the precompiled templates, the title is shortened
+    # if needed to keep the tweet within the character limit
+    message = render('news', topic=news_topic, title=news_article['title'], url=news_article['url'])
     return message
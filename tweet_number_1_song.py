@@ -1,18 +1,22 @@
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyClientCredentials
-from requests import get
-from bs4 import BeautifulSoup
 from os import environ
 import logging
 import json
 from random import randrange
 from datetime import datetime, timedelta
-import boto3
+from tweet_dispatcher import dispatch_tweet
+from billboard_index import chart_week, get_index
+from spotify_cache import get_spotify_cache
+from billboard_parser import fetch_top_song
+from message_templates import render
+from http_cache import get_http_session
+from seen_index import get_seen_index
+from tracing import span, traced_handler
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+@traced_handler
 def lambda_handler(event, context):
     """
     AWS Lambda function to retrieve top song from a random date and invoke a tweet function.
@@ -23,40 +27,18 @@ def lambda_handler(event, context):
     try:
         song_finder = SpotifySongFinder()
 
-        # Generate a random date and get the top song info on that date
-        date = song_finder.generate_random_date()
+        # Generate a random date from a chart week not tweeted before and get the top song info on that date
+        date = song_finder.generate_new_date()
         song_info = song_finder.get_top_song_info(date)
+        logger.info(f'spotify search cache stats: {song_finder.search_cache.stats}')
 
         # Generate a message for the tweet
         song_message = write_spotify_message(song_info)
         logger.info('spotify reply created successfully')
 
-        # Initialize boto3 client for lambda
-        lambda_client = boto3.client('lambda')
-
-        # Invoke the 'tweet_text' Lambda function
-        response = lambda_client.invoke(
-            FunctionName='twiter_bot_tweet_text',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({'message': song_message})
-        )
-
-        # Load the response payload
-        response_payload = json.loads(response['Payload'].read())
-
-        # Check if there was an error invoking the function
-        if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-            logger.error('Error sending tweet')
-            logger.error(response_payload)
-            raise Exception(response_payload)
-
-        # Check the response status code
-        if response['StatusCode'] == 200:
-            logger.info('Tweet successfully sent')
-        else:
-            logger.error(response['StatusCode'])
-            raise Exception(
-                f'Tweet was not sent. status code {response.text}.')
+        # Send the tweet, raises an exception if the tweet was not sent
+        dispatch_tweet(song_message)
+        song_finder.seen_index.add('song_week', chart_week(date))
 
         return {
             'statusCode': 200,
@@ -85,11 +67,34 @@ class SpotifySongFinder:
         self.cid = environ.get('SPOTIFY_CID')
         self.secret = environ.get('SPOTIFY_SECRET')
 
-        # Set up Spotify client credentials manager
-        self.auth_manager = SpotifyClientCredentials(
-            client_id=self.cid, client_secret=self.secret)
+        # Spotify client, built on first use so runs answered from the index and cache never import spotipy
+        self._sp = None
+
+        # Local index of past number 1s, only weeks missing from it are scraped
+        self.index = get_index()
+
+        # Cache of previous spotify searches, including songs that could not be found
+        self.search_cache = get_spotify_cache()
+
+        # Index of the chart weeks already tweeted
+        self.seen_index = get_seen_index()
+
+    @property
+    def sp(self):
+        """the Spotify client, its credentials manager and client share the pooled http session"""
+        if self._sp is None:
+            from spotipy import Spotify
+            from spotipy.oauth2 import SpotifyClientCredentials
 
-        self.sp = Spotify(client_credentials_manager=self.auth_manager)
+            auth_manager = SpotifyClientCredentials(
+                client_id=self.cid, client_secret=self.secret, requests_session=get_http_session())
+            self._sp = Spotify(client_credentials_manager=auth_manager, requests_session=get_http_session())
+        return self._sp
+
+    def search_tracks(self, query):
+        """searches spotify for tracks matching a query, timed as the 'search' stage"""
+        with span('search', source='spotify'):
+            return self.sp.search(q=query, type='track')
 
     def generate_random_date(self):
         """
@@ -116,6 +121,24 @@ class SpotifySongFinder:
 
         return random_date_str
 
+    def generate_new_date(self, max_attempts=20):
+        """
+        Generates a random date whose chart week has not been tweeted before, checked before any
+        scraping or searching is done for it.
+
+        Parameters:
+        max_attempts (int): Number of dates tried before giving up
+
+        Returns:
+        str: The random date as a string in YYYY-MM-DD format
+        """
+        for attempt in range(max_attempts):
+            date = self.generate_random_date()
+            if not self.seen_index.seen('song_week', chart_week(date)):
+                return date
+            logger.info(f'chart week of {date} already tweeted, picking another date')
+        raise Exception(f'no chart week that has not been tweeted found in {max_attempts} attempts')
+
     def scrape_top_song(self, date):
         """
         Scrapes the Billboard website for the top song on a particular date.
@@ -129,26 +152,10 @@ class SpotifySongFinder:
 
         logger.info(f'scraping billboard for top song on date: {date}')
         try:
-            # Send a GET request to the Billboard website
-            response = get(
-                f'https://www.billboard.com/charts/hot-100/{date}/')  
-
-            website_html = response.text
-            
-            # Parse the website's HTML
-            soup = BeautifulSoup(website_html, 'html.parser')
-            
-            # Scrape the page for the top song
-            soup_data = soup.find_all(
-                name='li', class_='o-chart-results-list__item', limit=4)  # scrap page for top song
-
-            soup_song = soup_data[3]
-            
-            # Extract the song's title and artist
-            song = soup_song.find(name='h3', class_='c-title',
-                                  id="title-of-a-story").string.strip('\n')
-            artist = soup_song.find(
-                name='span', class_='c-label').string.strip('\n')
+            # Download the Billboard page and extract the song's title and artist, by default the
+            # page is parsed as it streams in and the download stops once the number 1 is found
+            song_data = fetch_top_song(date)
+            song, artist = song_data['song'], song_data['artist']
             logger.info(
                 f'song found on billboard song: {song}, artist: {artist}')
             return {'song': song, 'artist': artist}
@@ -171,16 +178,27 @@ class SpotifySongFinder:
         """
 
         logger.info('finding song uri code on spotify')
+
+        # Return a cached result if this song has been searched for before
+        hit, uri_code = self.search_cache.get(song, artist)
+        if hit and uri_code:
+            logger.info(f'song uri code found in cache, uri code: {uri_code}')
+            return uri_code
+        elif hit:
+            logger.error(
+                f'song cached as not found on spotify using song: {song}, artist: {artist}')
+            raise Exception(
+                f'song not found on spotify using song: {song}, artist: {artist}, cached result')
+
         # Search Spotify for the song using its name and artist
-        result = self.sp.search(
-            q=f'artist:{artist}%20track:{song}', type='track')  
+        result = self.search_tracks(f'artist:{artist}%20track:{song}')
         try:
             uri = result['tracks']['items'][0]['uri']
             url = result['tracks']['items'][0]['external_urls']['spotify']
             uri_code = uri.split(':')[2]
         except (IndexError, KeyError) as error:
             # If the search using both the song and artist failed, try searching using only the song
-            result = self.sp.search(q=f'track:{song}', type='track')
+            result = self.search_tracks(f'track:{song}')
             try:
                 uri = result['tracks']['items'][0]['uri']
                 url = result['tracks']['items'][0]['external_urls']['spotify']
@@ -188,9 +206,11 @@ class SpotifySongFinder:
             except (IndexError, KeyError) as error:
                 logger.error(
                     f'song not found on spotify using song: {song}, artist: {artist}')
+                self.search_cache.put(song, artist, None)
                 raise Exception(
                     f'song not found on spotify using song: {song}, artist: {artist}, error {error}')
         logger.info(f'song uri code found, uri code: {uri_code}')
+        self.search_cache.put(song, artist, uri_code)
         return uri_code
 
     def get_top_song_info(self, date):
@@ -206,12 +226,20 @@ class SpotifySongFinder:
         """
         logger.info(f'trying to find number one song on {date}')
         try:
-            # Scrape the top song from Billboard
-            song_data = self.scrape_top_song(date)
+            # Look the week up in the local index, falling back to scraping Billboard on a miss
+            song_data = self.index.lookup(date)
+            if song_data:
+                logger.info(f"song found in billboard index for week {song_data['week']}")
+            else:
+                song_data = self.scrape_top_song(date)
             song, artist = song_data['song'], song_data['artist']
 
-            # Find the song's Spotify URI code
-            uri_code = self.find_song_uri(song, artist)
+            # Find the song's Spotify URI code if the index doesn't already have it
+            uri_code = song_data.get('uri_code')
+            if not uri_code:
+                uri_code = self.find_song_uri(song, artist)
+                self.index.add(date, song, artist, uri_code)
+                self.index.save()
 
             link = f'https://open.spotify.com/track/{uri_code}'
             logger.info(f'song data returned for {song}, {artist}, {link}')
@@ -235,6 +263,6 @@ def write_spotify_message(data):
     artist = data['artist']
     date = data['date']
 
-    message = f'The number 1 song for today was at the top on {date}, its {song} by {artist}, listen here:\n{link}'
+    message = render('spotify_number_1', date=date, song=song, artist=artist, link=link)
     return message
 
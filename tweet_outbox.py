@@ -0,0 +1,346 @@
+"""
+Durable outbox for tweets.
+
+Content lambdas enqueue tweets (TWEET_TRANSPORT=outbox) with an idempotency key, by default a hash of
+the text and media, and a drainer posts them in batches with backoff. Tweets already in the outbox,
+pending or sent, are not enqueued again so retries of a content lambda don't queue a tweet twice.
+Delivery is at least once: a drain that dies after posting and before marking the tweet sent leaves
+it to be posted again once its claim expires.
+
+Before a tweet is posted it is claimed by moving it from 'pending' to 'sending' with a conditional
+update, so when several drains run at once (OUTBOX_DRAIN_ON_ENQUEUE in a few content lambdas and the
+scheduled drainer) only the one that made the claim posts it. A claim left behind by a drain that
+died part way is taken over once OUTBOX_CLAIM_TIMEOUT has passed.
+
+The default backend is SQLite (OUTBOX_PATH). Set OUTBOX_BACKEND=dynamodb to use the OUTBOX_TABLE
+DynamoDB table (partition key 'key') when the drainer runs as a separate lambda; media then needs to
+be staged in s3 (MEDIA_STORE_BUCKET) so the drainer can read it. The table needs a global secondary
+index, OUTBOX_DUE_INDEX, with partition key 'status' and sort key 'next_attempt' (a number) so due
+tweets are queried rather than the whole table scanned.
+"""
+import logging
+from os import environ
+import os
+import hashlib
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from tweet_dispatcher import dispatch_tweet, get_transport
+from media_store import delete_media
+from tracing import traced_handler
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+OUTBOX_BACKEND = environ.get('OUTBOX_BACKEND', 'sqlite')
+OUTBOX_PATH = environ.get('OUTBOX_PATH', os.path.join(tempfile.gettempdir(), 'tweet_outbox.sqlite3'))
+OUTBOX_TABLE = environ.get('OUTBOX_TABLE', 'TweetOutbox')
+OUTBOX_DUE_INDEX = environ.get('OUTBOX_DUE_INDEX', 'status-next_attempt-index')
+
+# The transport the drainer posts with, must not be 'outbox' itself
+OUTBOX_DELIVERY_TRANSPORT = environ.get('OUTBOX_DELIVERY_TRANSPORT', 'inprocess')
+OUTBOX_BATCH_SIZE = int(environ.get('OUTBOX_BATCH_SIZE', 10))
+OUTBOX_MAX_ATTEMPTS = int(environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_BACKOFF = float(environ.get('OUTBOX_BACKOFF', 30))
+# Seconds a claimed tweet is left to its drain, longer than a lambda can run so a live drain is never overtaken
+OUTBOX_CLAIM_TIMEOUT = float(environ.get('OUTBOX_CLAIM_TIMEOUT', 15 * 60))
+
+
+def idempotency_key(message, media=None):
+    """
+    Builds the key a tweet is deduplicated on.
+
+    Parameters:
+    message (str): The text of the tweet
+    media (str): Optional identity of the attached media, e.g. its source url
+
+    Returns:
+    str: A sha256 hex digest of the text and media
+    """
+    digest = hashlib.sha256(message.encode('utf-8'))
+    if media:
+        digest.update(b'\x00')
+        digest.update(media.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SQLiteOutboxBackend:
+    """Outbox storage in a local SQLite database."""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'key TEXT PRIMARY KEY, message TEXT NOT NULL, media_ref TEXT, status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, created REAL NOT NULL, '
+            'sent_at REAL, last_error TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)')
+        self._db.commit()
+
+    def insert(self, item):
+        """adds an item unless its key is already present, returns True if it was added"""
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO outbox (key, message, media_ref, status, attempts, next_attempt, created) '
+                'VALUES (:key, :message, :media_ref, :status, 0, :next_attempt, :created)', item)
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT * FROM outbox WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+    def due(self, limit, now):
+        """returns up to limit pending items, and items whose claim has expired, that are due, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM outbox WHERE status IN ('pending', 'sending') AND next_attempt <= ? "
+                "ORDER BY created LIMIT ?",
+                (now, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(self, key, now, timeout):
+        """moves a due item to 'sending' until now + timeout, returns True only for the one caller that did"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE outbox SET status = 'sending', next_attempt = ? "
+                "WHERE key = ? AND status IN ('pending', 'sending') AND next_attempt <= ?",
+                (now + timeout, key, now))
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def update(self, key, **fields):
+        with self._lock:
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            self._db.execute(f'UPDATE outbox SET {assignments} WHERE key = ?', (*fields.values(), key))
+            self._db.commit()
+
+
+class DynamoDBOutboxBackend:
+    """Outbox storage in a DynamoDB table so separate lambdas share it."""
+
+    def __init__(self, table_name=OUTBOX_TABLE):
+        # boto3 is only imported when this backend is used, the sqlite backend doesn't need it
+        import boto3
+        self.table = boto3.resource('dynamodb', endpoint_url=environ.get('DYNAMODB_ENDPOINT_URL')).Table(table_name)
+
+    @staticmethod
+    def _to_item(item):
+        return {name: Decimal(str(value)) if isinstance(value, float) else value
+                for name, value in item.items() if value is not None}
+
+    @staticmethod
+    def _from_item(item):
+        return {name: float(value) if isinstance(value, Decimal) else value for name, value in item.items()}
+
+    def insert(self, item):
+        from botocore.exceptions import ClientError
+        from boto3.dynamodb.conditions import Attr
+        try:
+            self.table.put_item(Item=self._to_item(dict(item, attempts=0)),
+                                ConditionExpression=Attr('key').not_exists())
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def get(self, key):
+        item = self.table.get_item(Key={'key': key}).get('Item')
+        return self._from_item(item) if item else None
+
+    def due(self, limit, now):
+        from boto3.dynamodb.conditions import Key
+        # sent and failed items stay in the table for deduplication, querying the index never reads them
+        items = []
+        for status in ('pending', 'sending'):
+            kwargs = {
+                'IndexName': OUTBOX_DUE_INDEX,
+                'KeyConditionExpression': Key('status').eq(status) & Key('next_attempt').lte(Decimal(str(now))),
+                'Limit': limit,
+            }
+            while len(items) < limit:
+                response = self.table.query(**kwargs)
+                items.extend(self._from_item(item) for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return sorted(items, key=lambda item: item['created'])[:limit]
+
+    def claim(self, key, now, timeout):
+        from botocore.exceptions import ClientError
+        from boto3.dynamodb.conditions import Attr
+        try:
+            self.table.update_item(
+                Key={'key': key},
+                UpdateExpression='SET #status = :sending, next_attempt = :lease',
+                ConditionExpression=Attr('status').is_in(['pending', 'sending'])
+                & Attr('next_attempt').lte(Decimal(str(now))),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':sending': 'sending', ':lease': Decimal(str(now + timeout))},
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def update(self, key, **fields):
+        fields = self._to_item(fields)
+        self.table.update_item(
+            Key={'key': key},
+            UpdateExpression='SET ' + ', '.join(f'#{name} = :{name}' for name in fields),
+            ExpressionAttributeNames={f'#{name}': name for name in fields},
+            ExpressionAttributeValues={f':{name}': value for name, value in fields.items()},
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteOutboxBackend,
+    'dynamodb': DynamoDBOutboxBackend,
+}
+
+
+class TweetOutbox:
+    """
+    Class that queues tweets durably and delivers them at least once, deduplicated on enqueue: a tweet is
+    only posted by the drain that claimed it, and posted again only if that drain died before marking it sent.
+    """
+
+    def __init__(self, backend=None, transport=None, max_attempts=OUTBOX_MAX_ATTEMPTS, backoff=OUTBOX_BACKOFF,
+                 claim_timeout=OUTBOX_CLAIM_TIMEOUT):
+        """
+        Parameters:
+        backend (object): The storage backend, defaults to the one named by OUTBOX_BACKEND
+        transport (object): The transport tweets are delivered with, see tweet_dispatcher
+        max_attempts (int): Number of delivery attempts before a tweet is marked failed
+        backoff (float): Seconds before the first retry, doubled on each retry after
+        claim_timeout (float): Seconds a claim is held before another drain may take the tweet over
+        """
+        self.backend = backend or BACKENDS[OUTBOX_BACKEND]()
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.claim_timeout = claim_timeout
+
+    def enqueue(self, message, media_ref=None, key=None):
+        """
+        Adds a tweet to the outbox unless a tweet with the same key is already there.
+
+        Parameters:
+        message (str): The text to be tweeted
+        media_ref (str): Optional reference to staged media to attach
+        key (str): Optional idempotency key, defaults to a hash of the text and media reference
+
+        Returns:
+        tuple: (key, bool True if the tweet was added, False if it was a duplicate)
+        """
+        key = key or idempotency_key(message, media_ref)
+        now = time.time()
+        added = self.backend.insert({
+            'key': key, 'message': message, 'media_ref': media_ref,
+            'status': 'pending', 'next_attempt': now, 'created': now,
+        })
+        if added:
+            logger.info(f'tweet added to outbox, key: {key}')
+        else:
+            logger.info(f'duplicate tweet not added to outbox, key: {key}')
+        return key, added
+
+    def _deliver(self, item):
+        # only the drain that moves the tweet from pending to sending posts it
+        if not self.backend.claim(item['key'], time.time(), self.claim_timeout):
+            logger.info(f"tweet in outbox claimed by another drain, key: {item['key']}")
+            return 'skipped'
+
+        attempts = int(item['attempts']) + 1
+        try:
+            dispatch_tweet(item['message'], media_ref=item.get('media_ref'),
+                           transport=self.transport or get_transport(OUTBOX_DELIVERY_TRANSPORT))
+            self.backend.update(item['key'], status='sent', attempts=attempts, sent_at=time.time())
+            return 'sent'
+        except Exception as e:
+            error = str(e)
+            if attempts >= self.max_attempts:
+                logger.error(f"tweet in outbox failed for good, key: {item['key']}, error: {error}")
+                self.backend.update(item['key'], status='failed', attempts=attempts, last_error=error)
+                # nothing will post the staged media now, so it would only fill the staging area
+                if item.get('media_ref'):
+                    delete_media(item['media_ref'])
+                return 'failed'
+
+            delay = self.backoff * 2 ** (attempts - 1)
+            # wait at least until a rate limit resets if the tweet handler said when that is
+            response_payload = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+            if response_payload.get('statusCode') == 429:
+                delay = max(delay, json.loads(response_payload['body']).get('retry_after', 0))
+            logger.warning(f"tweet in outbox not sent, key: {item['key']}, retrying in {delay:.0f}s, error: {error}")
+            self.backend.update(item['key'], status='pending', attempts=attempts, next_attempt=time.time() + delay,
+                                last_error=error)
+            return 'retry'
+
+    def drain(self, batch_size=OUTBOX_BATCH_SIZE, max_batches=None):
+        """
+        Delivers due tweets a batch at a time until none are due.
+
+        Parameters:
+        batch_size (int): Number of tweets read from the backend at a time
+        max_batches (int): Optional limit on the number of batches
+
+        Returns:
+        dict: Counts of tweets 'sent', 'retry', 'failed' and 'skipped' (claimed by another drain)
+        """
+        counts = {'sent': 0, 'retry': 0, 'failed': 0, 'skipped': 0}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = self.backend.due(batch_size, time.time())
+            if not batch:
+                break
+            for item in batch:
+                counts[self._deliver(item)] += 1
+            batches += 1
+        logger.info(f'outbox drained, {counts}')
+        return counts
+
+
+@per_container
+def get_outbox():
+    """returns the outbox, its backend connection opened once per container"""
+    return TweetOutbox()
+
+
+@traced_handler
+def lambda_handler(event, context):
+    """
+    AWS Lambda function that drains the outbox, run it on a schedule.
+
+    Returns:
+    dict: A response object with the status code and the delivery counts or an error message
+    """
+    try:
+        counts = get_outbox().drain()
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Outbox drained',
+                'counts': counts,
+            }),
+        }
+    except Exception as e:
+        logger.exception(
+            'An error occurred, traceback message:\n {}'.format(e))
+
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'message': 'An error occurred: {}'.format(e)
+            }),
+        }
@@ -1,6 +1,6 @@
 import logging
-from os import environ
-from requests_oauthlib import OAuth1Session
+from twitter_client import get_twitter_client, RateLimitedError
+from tracing import span, traced_handler
 import json
 
 # Setting up logging to catch and record errors
@@ -8,6 +8,7 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@traced_handler
 def lambda_handler(event, context):
     """
     AWS Lambda function to send a tweet from a bot account.
@@ -28,20 +29,17 @@ def lambda_handler(event, context):
         # Twitter API url for creating a new tweet
         TWEET_URL = 'https://api.twitter.com/2/tweets'
 
-        # Setting up OAuth session using environment variables
-        oauth = OAuth1Session(
-            environ.get("TWITTER_API_KEY"),
-            client_secret=environ.get("TWITTER_API_SECRET"),
-            resource_owner_key=environ.get("TWITTER_API_ACCESS_TOKEN"),
-            resource_owner_secret=environ.get(
-                "TWITTER_API_ACCESS_TOKEN_SECRET"),
-        )
+        # Getting the shared rate limit aware client, reused between warm invocations
+        client = get_twitter_client()
 
         # Constructing the tweet object
         tweet = {"text": message}
         
         # Sending a POST request to the Twitter API
-        tweet_res = oauth.post(url=TWEET_URL, json=tweet)
+        with span('post', kind='text') as post_span:
+            tweet_res = client.post(TWEET_URL, json=tweet)
+            post_span.set(status_code=tweet_res.status_code)
+        logger.info(f'twitter rate limit budget: {client.budget()}')
 
         # Checking if the tweet was successful based on the status code
         if tweet_res.status_code == 201:
@@ -64,6 +62,17 @@ def lambda_handler(event, context):
                 'response_json': tweet_res.json(),
             })
 
+    except RateLimitedError as e:
+        # The rate limit budget is used up, tell the caller when it is worth trying again
+        logger.warning(f'tweet not sent, rate limited: {e}')
+        return {
+            'statusCode': 429,
+            'body': json.dumps({
+                'message': 'Rate limited: {}'.format(e),
+                'retry_after': round(e.retry_after),
+            }),
+        }
+
     except Exception as e:
         # Logging the exception information
         logger.exception(
@@ -1,62 +1,64 @@
 import logging
-import boto3
 import json
-from requests import get
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from os import environ
+from tweet_dispatcher import dispatch_tweet
+from http_cache import get_http_cache
+from message_templates import render, render_within, tweet_length, TWEET_LIMIT
+from tracing import traced_handler
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize boto3 client for lambda
-lambda_client = boto3.client('lambda')
+WEATHER_URL = 'https://api.openweathermap.org/data/2.5/onecall?'
 
+# Forecasts are cached between runs, fresh for WEATHER_CACHE_MAX_AGE seconds unless the api says otherwise
+WEATHER_CACHE_MAX_AGE = int(environ.get('WEATHER_CACHE_MAX_AGE', 3 * 60 * 60))
+# Seconds past expiry the last good forecast is served if the api is slow or down
+WEATHER_STALE_IF_ERROR = int(environ.get('WEATHER_STALE_IF_ERROR', 24 * 60 * 60))
+# Seconds past expiry the last good forecast is served immediately while it is refreshed in the background
+WEATHER_STALE_WHILE_REVALIDATE = int(environ.get('WEATHER_STALE_WHILE_REVALIDATE', 0))
+WEATHER_TIMEOUT = float(environ.get('WEATHER_TIMEOUT', 5))
+
+# Locations tweeted about, a json list of {"name": ..., "lat": ..., "lon": ...}, can also be passed in the event
+WEATHER_LOCATIONS = json.loads(environ.get('WEATHER_LOCATIONS', '[{"name": null, "lat": 53.57, "lon": -2.42}]'))
+WEATHER_WORKERS = int(environ.get('WEATHER_WORKERS', 8))
+
+@traced_handler
 def lambda_handler(event, context):
     """
-    AWS Lambda function to retrieve weather data and invoke a tweet function.
+    AWS Lambda function to retrieve weather data for each location and invoke a tweet function.
+
+    Parameters:
+    event (dict): May include 'locations', a list of {'name', 'lat', 'lon'}, defaults to WEATHER_LOCATIONS
 
     Returns:
-    dict: A response object with the status code and the success message or an error message
+    dict: A response object with the status code and the per location results or an error message
     """
 
     try:
-        # Retrieve weather data and write tweet message
-        weather_data = get_weather()
-        message = write_weather_message(weather_data)
-        
-        # Invoke the 'tweet_text' Lambda function
-        response = lambda_client.invoke(
-            FunctionName='twiter_bot_tweet_text',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({'message': message})
-        )
-        logger.info('tweet_text function called')
-
-        # Load the response payload
-        response_payload = json.loads(response['Payload'].read())
-
-        # Check if there was an error invoking the function
-        if 'FunctionError' in response or response_payload.get('statusCode') != 200:
-            logger.error('Error sending tweet')
-            logger.error(response_payload)
-            raise Exception(response_payload)
-
-        # Check the response status code if tweet successful return succesful response else raise exception
-        if response['StatusCode'] == 200:
-            logger.info('Tweet successfully sent')
-            return {
-            'statusCode': 200,
+        locations = event.get('locations') if isinstance(event, dict) else None
+        results = tweet_weather_for_locations(locations or WEATHER_LOCATIONS)
+
+        # 207 when only some of the locations could be tweeted
+        failed = [result for result in results if 'error' in result]
+        if not failed:
+            status_code, message = 200, 'Tweet successfully sent!'
+        elif len(failed) < len(results):
+            status_code, message = 207, 'Some weather tweets could not be sent'
+        else:
+            status_code, message = 500, 'Weather tweets could not be sent'
+
+        return {
+            'statusCode': status_code,
             'body': json.dumps({
-                'message': 'Tweet successfully sent!',
-                'weather_data': weather_data,
+                'message': message,
+                'locations': results,
             }),
         }
-        else:
-            logger.error(response['StatusCode'])
-            raise Exception(
-                f'Tweet was not sent. status code {response["StatusCode"]}. response {response.text}'
-            )
 
     except Exception as e:
         # log error and return unsuccessful response
@@ -72,9 +74,58 @@ def lambda_handler(event, context):
         }
 
 
-def get_weather():
+def tweet_weather_for_locations(locations, workers=WEATHER_WORKERS):
     """
-    Fetches weather data from the OpenWeatherMap API
+    Fetches the forecast for every location concurrently and tweets each as soon as it arrives, so a slow
+    location doesn't hold up the others. Locations sharing coordinates are only fetched once.
+
+    Parameters:
+    locations (list): A list of dictionaries with 'name', 'lat' and 'lon'
+    workers (int): Number of forecasts fetched at once
+
+    Returns:
+    list: A dictionary per location with 'name', 'fetch_seconds' and either 'weather_data' or 'error'
+    """
+    # coalesce locations whose coordinates round to the same forecast
+    by_coordinates = {}
+    for location in locations:
+        coordinates = (round(float(location['lat']), 2), round(float(location['lon']), 2))
+        by_coordinates.setdefault(coordinates, []).append(location)
+    logger.info(f'fetching weather for {len(locations)} locations, {len(by_coordinates)} distinct coordinates')
+
+    def fetch(coordinates):
+        start = time.perf_counter()
+        try:
+            return coordinates, get_weather(*coordinates), None, time.perf_counter() - start
+        except Exception as e:
+            return coordinates, None, e, time.perf_counter() - start
+
+    get_http_cache()  # open the cache before the workers share it
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(by_coordinates)))) as executor:
+        futures = [executor.submit(fetch, coordinates) for coordinates in by_coordinates]
+        for future in as_completed(futures):
+            coordinates, weather_data, error, elapsed = future.result()
+            for location in by_coordinates[coordinates]:
+                result = {'name': location.get('name'), 'fetch_seconds': round(elapsed, 3)}
+                logger.info(f"weather for {location.get('name') or coordinates} fetched in {elapsed:.3f}s")
+                try:
+                    if error:
+                        raise error
+                    # Send the tweet, raises an exception if the tweet was not sent
+                    dispatch_tweet(write_weather_message(weather_data, location.get('name')))
+                    result['weather_data'] = weather_data
+                except Exception as e:
+                    logger.error(f"weather tweet not sent for {location.get('name') or coordinates}, error: {e}")
+                    result['error'] = str(e)
+                results.append(result)
+    return results
+
+
+def get_weather(lat=53.57, lon=-2.42, units='metric', exclude='current,minutely,hourly,alerts'):
+    """
+    Fetches weather data from the OpenWeatherMap API, or from the cache if a fresh enough forecast was
+    fetched on a previous run
 
     Returns:
     dict: Weather data for the next seven days
@@ -84,45 +135,48 @@ def get_weather():
 
     # Set API parameters
     params = {
-        'lat': 53.57,
-        'lon': -2.42,
-        'exclude': 'current,minutely,hourly,alerts',
-        'units': 'metric',
+        'lat': lat,
+        'lon': lon,
+        'exclude': exclude,
+        'units': units,
         'appid': environ.get('WEATHER_API_KEY')
     }
 
+    # The cache key leaves out the api key
+    key = f'weather:{lat}:{lon}:{units}:{exclude}'
+
     try:
-        # Send request to API
-        response = get(
-            'https://api.openweathermap.org/data/2.5/onecall?', params=params
-        )
-        weather_data = response.json()['daily']
+        # Send request to API, or use the cached forecast
+        body, cache_status = get_http_cache().fetch(
+            key, WEATHER_URL, params=params, max_age=WEATHER_CACHE_MAX_AGE, timeout=WEATHER_TIMEOUT,
+            stale_if_error=WEATHER_STALE_IF_ERROR, stale_while_revalidate=WEATHER_STALE_WHILE_REVALIDATE)
+        logger.info(f'weather data cache status: {cache_status}')
+        response_data = json.loads(body)
+        weather_data = response_data['daily']
     except KeyError:
-        logger.error(
-            f'error getting weather data status code of request: {response.status_code}'
-        )
-        logger.error(response.json())
+        logger.error('error getting weather data, no daily forecast in response')
+        logger.error(response_data)
         raise KeyError('no weather data returned from api')
-    except Exception:
-        logger.error('error retrieving data from api')
-        raise Exception
+    except Exception as e:
+        logger.error(f'error retrieving data from api, error: {e}')
+        raise Exception(f'error retrieving data from api, error: {e}')
 
     logger.info('weather data returned from api')
     return weather_data
 
 
-def write_weather_message(data):
+def write_weather_message(data, location_name=None):
     """
     Constructs a tweet message from weather data
 
     Parameters:
     data (dict): Weather data for the next seven days
+    location_name (str): Optional name of the location the weather is for
 
     Returns:
-    str: A message string containing the weather data
+    str: A message string containing the weather data, with the location name shortened to keep it within the tweet limit
     """
-
-    message = 'The next 7 days weather:\n'
+    lines = []
     day = datetime.now()
     
     for weather in data:
@@ -131,8 +185,17 @@ def write_weather_message(data):
         type = weather['weather'][0]['main']
         temp = weather['temp']['day']
 
-        # Append data to message
-        message = message + f"{day_name} {type} {temp}C\n"
+        # Add a line for the day
+        lines.append(render('weather_day', day=day_name, type=type, temp=temp))
         day = day + timedelta(days=1)
-
+    days = ''.join(lines)
+
+    # the header gets whatever the days leave of the tweet
+    if location_name:
+        header = render_within('weather_header_location', TWEET_LIMIT - tweet_length(days), location=location_name)
+    else:
+        header = render('weather_header')
+    message = header + days
+    if tweet_length(message) > TWEET_LIMIT:
+        logger.warning(f'weather message is {tweet_length(message) - TWEET_LIMIT} characters over the tweet limit')
     return message
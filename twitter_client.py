@@ -0,0 +1,137 @@
+import logging
+from os import environ
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from rate_limit import TokenBucket
+from twitter_session import get_oauth_session
+from container_state import per_container
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Longest a request is delayed waiting for rate limit budget, keep it well inside the lambda timeout
+TWITTER_MAX_WAIT = float(environ.get('TWITTER_MAX_WAIT', 30))
+# every request is sent at least once
+TWITTER_MAX_ATTEMPTS = max(1, int(environ.get('TWITTER_MAX_ATTEMPTS', 3)))
+
+
+class RateLimitedError(Exception):
+    """
+    Raised when a request could not be made within max_wait because the endpoint's rate limit
+    budget is used up, 'retry_after' is the number of seconds until the budget resets
+    """
+
+    def __init__(self, message, endpoint, retry_after):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def endpoint_key(method, url):
+    """groups urls into the rate limited endpoint they belong to by replacing ids in the path,
+    e.g. 'GET /2/users/:id/mentions'"""
+    path = re.sub(r'/\d{3,}(?=/|$)', '/:id', urlparse(url).path)
+    return f'{method.upper()} {path}'
+
+
+class TwitterClient:
+    """
+    Class wrapping the OAuth session with rate limit awareness. The x-rate-limit headers of every
+    response update a token bucket for that endpoint, requests wait for budget instead of being sent
+    into a 429, and a 429 is retried once the window resets if that is within max_wait.
+    """
+
+    def __init__(self, session_factory=get_oauth_session, max_wait=TWITTER_MAX_WAIT, max_attempts=TWITTER_MAX_ATTEMPTS):
+        """
+        Parameters:
+        session_factory (callable): Returns the session requests are made with
+        max_wait (float): Longest a request is delayed waiting for budget, in seconds
+        max_attempts (int): Number of times a request is sent if it keeps getting a 429
+        """
+        self.session_factory = session_factory
+        self.max_wait = max_wait
+        self.max_attempts = max(1, max_attempts)
+        self.buckets = {}
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def _update_limits(self, endpoint, headers):
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self._lock:
+            self.limits[endpoint] = {'limit': limit, 'remaining': remaining, 'reset': reset}
+            if endpoint not in self.buckets:
+                self.buckets[endpoint] = TokenBucket(rate=limit / 900, capacity=limit)
+            bucket = self.buckets[endpoint]
+        bucket.set_state(remaining, reset - time.time())
+
+    def _retry_after(self, endpoint, headers):
+        try:
+            return max(0.0, int(headers['x-rate-limit-reset']) - time.time())
+        except (KeyError, TypeError, ValueError):
+            limits = self.limits.get(endpoint)
+            return max(0.0, limits['reset'] - time.time()) if limits else self.max_wait
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request, waiting for rate limit budget first.
+
+        Parameters:
+        method (str): The http method
+        url (str): The url
+        **kwargs: Passed on to the session's request method
+
+        Returns:
+        Response: The response
+        """
+        endpoint = endpoint_key(method, url)
+        for attempt in range(1, self.max_attempts + 1):
+            bucket = self.buckets.get(endpoint)
+            if bucket and not bucket.acquire(max_wait=self.max_wait):
+                retry_after = self._retry_after(endpoint, {})
+                logger.warning(f'rate limit budget used up for {endpoint}, resets in {retry_after:.0f}s')
+                raise RateLimitedError(f'rate limit budget used up for {endpoint}', endpoint, retry_after)
+
+            response = self.session_factory().request(method, url, **kwargs)
+            self._update_limits(endpoint, response.headers)
+
+            if response.status_code != 429:
+                return response
+
+            retry_after = self._retry_after(endpoint, response.headers)
+            logger.warning(f'429 from {endpoint}, attempt {attempt}, resets in {retry_after:.0f}s')
+            if retry_after > self.max_wait or attempt == self.max_attempts:
+                raise RateLimitedError(f'rate limited by {endpoint}', endpoint, retry_after)
+            time.sleep(retry_after)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def budget(self):
+        """
+        Returns the last known rate limit budget of each endpoint.
+
+        Returns:
+        dict: endpoint -> {'limit', 'remaining', 'reset', 'reset_in'}
+        """
+        now = time.time()
+        with self._lock:
+            return {endpoint: dict(limits, reset_in=max(0, round(limits['reset'] - now)))
+                    for endpoint, limits in self.limits.items()}
+
+
+@per_container
+def get_twitter_client():
+    """returns the rate limit aware twitter client, created once per container so budgets carry over"""
+    return TwitterClient()
@@ -0,0 +1,108 @@
+import logging
+from os import environ
+import threading
+from urllib3.util.retry import Retry
+from http_transport import mount_adapter
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Environment variables holding the twitter api credentials
+CREDENTIAL_VARS = ('TWITTER_API_KEY', 'TWITTER_API_SECRET',
+                   'TWITTER_API_ACCESS_TOKEN', 'TWITTER_API_ACCESS_TOKEN_SECRET')
+
+# Connection pool and retry tuning for the session
+POOL_CONNECTIONS = int(environ.get('TWITTER_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(environ.get('TWITTER_POOL_MAXSIZE', 10))
+MAX_RETRIES = int(environ.get('TWITTER_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(environ.get('TWITTER_RETRY_BACKOFF', 0.5))
+
+# The session is kept at module level so it, and its open connections, survive between
+# invocations of a warm lambda container
+_session = None
+_session_credentials = None
+_session_lock = threading.Lock()
+
+
+def get_credentials():
+    """
+    Reads the twitter api credentials from the environment.
+
+    Returns:
+    tuple: (api key, api secret, access token, access token secret)
+    """
+    return tuple(environ.get(name) for name in CREDENTIAL_VARS)
+
+
+def build_oauth_session(credentials, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                        max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+    """
+    Builds an OAuth1Session with a tuned keep-alive connection pool.
+
+    Parameters:
+    credentials (tuple): (api key, api secret, access token, access token secret)
+    pool_connections (int): Number of hosts to keep connection pools for
+    pool_maxsize (int): Maximum number of connections kept open per host
+    max_retries (int): Number of retries for connection errors, and for server errors on idempotent requests
+    backoff (float): Backoff factor between retries
+
+    Returns:
+    OAuth1Session: The session
+    """
+    # imported when the session is first built rather than when a handler module is imported
+    from requests_oauthlib import OAuth1Session
+
+    api_key, api_secret, access_token, access_token_secret = credentials
+    oauth = OAuth1Session(
+        api_key,
+        client_secret=api_secret,
+        resource_owner_key=access_token,
+        resource_owner_secret=access_token_secret,
+    )
+
+    # Only idempotent methods are retried on server errors so a tweet is never posted twice,
+    # connection errors happen before anything is sent so are retried for every method
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        raise_on_status=False,
+    )
+    return mount_adapter(oauth, pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+
+def get_oauth_session():
+    """
+    Returns the shared OAuth1Session, building it on first use and rebuilding it if the credentials
+    in the environment have changed since it was built.
+
+    Returns:
+    OAuth1Session: The shared session
+    """
+    global _session, _session_credentials
+
+    credentials = get_credentials()
+    with _session_lock:
+        if _session is None or credentials != _session_credentials:
+            if _session is not None:
+                logger.info('twitter credentials changed, rebuilding oauth session')
+                _session.close()
+            _session = build_oauth_session(credentials)
+            _session_credentials = credentials
+        return _session
+
+
+def reset_oauth_session():
+    """Closes and discards the shared session, the next call to get_oauth_session builds a new one."""
+    global _session, _session_credentials
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_credentials = None